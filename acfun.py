@@ -1,15 +1,22 @@
 import os
 import re
 import gc
+import sys
 import json
-from typing import Tuple
-from concurrent.futures import ThreadPoolExecutor as Pool
+import argparse
+import itertools
+from typing import Tuple, List, Optional, Iterable, Iterator
 
 import atexit
 import m3u8
+import metrics
 import delay
+import extract
+import engine
+import priority
 import setting
 from url import UrlSet
+from parallel import prefetch, BoundedPool, CompletionTracker, finish_future
 
 
 video_urls = UrlSet(setting.ACFUN_VIDEO_PATH)
@@ -54,60 +61,287 @@ def parse_av_video_page(html: str) -> Tuple[str, dict]:
 
     :return: 视频url 以及 视频信息
     """
-    match_str = m3u8.match(html[html.find('"ksPlayJson"'):], '{', '}').replace(r'\"', '"')
-
-    json_str = json.loads(match_str)
+    json_str = extract.json_value(html, '"ksPlayJson"')
+    # ksPlayJson 的值通常是转义后的 json 字符串
+    if isinstance(json_str, str):
+        json_str = json.loads(json_str)
     return json_str['adaptationSet'][0]['representation'][0]['url'], json_str
 
 
-def download_video(av_id: str):
+def get_av_video(av_id: str) -> Tuple[str, dict]:
+    """
+    请求并解析视频页面
+
+    :param av_id: av 号
+
+    :return: 视频url 以及 视频信息 ksPlayJson
+    """
+    return parse_av_video_page(m3u8.request_text(f'https://www.acfun.cn/v/ac{av_id}'))
+
+
+def av_video_meta(video_datas: dict) -> dict:
+    """
+    从 ksPlayJson 中获取调度信息, 见 priority.TaskQueue
+
+    :return: {'duration': 时长(s), 'size': 按平均码率估算的大小(字节)}, 只包含找到的字段
+    """
+    meta = {}
+    try:
+        adaptation = video_datas['adaptationSet'][0]
+        # ksPlayJson 中的时长单位为毫秒
+        duration = priority.parse_duration(adaptation.get('duration'))
+        if duration is not None:
+            meta['duration'] = duration / 1000
+            bitrate = adaptation['representation'][0].get('avgBitrate')
+            if isinstance(bitrate, (int, float)) and bitrate > 0:
+                meta['size'] = bitrate * 1000 / 8 * meta['duration']
+    except (KeyError, IndexError, TypeError, AttributeError):
+        pass
+
+    return meta
+
+
+def download_video(av_id: str, video: Optional[Tuple[str, dict]] = None):
     """
     根据av号下载视频
 
     :param av_id: av 号
+
+    :param video: 已经解析的 (视频url, 视频信息), 若为 None 则请求视频页面解析
+
+    :return: 视频已经下载过时返回 False
     """
     av_id = str(av_id)
     if av_id in video_urls:
         print(f'{av_id} 视频已经下载')
-        return
+        return False
 
     print(f'开始下载 {av_id} 视频')
-    html = m3u8.request_text(f'https://www.acfun.cn/v/ac{av_id}')
-    video_url, video_datas = parse_av_video_page(html)
+    with metrics.span('video', site='acfun', id=av_id):
+        if video is None:
+            with metrics.span('parse'):
+                video = get_av_video(av_id)
+        video_url, video_datas = video
 
-    m3u8.download_video(video_url, os.path.join(setting.ACFUN_VIDEO_PATH, av_id), _video_info=video_datas, cover=True)
+        m3u8.download_video(video_url, os.path.join(setting.ACFUN_VIDEO_PATH, av_id), _video_info=video_datas,
+                            cover=True)
 
     video_urls.add(av_id)
     delay.random_delay(1, 2)
     print(f'{av_id} 视频下载完成')
+    return True
+
+
+def get_up_page(uid: str, page: int) -> list:
+    """
+    获取 up主 一页视频的 av号
+
+    :param uid: up主的uid
+
+    :param page: 页码, 下标从1开始
+    """
+    return parse_page_with_av(m3u8.request_text(make_up_index_url(uid, page)))
+
+
+def undownloaded_pages(uid: str):
+    """
+    从第1页开始, 跳过已经下载完成的页
+    """
+    for page in itertools.count(1):
+        if f'{uid}-{page}' in video_urls:
+            print(f'uid:{uid} 第{page}页视频已经下载')
+            continue
+        yield page
 
 
-def download_all_videos(uid: str):
+def on_page_complete(key: Tuple[str, int], ok: bool):
+    """
+    一页视频全部下载完成后记录该页
+    """
+    uid, page = key
+    if ok:
+        video_urls.add(f'{uid}-{page}')
+        print(f'uid:{uid} 第{page}页视频下载完成')
+    else:
+        print(f'uid:{uid} 第{page}页有视频下载失败')
+
+
+def on_up_complete(uid: str, ok: bool):
+    """
+    up主的所有视频下载完成后记录该 up主, 重启时直接跳过
+    """
+    if ok:
+        video_urls.add(f'up-{uid}')
+        print(f'uid:{uid} up视频已经下载完成')
+    else:
+        print(f'uid:{uid} 有视频下载失败')
+
+
+def download_all_videos(uid: str, pool: Optional[BoundedPool] = None, up_tracker: Optional[CompletionTracker] = None):
     """
     下载up主的所有视频
+
+    所有页共用一个线程池, 下载当前页时在后台请求后续的页, 一页的视频全部下载成功后才记录该页
+
+    :param uid: up主的uid
+
+    :param pool: 下载线程池, 若为 None 则创建一个 10 线程的线程池, 并等待所有视频下载完成
+
+    :param up_tracker: up主级别的完成跟踪器, 以 uid 为 key, 若为 None 则不跟踪
+    """
+    if pool is None:
+        with BoundedPool(max_workers=10) as pool:
+            return download_all_videos(uid, pool, up_tracker)
+
+    tracker = CompletionTracker(on_page_complete)
+    pages = prefetch(lambda _page: get_up_page(uid, _page), undownloaded_pages(uid), setting.PREFETCH_PAGES,
+                     stop=lambda _av_ids: not _av_ids)
+    for page, av_ids in pages:
+        if not av_ids:  # 已经到达最后一页
+            print(f'uid:{uid} up视频已经全部加入下载队列')
+            break
+
+        print(f'开始下载 uid:{uid} 第{page}页视频')
+        for av_id in av_ids:
+            future = pool.submit(download_video, av_id)
+            tracker.add((uid, page), future)
+            if up_tracker is not None:
+                up_tracker.add(uid, future)
+        tracker.close((uid, page))
+
+
+def read_uids(lines: Iterable[str]) -> Iterator[str]:
+    """
+    逐行读取 uid, 忽略空行与 # 开头的注释
+
+    :param lines: 文件或标准输入
     """
-    page = 0
-    while True:
-        with Pool(max_workers=10) as pool:
-            page += 1
-            if f'{uid}-{page}' in video_urls:
-                print(f'uid:{uid} 第{page}页视频已经下载')
+    for line in lines:
+        uid = line.strip()
+        if uid and not uid.startswith('#'):
+            yield uid
+
+
+def download_up_owners(uids: Iterable[str], max_workers: int = 10, max_up_owners: int = 4):
+    """
+    批量下载多个 up主 的视频
+
+    多个 up主 同时发现视频, 所有视频共用一个下载线程池, 已经全部下载的 up主 直接跳过
+
+    :param uids: up主的uid, 可以是惰性读取的迭代器
+
+    :param max_workers: 全局下载线程数
+
+    :param max_up_owners: 同时发现视频的 up主 数量
+    """
+    up_tracker = CompletionTracker(on_up_complete)
+
+    def crawl(uid: str):
+        try:
+            download_all_videos(uid, download_pool, up_tracker)
+            up_tracker.close(uid)
+        except Exception as e:
+            print(f'uid:{uid} 获取视频列表失败: {e}')
+            up_tracker.close(uid, ok=False)
+
+    with BoundedPool(max_workers=max_workers) as download_pool, \
+            BoundedPool(max_workers=max_up_owners, max_pending=max_up_owners) as up_pool:
+        for uid in uids:
+            if f'up-{uid}' in video_urls:
+                print(f'uid:{uid} up视频已经下载完成')
                 continue
 
-            print(f'开始下载 uid:{uid} 第{page}页视频')
-            url = make_up_index_url(uid, page)
-            html = m3u8.request_text(url)
-            av_ids = parse_page_with_av(html)
+            up_pool.submit(crawl, uid)
+
+        # 等待所有 up主 的视频发现完成后, 才能关闭下载线程池
+        up_pool.shutdown(wait=True)
+
+
+class AcfunSite(engine.Site):
+    name = 'acfun'
+
+    host = 'www.acfun.cn'
+
+    def __init__(self, uids: List[str], fetch_meta: bool = True):
+        """
+        :param uids: up主的uid
+
+        :param fetch_meta: 发现时是否请求视频页面获取时长, 用于按时长调度, fifo 模式不需要
+        """
+        self.uids = uids
+        self.fetch_meta = fetch_meta
+
+    def discover(self):
+        """
+        发现阶段只从视频页面读取时长, 视频地址会过期, 下载时再请求视频页面获取
+
+        与 download_up_owners 相同, 一页视频全部下载成功后记录该页, up主 的所有视频下载成功后记录该 up主
+        """
+        def resolve(av_id: str) -> dict:
+            if not self.fetch_meta:
+                return {}
+            try:
+                return av_video_meta(get_av_video(av_id)[1])
+            except Exception as e:
+                # 获取不到时长时仍然下载, 按时长未知调度
+                print(f'{av_id} 视频页面解析失败: {e}')
+                return {}
 
-            if not av_ids:  # 已经到达最后一页
+        up_tracker = CompletionTracker(on_up_complete)
+        for uid in self.uids:
+            if f'up-{uid}' in video_urls:
                 print(f'uid:{uid} up视频已经下载完成')
-                break
+                continue
 
-            pool.map(download_video, av_ids)
+            tracker = CompletionTracker(on_page_complete)
+            up_ok = True
+            try:
+                pages = prefetch(lambda _page, _uid=uid: get_up_page(_uid, _page), undownloaded_pages(uid),
+                                 setting.PREFETCH_PAGES, stop=lambda _av_ids: not _av_ids)
+                for page, av_ids in pages:
+                    if not av_ids:  # 已经到达最后一页
+                        break
 
-        video_urls.add(f'{uid}-{page}')
+                    av_ids = [av_id for av_id in av_ids if av_id not in video_urls]
+                    for av_id, meta in prefetch(resolve, av_ids, setting.PREFETCH_PAGES):
+                        future = tracker.expect((uid, page))
+                        up_tracker.add(uid, future)
+                        yield av_id, meta, future
+                    tracker.close((uid, page))
+            except Exception as e:
+                print(f'uid:{uid} 获取视频列表失败: {e}')
+                up_ok = False
+            up_tracker.close(uid, ok=up_ok)
+
+    def download(self, task: tuple) -> bool:
+        return download_video(task[0])
+
+    def task_key(self, task: tuple) -> str:
+        return task[0]
+
+    def done(self, task: tuple, ok: bool):
+        finish_future(task[-1], ok)
+
+    def task_meta(self, task: tuple) -> dict:
+        return task[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='下载 acfun up主 的视频')
+    parser.add_argument('uid_file', nargs='?', help='每行一个 uid 的文件, - 表示从标准输入读取, 不传时交互输入一个 uid')
+    parser.add_argument('--workers', type=int, default=10, help='全局下载线程数')
+    parser.add_argument('--up-owners', type=int, default=4, help='同时发现视频的 up主 数量')
+    args = parser.parse_args()
+
+    if args.uid_file is None:
+        download_all_videos(input('请输入up主的uid: '))
+    elif args.uid_file == '-':
+        download_up_owners(read_uids(sys.stdin), args.workers, args.up_owners)
+    else:
+        with open(args.uid_file, 'r', encoding='utf-8') as f:
+            download_up_owners(read_uids(f), args.workers, args.up_owners)
 
 
 if __name__ == '__main__':
     atexit.register(gc.collect)
-    download_all_videos(input('请输入up主的uid: '))
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,138 @@
+import os
+import time
+import resource
+import argparse
+import tempfile
+import multiprocessing
+
+import m3u8
+import setting
+from bench_server import BenchServer
+
+
+def percentile(values: list, p: float) -> float:
+    """
+    线性插值的百分位数
+
+    :param values: 数值列表
+
+    :param p: 百分位, 0 ~ 100
+    """
+    if not values:
+        return 0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    f = int(k)
+    c = min(f + 1, len(values) - 1)
+    return values[f] + (values[c] - values[f]) * (k - f)
+
+
+def make_cases(master_url: str, mp4_url: str, out_dir: str) -> dict:
+    """
+    各个下载路径的测试用例, 每个用例返回写入的字节数
+    """
+    ts_path = os.path.join(out_dir, 'merge.ts')
+    mp4_path = os.path.join(out_dir, 'video.mp4')
+    m3u8_path = os.path.join(out_dir, 'm3u8.mp4')
+
+    def parse():
+        return len(m3u8.parse_m3u8(master_url))
+
+    def merge():
+        m3u8.merge_download_ts_files(m3u8.parse_m3u8(master_url), ts_path, cover=True)
+        return os.path.getsize(ts_path)
+
+    def mp4():
+        m3u8.download_mp4_video(mp4_url, mp4_path, cover=True)
+        return os.path.getsize(mp4_path)
+
+    def m3u8_video():
+        m3u8.download_m3u8_video(master_url, m3u8_path, cover=True)
+        return os.path.getsize(m3u8_path)
+
+    return {
+        'parse_m3u8': parse,
+        'merge_download_ts_files': merge,
+        'download_mp4_video': mp4,
+        'download_m3u8_video': m3u8_video,
+    }
+
+
+def run_case(name: str, master_url: str, mp4_url: str, repeat: int, remux: bool, results: multiprocessing.Queue):
+    """
+    在独立的子进程中运行一个下载路径, 以便单独统计峰值内存
+    """
+    setting.HLS_REMUX = remux
+    latencies, num_bytes, num_failed = [], 0, 0
+    with tempfile.TemporaryDirectory() as out_dir:
+        case = make_cases(master_url, mp4_url, out_dir)[name]
+        for _ in range(repeat):
+            start = time.perf_counter()
+            try:
+                num_bytes += case()
+            except Exception as e:
+                num_failed += 1
+                print(f'{name} 出错: {e!r}')
+            latencies.append(time.perf_counter() - start)
+
+    # linux 下 ru_maxrss 单位为 KB
+    results.put({
+        'throughput': num_bytes / max(sum(latencies), 1e-9) / 1024 ** 2,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'failed': num_failed,
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description='使用本地 HLS / MP4 服务器测试下载路径')
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求的延迟(s)')
+    parser.add_argument('--bandwidth', type=float, default=None, help='每个连接的带宽上限(MB/s)')
+    parser.add_argument('--no-range', action='store_true', help='关闭 Range 请求支持')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='分片与 MP4 请求出错的概率')
+    parser.add_argument('--error-mode', choices=['status', 'truncate'], default='status', help='出错方式')
+    parser.add_argument('--segments', type=int, default=20, help='分片数量')
+    parser.add_argument('--segment-size', type=int, default=512, help='分片大小(KB)')
+    parser.add_argument('--mp4-size', type=int, default=16, help='MP4 大小(MB)')
+    parser.add_argument('--repeat', type=int, default=5, help='每个下载路径的重复次数')
+    parser.add_argument('--cases', nargs='*', default=None, help='只运行指定的下载路径')
+    parser.add_argument('--remux', action='store_true', help='download_m3u8_video 封装为 MP4, 合成的分片无法被 ffmpeg 解析, 会回退为合并')
+    args = parser.parse_args()
+
+    server_kwargs = {
+        'latency': args.latency,
+        'bandwidth': args.bandwidth * 1024 ** 2 if args.bandwidth else None,
+        'range_support': not args.no_range,
+        'error_rate': args.error_rate,
+        'error_mode': args.error_mode,
+        'num_segments': args.segments,
+        'segment_size': args.segment_size * 1024,
+        'mp4_size': args.mp4_size * 1024 ** 2,
+    }
+    names = args.cases or ['parse_m3u8', 'merge_download_ts_files', 'download_mp4_video', 'download_m3u8_video']
+
+    print(f'{"下载路径":<26}{"吞吐(MB/s)":>12}{"p50(s)":>10}{"p99(s)":>10}{"请求p50(s)":>12}{"请求p99(s)":>12}'
+          f'{"失败":>6}{"注入错误":>8}{"峰值内存(MB)":>14}')
+    # 服务器运行在主进程, 下载在 spawn 的子进程中运行, 峰值内存不包含服务器的数据
+    ctx = multiprocessing.get_context('spawn')
+    with BenchServer(**server_kwargs) as server:
+        for name in names:
+            server.request_times.clear()
+            server.num_errors = 0
+
+            results = ctx.Queue()
+            process = ctx.Process(target=run_case, args=(name, server.url('/master.m3u8'), server.url('/video.mp4'),
+                                                         args.repeat, args.remux, results))
+            process.start()
+            r = results.get()
+            process.join()
+
+            r['request_p50'] = percentile(server.request_times, 50)
+            r['request_p99'] = percentile(server.request_times, 99)
+            print(f'{name:<30}{r["throughput"]:>12.2f}{r["p50"]:>10.3f}{r["p99"]:>10.3f}{r["request_p50"]:>12.4f}'
+                  f'{r["request_p99"]:>12.4f}{r["failed"]:>6}{server.num_errors:>8}{r["peak_rss"]:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
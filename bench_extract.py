@@ -0,0 +1,105 @@
+import json
+import random
+import timeit
+
+import extract
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+
+def legacy_match(text: str, pattern_l: str, patter_r: str) -> str:
+    """
+    原 m3u8.match 的逐字符实现, 作为对照
+    """
+    cnt, first = 0, -1
+    for i, c in enumerate(text):
+        if first != -1 and cnt == 0:
+            return text[first: i]
+        elif cnt < 0:
+            raise RuntimeError('无法完成完整匹配, 请检查左右匹配是否配对')
+
+        if c == pattern_l:
+            if first == -1:
+                first = i
+            cnt += 1
+
+        elif c == patter_r:
+            cnt -= 1
+
+    raise RuntimeError('无法完成完整匹配, 请检查左右匹配是否配对')
+
+
+def make_acfun_page(num_representations: int = 500, padding: int = 200_000) -> str:
+    """
+    构造一个类似 acfun 视频页面的 html, ksPlayJson 为转义后的 json 字符串
+    """
+    play_json = {'adaptationSet': [{'representation': [
+        {'url': f'https://example.com/{i}.m3u8', 'qualityLabel': f'{i}p', 'codecs': 'avc1.64001F,mp4a.40.2'}
+        for i in range(num_representations)]}]}
+    video_info = {'title': '测试视频', 'currentVideoInfo': {'ksPlayJson': json.dumps(play_json)}}
+    filler = ''.join(random.choice('abcdefghij <>/="') for _ in range(padding))
+    return f'<html><head>{filler}</head><script>window.videoInfo = {json.dumps(video_info)};</script>{filler}</html>'
+
+
+def make_brtv_page(num_years: int = 2000, padding: int = 200_000) -> str:
+    """
+    构造一个类似 btime 栏目页面的 html
+    """
+    years = [{'listId': f'id{i}', 'year': 2000 + i} for i in range(num_years)]
+    filler = ''.join(random.choice('abcdefghij <>/="') for _ in range(padding))
+    return f'<html>{filler}<script>var data = {{"list": {json.dumps(years)}}}</script>{filler}</html>'
+
+
+def make_ifeng_page(padding: int = 200_000) -> str:
+    """
+    构造一个类似 ifeng 视频页面的 html
+    """
+    filler = '<div class="item"><a href="/c/x">链接</a></div>' * (padding // 40)
+    return (f'<html><head><meta charset="utf-8"><meta name="og:img_video" content="https://example.com/v.mp4">'
+            f'</head><body>{filler}</body></html>')
+
+
+def bench(name: str, func, number: int):
+    seconds = timeit.timeit(func, number=number) / number
+    print(f'{name:<40} {seconds * 1000:10.3f} ms')
+    return seconds
+
+
+def main():
+    random.seed(0)
+    acfun_html = make_acfun_page()
+    brtv_html = make_brtv_page()
+    ifeng_html = make_ifeng_page()
+
+    acfun_old = legacy_match(acfun_html[acfun_html.find('"ksPlayJson"'):], '{', '}').replace(r'\"', '"')
+    assert json.loads(acfun_old) == json.loads(extract.json_value(acfun_html, '"ksPlayJson"'))
+    brtv_old = json.loads(legacy_match(brtv_html[brtv_html.find('"list"'):], '[', ']'))
+    assert brtv_old == extract.json_value(brtv_html, '"list"')
+
+    print('acfun ksPlayJson')
+    old = bench('  m3u8.match (逐字符)', lambda: legacy_match(acfun_html[acfun_html.find('"ksPlayJson"'):], '{', '}'), 20)
+    new = bench('  extract.match_balanced', lambda: extract.match_balanced(acfun_html, '{', '}',
+                                                                         acfun_html.find('"ksPlayJson"')), 20)
+    raw = bench('  extract.json_value', lambda: json.loads(extract.json_value(acfun_html, '"ksPlayJson"')), 20)
+    print(f'  加速 match_balanced {old / new:.1f}x, json_value {old / raw:.1f}x')
+
+    print('brtv list')
+    old = bench('  m3u8.match (逐字符)', lambda: json.loads(legacy_match(brtv_html[brtv_html.find('"list"'):], '[', ']')), 20)
+    raw = bench('  extract.json_value', lambda: extract.json_value(brtv_html, '"list"'), 20)
+    print(f'  加速 {old / raw:.1f}x')
+
+    print('ifeng meta')
+    new = bench('  extract.meta_content', lambda: extract.meta_content(ifeng_html, 'og:img_video'), 20)
+    if BeautifulSoup is not None:
+        old = bench('  BeautifulSoup', lambda: BeautifulSoup(ifeng_html, 'html.parser')
+                    .select_one('meta[name="og:img_video"]').get('content'), 5)
+        print(f'  加速 {old / new:.1f}x')
+    else:
+        print('  未安装 bs4, 跳过 BeautifulSoup 对照')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+import os
+import json
+import time
+import random
+import argparse
+import difflib
+from typing import List
+
+import cv2
+import numpy as np
+import pysrt
+
+import ocr
+from profiler import Profiler
+
+
+WORDS = ['hello', 'world', 'today', 'news', 'weather', 'city', 'music', 'people', 'river', 'market', 'school',
+         'travel', 'game', 'summer', 'winter', 'light', 'train', 'story', 'green', 'ocean']
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+
+def make_cues(duration: float, seed: int = 0) -> List[dict]:
+    """
+    生成随机的字幕时间轴, 每条字幕持续 1.5 ~ 4 秒, 字幕之间间隔 0 ~ 1 秒
+
+    :param duration: 视频时长(s)
+
+    :param seed: 随机种子
+
+    :return: [{'start': 开始时间(s), 'end': 结束时间(s), 'text': 字幕}]
+    """
+    rng = random.Random(seed)
+    cues, t = [], rng.uniform(0, 1)
+    while True:
+        length = rng.uniform(1.5, 4)
+        if t + length > duration:
+            break
+        cues.append({'start': t, 'end': t + length, 'text': ' '.join(rng.choices(WORDS, k=rng.randint(2, 5)))})
+        t += length + rng.uniform(0, 1)
+
+    return cues
+
+
+def put_center_text(frame: np.ndarray, text: str, y: int, scale: float, color=(255, 255, 255)):
+    """
+    在 y 处水平居中绘制带黑色描边的文字
+    """
+    (w, h), _ = cv2.getTextSize(text, FONT, scale, 2)
+    x = (frame.shape[1] - w) // 2
+    cv2.putText(frame, text, (x, y), FONT, scale, (0, 0, 0), 6, cv2.LINE_AA)
+    cv2.putText(frame, text, (x, y), FONT, scale, color, 2, cv2.LINE_AA)
+
+
+def generate_video(video_path: str, duration: float = 60, fps: int = 25, width: int = 1280, height: int = 720,
+                   distractors: bool = True, seed: int = 0) -> List[dict]:
+    """
+    生成带已知字幕的合成视频, 并将字幕真值保存为同名 .json 文件
+
+    字幕绘制在画面下方三分之一处并水平居中, 干扰文字包括左上角常驻台标, 画面中部的移动文字, 以及下方偏左的角标
+
+    :param video_path: 视频保存地址 xxx.mp4
+
+    :param duration: 视频时长(s)
+
+    :param fps: 帧率
+
+    :param width: 宽
+
+    :param height: 高
+
+    :param distractors: 是否添加干扰文字
+
+    :param seed: 随机种子
+
+    :return: 字幕真值
+    """
+    cues = make_cues(duration, seed)
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    if not writer.isOpened():
+        raise cv2.error(f'无法写入视频 {video_path}')
+
+    rng = np.random.default_rng(seed)
+    background = rng.integers(0, 120, size=(height // 8, width // 8, 3), dtype=np.uint8)
+    background = cv2.resize(background, (width, height), interpolation=cv2.INTER_LINEAR)
+
+    cue_index = 0
+    for i in range(int(duration * fps)):
+        t = i / fps
+        # 背景缓慢平移, 模拟画面运动
+        frame = np.roll(background, i * 2, axis=1)
+
+        if distractors:
+            cv2.putText(frame, 'BENCH TV', (30, 60), FONT, 1.2, (0, 200, 255), 3, cv2.LINE_AA)
+            cv2.putText(frame, f'LIVE {int(t) // 60:02d}:{int(t) % 60:02d}', (width - 260, 60), FONT, 1.0,
+                        (255, 255, 255), 2, cv2.LINE_AA)
+            x = width - (i * 6) % (width + 600)
+            cv2.putText(frame, 'breaking story on the market', (x, height // 2), FONT, 1.0, (200, 255, 200), 2,
+                        cv2.LINE_AA)
+            cv2.putText(frame, 'www.bench.tv', (40, height - 120), FONT, 0.8, (180, 180, 180), 2, cv2.LINE_AA)
+
+        while cue_index < len(cues) and cues[cue_index]['end'] <= t:
+            cue_index += 1
+        if cue_index < len(cues) and cues[cue_index]['start'] <= t:
+            put_center_text(frame, cues[cue_index]['text'], height - 60, 1.4)
+
+        writer.write(frame)
+
+    writer.release()
+
+    with open(os.path.splitext(video_path)[0] + '.json', 'w', encoding='utf-8') as f:
+        json.dump(cues, f, ensure_ascii=False, indent=2)
+
+    return cues
+
+
+def normalize(text: str) -> str:
+    return ' '.join(text.lower().split())
+
+
+def evaluate(predicted: List[dict], truth: List[dict], threshold: float = 0.8) -> dict:
+    """
+    字幕级别的准确率与召回率
+
+    预测字幕与真值字幕时间有重叠, 且文本相似度不低于 threshold 时视为匹配
+
+    :param predicted: 预测字幕 [{'start', 'end', 'text'}]
+
+    :param truth: 真值字幕
+
+    :param threshold: 文本相似度阈值
+
+    :return: precision, recall, 预测数量, 真值数量
+    """
+    matched_truth, matched_pred = set(), 0
+    for pred in predicted:
+        for j, cue in enumerate(truth):
+            if pred['start'] < cue['end'] and cue['start'] < pred['end'] and \
+                    difflib.SequenceMatcher(None, normalize(pred['text']), normalize(cue['text'])).ratio() >= threshold:
+                matched_pred += 1
+                matched_truth.add(j)
+                break
+
+    return {
+        'precision': matched_pred / len(predicted) if predicted else 0,
+        'recall': len(matched_truth) / len(truth) if truth else 0,
+        'num_predicted': len(predicted),
+        'num_truth': len(truth),
+    }
+
+
+def merge_boxes(boxes: List[ocr.SubTitleBox]) -> List[dict]:
+    """
+    将 VideoOCR.ocr 的原始识别框按文本合并为连续的字幕
+    """
+    cues, last = [], {}
+    for box in boxes:
+        start, end = box.start_time.ordinal / 1000, box.end_time.ordinal / 1000
+        cue = last.get(box.text)
+        if cue is not None and start <= cue['end']:
+            cue['end'] = end
+        else:
+            cue = {'start': start, 'end': end, 'text': box.text}
+            cues.append(cue)
+            last[box.text] = cue
+
+    return cues
+
+
+class CountingOCR:
+    """
+    统计 ocr.image_ocr 的调用次数与耗时
+    """
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0
+        self.image_ocr = ocr.image_ocr
+
+    def __call__(self, img, profiler=None):
+        start = time.perf_counter()
+        try:
+            return self.image_ocr(img, profiler)
+        finally:
+            self.calls += 1
+            self.seconds += time.perf_counter() - start
+
+    def __enter__(self):
+        ocr.image_ocr = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        ocr.image_ocr = self.image_ocr
+
+
+def run_mode(video_path: str, mode: str, skip_frames: int, eps: float, profiler: Profiler = None) -> List[dict]:
+    """
+    运行一种 OCR 模式, 返回预测的字幕
+
+    :param mode: raw 为 VideoOCR.ocr 的全部识别结果, filtered 为 subtitle_ocr 过滤后的字幕
+    """
+    if mode == 'raw':
+        with ocr.VideoOCR(video_path, profiler) as video:
+            return merge_boxes(video.ocr(skip_frames))
+
+    srt_path = os.path.splitext(video_path)[0] + f'.{skip_frames}.srt'
+    ocr.subtitle_ocr(video_path, srt_path, skip_frames=skip_frames, eps=eps, profiler=profiler)
+    return [{'start': item.start.ordinal / 1000, 'end': item.end.ordinal / 1000, 'text': item.text}
+            for item in pysrt.open(srt_path, encoding='utf-8')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='使用合成字幕视频测试 OCR 的速度与准确率')
+    parser.add_argument('--out', default='bench_ocr_data', help='合成视频的保存文件夹')
+    parser.add_argument('--duration', type=float, default=60, help='视频时长(s)')
+    parser.add_argument('--fps', type=int, default=25, help='帧率')
+    parser.add_argument('--no-distractors', action='store_true', help='不添加干扰文字')
+    parser.add_argument('--skip-frames', type=int, nargs='*', default=[5, 10, 25], help='测试的采样间隔')
+    parser.add_argument('--modes', nargs='*', default=['raw', 'filtered'], help='测试的 OCR 模式: raw, filtered')
+    parser.add_argument('--eps', type=float, default=10, help='subtitle_ocr 的居中误差')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--profile', action='store_true', help='打印每种模式各阶段的耗时')
+    parser.add_argument('--trace', action='store_true', help='保存每种模式的 Chrome trace json, 需要 --profile')
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    video_path = os.path.join(args.out, f'synthetic_{args.seed}.mp4')
+    truth_path = os.path.splitext(video_path)[0] + '.json'
+    if os.path.exists(video_path) and os.path.exists(truth_path):
+        with open(truth_path, 'r', encoding='utf-8') as f:
+            truth = json.load(f)
+    else:
+        print(f'生成合成视频 {video_path}')
+        truth = generate_video(video_path, args.duration, args.fps, distractors=not args.no_distractors,
+                               seed=args.seed)
+
+    num_frames = int(args.duration * args.fps)
+    print(f'{"模式":<10}{"采样间隔":>8}{"帧/s":>10}{"OCR调用/分钟":>14}{"OCR耗时占比":>12}{"准确率":>8}{"召回率":>8}')
+    for mode in args.modes:
+        for skip_frames in args.skip_frames:
+            profiler = Profiler(trace=args.trace) if args.profile else None
+            with CountingOCR() as counter:
+                start = time.perf_counter()
+                predicted = run_mode(video_path, mode, skip_frames, args.eps, profiler)
+                elapsed = time.perf_counter() - start
+
+            result = evaluate(predicted, truth)
+            print(f'{mode:<12}{skip_frames:>10}{num_frames / elapsed:>10.1f}'
+                  f'{counter.calls / (args.duration / 60):>16.1f}{counter.seconds / elapsed:>14.1%}'
+                  f'{result["precision"]:>10.2f}{result["recall"]:>10.2f}')
+            if profiler is not None:
+                print(profiler.summary())
+                if args.trace:
+                    trace_path = os.path.join(args.out, f'trace_{mode}_{skip_frames}.json')
+                    profiler.write_chrome_trace(trace_path)
+                    print(f'Chrome trace 已保存到 {trace_path}')
+
+
+if __name__ == '__main__':
+    main()
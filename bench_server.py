@@ -0,0 +1,191 @@
+import re
+import time
+import random
+import struct
+import threading
+from typing import Optional
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from m3u8 import TS_PACKET_SIZE, TS_SYNC_BYTE
+
+
+def make_ts_segment(index: int, size: int) -> bytes:
+    """
+    构造一个合成的 TS 分片, 每 188 字节以 0x47 开头, 大小向下取整到 188 的整数倍
+
+    :param index: 分片序号, 用于区分分片内容
+
+    :param size: 分片大小(字节)
+    """
+    payload = bytes((index + i) % 256 for i in range(TS_PACKET_SIZE - 1))
+    packet = bytes([TS_SYNC_BYTE]) + payload
+    return packet * max(1, size // TS_PACKET_SIZE)
+
+
+def make_mp4(size: int) -> bytes:
+    """
+    构造一个合成的 MP4 文件, 包含 ftyp, moov, mdat 三个顶层 box, 可以通过 verify.check_mp4_boxes
+
+    :param size: 文件大小(字节)
+    """
+    ftyp = struct.pack('>I4s4sI8s', 24, b'ftyp', b'isom', 0x200, b'isomiso2')
+    moov = struct.pack('>I4s', 16, b'moov') + b'\x00' * 8
+    mdat_size = max(8, size - len(ftyp) - len(moov))
+    mdat = struct.pack('>I4s', mdat_size, b'mdat') + bytes(i % 251 for i in range(mdat_size - 8))
+    return ftyp + moov + mdat
+
+
+class BenchServer:
+    def __init__(self, latency: float = 0.0, bandwidth: Optional[float] = None, range_support: bool = True,
+                 error_rate: float = 0.0, error_mode: str = 'status', num_segments: int = 20,
+                 segment_size: int = 512 * 1024, mp4_size: int = 16 * 1024 * 1024, seed: int = 0):
+        """
+        本地 HLS / MP4 测试服务器
+
+        提供 /master.m3u8, /media.m3u8, /seg/{i}.ts, /video.mp4
+
+        :param latency: 每个请求返回响应头前的延迟, 单位(s)
+
+        :param bandwidth: 每个连接的带宽上限, 单位(字节/s), 为 None 时不限速
+
+        :param range_support: 是否支持 Range 请求
+
+        :param error_rate: 分片与 MP4 请求出错的概率
+
+        :param error_mode: 出错方式, status 返回 500, truncate 只返回一半的内容
+
+        :param num_segments: 媒体播放列表中的分片数量
+
+        :param segment_size: 每个分片的大小(字节)
+
+        :param mp4_size: MP4 文件的大小(字节)
+
+        :param seed: 错误注入的随机种子
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.range_support = range_support
+        self.error_rate = error_rate
+        self.error_mode = error_mode
+        self.num_segments = num_segments
+        self.segments = [make_ts_segment(i, segment_size) for i in range(num_segments)]
+        self.mp4 = make_mp4(mp4_size)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        # 每个请求的处理耗时, 单位(s)
+        self.request_times = []
+        self.num_errors = 0
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, path: str) -> str:
+        return f'http://127.0.0.1:{self.httpd.server_address[1]}{path}'
+
+    def start(self) -> 'BenchServer':
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def master_playlist(self) -> bytes:
+        return ('#EXTM3U\n'
+                '#EXT-X-STREAM-INF:BANDWIDTH=1280000,RESOLUTION=1280x720\n'
+                'media.m3u8\n').encode()
+
+    def media_playlist(self) -> bytes:
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:4', '#EXT-X-MEDIA-SEQUENCE:0']
+        for i in range(self.num_segments):
+            lines += ['#EXTINF:4.000,', f'seg/{i}.ts']
+        lines.append('#EXT-X-ENDLIST')
+        return ('\n'.join(lines) + '\n').encode()
+
+    def _inject_error(self) -> Optional[str]:
+        with self.lock:
+            if self.error_rate > 0 and self.random.random() < self.error_rate:
+                self.num_errors += 1
+                return self.error_mode
+        return None
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                start = time.perf_counter()
+                try:
+                    self._handle()
+                finally:
+                    with server.lock:
+                        server.request_times.append(time.perf_counter() - start)
+
+            def _handle(self):
+                if server.latency > 0:
+                    time.sleep(server.latency)
+
+                m = re.fullmatch(r'/seg/(\d+)\.ts', self.path)
+                if self.path == '/master.m3u8':
+                    return self._send(server.master_playlist(), 'application/vnd.apple.mpegurl')
+                elif self.path == '/media.m3u8':
+                    return self._send(server.media_playlist(), 'application/vnd.apple.mpegurl')
+                elif m and int(m.group(1)) < server.num_segments:
+                    return self._send(server.segments[int(m.group(1))], 'video/mp2t', inject=True)
+                elif self.path == '/video.mp4':
+                    return self._send(server.mp4, 'video/mp4', inject=True)
+
+                self.send_error(404)
+
+            def _send(self, body: bytes, content_type: str, inject: bool = False):
+                error = server._inject_error() if inject else None
+                if error == 'status':
+                    self.send_error(500)
+                    return
+
+                status, start, end = 200, 0, len(body)
+                range_header = self.headers.get('Range')
+                if server.range_support and range_header:
+                    m = re.fullmatch(r'bytes=(\d*)-(\d*)', range_header.strip())
+                    if m:
+                        start = int(m.group(1)) if m.group(1) else max(0, len(body) - int(m.group(2)))
+                        end = int(m.group(2)) + 1 if m.group(1) and m.group(2) else len(body)
+                        status = 206
+
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(end - start))
+                if server.range_support:
+                    self.send_header('Accept-Ranges', 'bytes')
+                if status == 206:
+                    self.send_header('Content-Range', f'bytes {start}-{end - 1}/{len(body)}')
+                self.end_headers()
+
+                # 截断错误: 声明完整长度, 只发送一半后关闭连接
+                if error == 'truncate':
+                    end = start + (end - start) // 2
+                    self.close_connection = True
+
+                self._write(memoryview(body)[start: end])
+
+            def _write(self, data: memoryview):
+                chunk_size = 64 * 1024
+                for i in range(0, len(data), chunk_size):
+                    chunk = data[i: i + chunk_size]
+                    self.wfile.write(chunk)
+                    if server.bandwidth:
+                        time.sleep(len(chunk) / server.bandwidth)
+
+        return Handler
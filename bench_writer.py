@@ -0,0 +1,110 @@
+import os
+import re
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import m3u8
+from bench_download import percentile
+
+
+def legacy_write(save_path: str, size: int, chunk: bytes):
+    """
+    原来的写入方式, open(save_path, 'wb') 后逐块写入
+    """
+    with open(save_path, 'wb') as f:
+        for _ in range(size // len(chunk)):
+            f.write(chunk)
+
+
+def make_writer(fsync: str, preallocate: bool, buffer_size: int):
+    """
+    使用 m3u8.VideoWriter 写入
+    """
+    def write(save_path: str, size: int, chunk: bytes):
+        with m3u8.VideoWriter(save_path, size if preallocate else None, buffer_size, fsync) as f:
+            for _ in range(size // len(chunk)):
+                f.write(chunk)
+
+    return write
+
+
+def count_extents(path: str) -> int:
+    """
+    使用 filefrag 统计文件的 extent 数量, filefrag 不可用时返回 -1
+    """
+    if shutil.which('filefrag') is None:
+        return -1
+
+    ret = subprocess.run(['filefrag', path], capture_output=True, text=True)
+    m = re.search(r'(\d+) extents? found', ret.stdout)
+    return int(m.group(1)) if m else -1
+
+
+def run_case(write, out_dir: str, writers: int, size: int, chunk: bytes) -> dict:
+    """
+    writers 个线程同时各写入一个 size 大小的文件
+    """
+    paths = [os.path.join(out_dir, f'video_{i}.mp4') for i in range(writers)]
+    latencies = []
+
+    def job(path):
+        start = time.perf_counter()
+        write(path, size, chunk)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=writers) as pool:
+        list(pool.map(job, paths))
+    elapsed = time.perf_counter() - start
+
+    extents = [count_extents(path) for path in paths]
+    for path in paths:
+        os.remove(path)
+
+    return {
+        'throughput': writers * size / elapsed / 1024 ** 2,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'extents': sum(extents) / len(extents) if min(extents) >= 0 else -1,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='测试多个下载同时写入时的磁盘吞吐')
+    parser.add_argument('--dir', default=None, help='写入的文件夹, 应与视频文件夹在同一磁盘, 默认为临时文件夹')
+    parser.add_argument('--writers', type=int, default=12, help='同时写入的文件数')
+    parser.add_argument('--size', type=int, default=128, help='每个文件的大小(MB)')
+    parser.add_argument('--chunk', type=int, default=16, help='每次写入的大小(KB)')
+    parser.add_argument('--buffer', type=int, default=4, help='VideoWriter 的缓冲区大小(MB)')
+    parser.add_argument('--repeat', type=int, default=3, help='每种写入方式的重复次数')
+    args = parser.parse_args()
+
+    size = args.size * 1024 ** 2
+    chunk = os.urandom(args.chunk * 1024)
+    buffer_size = args.buffer * 1024 ** 2
+    cases = {
+        'legacy': legacy_write,
+        'writer': make_writer('never', False, buffer_size),
+        'writer+fallocate': make_writer('never', True, buffer_size),
+        'writer+fallocate+close': make_writer('close', True, buffer_size),
+        'writer+fallocate+always': make_writer('always', True, buffer_size),
+    }
+
+    print(f'{args.writers} 个文件同时写入, 每个 {args.size}MB, 每次写入 {args.chunk}KB')
+    print(f'{"写入方式":<28}{"吞吐(MB/s)":>12}{"p50(s)":>10}{"p99(s)":>10}{"extent":>10}')
+    out_dir = tempfile.mkdtemp(dir=args.dir)
+    try:
+        for name, write in cases.items():
+            results = [run_case(write, out_dir, args.writers, size, chunk) for _ in range(args.repeat)]
+            r = {k: sum(result[k] for result in results) / len(results) for k in results[0]}
+            print(f'{name:<32}{r["throughput"]:>12.1f}{r["p50"]:>10.3f}{r["p99"]:>10.3f}{r["extents"]:>10.1f}')
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
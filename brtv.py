@@ -2,18 +2,26 @@ import os
 import re
 import gc
 import json
+import queue
 import atexit
-from typing import List
+from typing import List, Iterator, Tuple, Optional
 from concurrent.futures import ThreadPoolExecutor as Pool
 
 import m3u8
+import metrics
+import engine
+import extract
 import setting
 import delay
 from url import UrlSet
+from parallel import imap_unordered, BoundedPool, CompletionTracker, finish_future
 
 
 video_urls = UrlSet(setting.BRTV_VIDEO_PATH)
 
+# 同时发现节目的栏目数, 以及每个栏目同时请求的年份数
+DISCOVER_WORKERS = 4
+
 
 def make_callback() -> str:
     """
@@ -50,17 +58,20 @@ def download_br_tv_video(gid: str):
     """
     if gid in video_urls:
         print(f'视频 {gid} 已下载')
-        return
+        return False
 
     print(f'开始下载 视频 {gid}')
-    api_url = make_br_tv_api(gid)
-    data = parse_br_tv_api_response(m3u8.request_text(api_url))
+    with metrics.span('video', site='brtv', id=gid):
+        with metrics.span('parse'):
+            api_url = make_br_tv_api(gid)
+            data = parse_br_tv_api_response(m3u8.request_text(api_url))
+            video_url = data['data']['video_stream'][0]['stream_url']
 
-    video_url = data['data']['video_stream'][0]['stream_url']
-    m3u8.download_video(video_url, os.path.join(setting.BRTV_VIDEO_PATH, gid), _video_info=data, cover=True)
+        m3u8.download_video(video_url, os.path.join(setting.BRTV_VIDEO_PATH, gid), _video_info=data, cover=True)
     video_urls.add(gid)
     delay.random_delay(1, 3)
     print(f'视频 {gid} 下载完成')
+    return True
 
 
 def get_programme_id(guide_name: str) -> List[str]:
@@ -74,33 +85,86 @@ def get_programme_id(guide_name: str) -> List[str]:
     url = f'https://www.btime.com/btv/{guide_name}'
     html = m3u8.request_text(url)
 
-    years = json.loads(m3u8.match(html[html.find('"list"'):], '[', ']'))
+    years = extract.json_value(html, '"list"')
 
     return [year['listId'] for year in years]
 
 
+def get_year_programs(program_id: str) -> List[str]:
+    """
+    获取 北京卫视 一个栏目某一年的节目表gid
+
+    :param program_id: 栏目一个年份的id, 由 get_programme_id 获取
+
+    :return: 该年份每期节目的 gid
+    """
+    url = (f'https://pc.api.btime.com/btimeweb/infoFlow?'
+           f'callback={make_callback()}'
+           f'&list_id={program_id}'
+           f'&refresh=1'
+           f'&count=1000'
+           f'&expands=pageinfo'
+           f'&_={delay.get_time(13)}')
+
+    res = m3u8.request_text(url)
+    res = res[res.find('(') + 1: -1]
+    return [program['gid'] for program in json.loads(res)['data']['list']]
+
+
 def get_guide_programs(guide_name: str):
     """
     获取 北京卫视 一个栏目的节目表gid
 
-    即一个栏目每一期节目的gid
+    即一个栏目每一期节目的gid, 各年份并发请求, 按请求完成的顺序返回
+
+    某个年份请求失败时, 先返回其余年份的节目, 最后抛出 RuntimeError
 
     :return: 所有年份每期节目的 gid
     """
-    for program_id in get_programme_id(guide_name):
-        url = (f'https://pc.api.btime.com/btimeweb/infoFlow?'
-               f'callback={make_callback()}'
-               f'&list_id={program_id}'
-               f'&refresh=1'
-               f'&count=1000'
-               f'&expands=pageinfo'
-               f'&_={delay.get_time(13)}')
+    failed = []
+    for program_id, future in imap_unordered(get_year_programs, get_programme_id(guide_name), DISCOVER_WORKERS):
+        try:
+            yield from future.result()
+        except Exception as e:
+            print(f'获取 栏目 {guide_name} 年份 {program_id} 的节目失败: {e}')
+            failed.append(program_id)
+
+    if failed:
+        raise RuntimeError(f'栏目 {guide_name} 有 {len(failed)} 个年份获取失败')
+
+
+def iter_guides_programs(guide_names: List[str]) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    并发获取多个栏目的节目表gid, 节目一被发现就返回
+
+    :param guide_names: 栏目名称
 
-        res = m3u8.request_text(url)
-        res = res[res.find('(') + 1: -1]
-        data = json.loads(res)['data']['list']
-        for program in data:
-            yield program['gid']
+    :return: (栏目名称, gid) 的迭代器, 一个栏目发现完成时返回 (栏目名称, None), 发现失败时返回 (栏目名称, False)
+    """
+    # 不限制队列长度, 避免消费者提前退出时发现线程阻塞
+    programs = queue.Queue()
+
+    def discover(guide_name: str):
+        end = None
+        try:
+            for gid in get_guide_programs(guide_name):
+                programs.put((guide_name, gid))
+        except Exception as e:
+            print(f'获取 栏目 {guide_name} 的节目失败: {e}')
+            end = False
+        finally:
+            programs.put((guide_name, end))
+
+    with Pool(max_workers=DISCOVER_WORKERS) as pool:
+        for guide_name in guide_names:
+            pool.submit(discover, guide_name)
+
+        remaining = len(guide_names)
+        while remaining:
+            guide_name, gid = programs.get()
+            if gid is None or gid is False:
+                remaining -= 1
+            yield guide_name, gid
 
 
 def get_all_btv_guides() -> list:
@@ -114,27 +178,65 @@ def get_all_btv_guides() -> list:
     return re.findall(pattern, html)
 
 
-def download_guide(guide_name: str):
+def on_guide_complete(guide_name: str, ok: bool):
     """
-    下载 北京卫视 guide_name 栏目下的所有节目
-
-    :param guide_name: 栏目名称
+    一个栏目的节目全部下载成功后记录该栏目
     """
-    if guide_name in video_urls:
-        print(f'栏目 {guide_name} 的所有节目已下载')
-        return
+    if ok:
+        video_urls.add(guide_name)
+        print(f'栏目 {guide_name} 的所有节目下载完成')
+    else:
+        print(f'栏目 {guide_name} 有节目下载失败')
+
 
-    print(f'开始下载 栏目 {guide_name} 的所有节目')
+class BrtvSite(engine.Site):
+    name = 'brtv'
 
-    with Pool(max_workers=4) as pool:
-        pool.map(download_br_tv_video, get_guide_programs(guide_name))
+    host = 'btime.com'
 
-    video_urls.add(guide_name)
+    def discover(self):
+        """
+        与 main 相同, 一个栏目的节目全部下载成功后记录该栏目
+        """
+        guide_names = [guide_name for guide_name in get_all_btv_guides() if guide_name not in video_urls]
+        tracker = CompletionTracker(on_guide_complete)
+        for guide_name, gid in iter_guides_programs(guide_names):
+            if gid is None or gid is False:
+                tracker.close(guide_name, ok=gid is None)
+            elif gid not in video_urls:
+                yield gid, tracker.expect(guide_name)
+
+    def download(self, task: tuple) -> bool:
+        return download_br_tv_video(task[0])
+
+    def task_key(self, task: tuple) -> str:
+        return task[0]
+
+    def done(self, task: tuple, ok: bool):
+        finish_future(task[1], ok)
 
 
 def main():
+    """
+    下载 北京卫视 所有栏目的节目
+
+    栏目, 年份, 节目的发现并发进行, 发现的节目立即交给下载线程池, 一个栏目的节目全部下载成功后记录该栏目
+    """
+    guide_names = []
     for guide_name in get_all_btv_guides():
-        download_guide(guide_name)
+        if guide_name in video_urls:
+            print(f'栏目 {guide_name} 的所有节目已下载')
+        else:
+            guide_names.append(guide_name)
+
+    # 节目发现快于下载, 使用有界线程池, 等待下载的节目达到上限时暂停发现
+    tracker = CompletionTracker(on_guide_complete)
+    with BoundedPool(max_workers=4) as pool:
+        for guide_name, gid in iter_guides_programs(guide_names):
+            if gid is None or gid is False:
+                tracker.close(guide_name, ok=gid is None)
+            else:
+                tracker.add(guide_name, pool.submit(download_br_tv_video, gid))
 
 
 if __name__ == '__main__':
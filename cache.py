@@ -0,0 +1,147 @@
+import re
+import time
+import sqlite3
+import threading
+from typing import Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import requests
+
+import metrics
+import setting
+
+
+class HttpCache:
+    def __init__(self, db_path: str):
+        """
+        基于 sqlite 的 http 响应缓存
+
+        缓存未过期时直接返回缓存内容, 过期后带 If-None-Match / If-Modified-Since 发送条件请求, 304 时继续使用缓存
+
+        :param db_path: 缓存数据库地址
+        """
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS responses ('
+                              'key TEXT PRIMARY KEY, '
+                              'etag TEXT, '
+                              'last_modified TEXT, '
+                              'body TEXT, '
+                              'fetched_at REAL)')
+            self.conn.commit()
+
+    def get(self, key: str) -> Optional[Tuple[str, str, str, float]]:
+        """
+        :return: etag, last_modified, body, fetched_at, 不存在时返回 None
+        """
+        with self.lock:
+            return self.conn.execute('SELECT etag, last_modified, body, fetched_at FROM responses WHERE key = ?',
+                                     (key, )).fetchone()
+
+    def put(self, key: str, etag: Optional[str], last_modified: Optional[str], body: str):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                              (key, etag, last_modified, body, time.time()))
+            self.conn.commit()
+
+    def touch(self, key: str):
+        """
+        条件请求返回 304 时, 刷新缓存时间
+        """
+        with self.lock:
+            self.conn.execute('UPDATE responses SET fetched_at = ? WHERE key = ?', (time.time(), key))
+            self.conn.commit()
+
+    def request_text(self, url: str, headers: dict, ttl: float, **kwargs) -> str:
+        """
+        带缓存地请求文本
+
+        :param url: 请求的 url
+
+        :param headers: 请求头
+
+        :param ttl: 缓存有效期, 单位(s), 过期后发送条件请求
+
+        :param kwargs: requests.get 的其他参数
+
+        :return: 响应文本, 请求失败时返回空字符串
+        """
+        key = cache_key(url)
+        host = urlsplit(url).netloc
+        entry = self.get(key)
+        if entry is not None and time.time() - entry[3] < ttl:
+            metrics.inc('http_cache_hits_total', host=host)
+            return entry[2]
+
+        headers = dict(headers)
+        if entry is not None:
+            etag, last_modified, _, _ = entry
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        response = requests.get(url, headers=headers, **kwargs)
+        metrics.inc('http_requests_total', host=host)
+        metrics.observe('http_ttfb_seconds', response.elapsed.total_seconds(), host=host)
+        if response.status_code == 304 and entry is not None:
+            metrics.inc('http_cache_revalidated_total', host=host)
+            self.touch(key)
+            return entry[2]
+
+        try:
+            response.raise_for_status()
+        except requests.exceptions.HTTPError:
+            metrics.inc('http_errors_total', host=host)
+            print(f'请求 {url} 失败')
+            return ''
+
+        text = response.text
+        self.put(key, response.headers.get('ETag'), response.headers.get('Last-Modified'), text)
+        return text
+
+
+def cache_key(url: str) -> str:
+    """
+    缓存的 key, 去掉时间戳, 回调名等每次请求都会变化的参数
+    """
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if k not in setting.HTTP_CACHE_IGNORE_PARAMS]
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(sorted(query)), ''))
+
+
+_RULES = [(re.compile(pattern), ttl) for pattern, ttl in setting.HTTP_CACHE_RULES]
+
+
+def cache_ttl(url: str) -> Optional[float]:
+    """
+    根据 setting.HTTP_CACHE_RULES 获取 url 的缓存有效期
+
+    :return: 缓存有效期, 不缓存时返回 None, 有效期不大于 0 的规则不缓存
+    """
+    if not setting.HTTP_CACHE_ENABLED:
+        return None
+
+    for pattern, ttl in _RULES:
+        if pattern.match(url):
+            # 有效期为 0 时缓存只能省去 304 的响应体, 却要保存每个页面的完整内容, 不如直接请求
+            return ttl if ttl > 0 else None
+
+    return None
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> HttpCache:
+    """
+    :return: 全局共享的 HttpCache, 第一次调用时创建
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = HttpCache(setting.HTTP_CACHE_PATH)
+        return _cache
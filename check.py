@@ -1,16 +1,69 @@
 import os
+import re
+import time
 import shutil
-from typing import List, Union, Tuple, Optional
+from collections import deque
+from typing import List, Union, Tuple, Optional, Iterable, Iterator
 
 from tqdm import tqdm
 
 import ocr
 import m3u8
+import verify
+import transcode
+from parallel import imap_ordered
+import url
+import setting
+import metastore
+import video_index
 from url import UrlSet
+from video_index import VideoIndex
 
 
 ROOT = os.path.dirname(os.path.abspath(__file__))
 
+# 保存的历史命令数量
+HISTORY_MAX_RETURNS = 100
+
+# 每条历史命令最多保存的返回元素数量
+HISTORY_MAX_ITEMS = 10000
+
+# compact prune 时, 视频文件夹中的下载记录 -> 对应的子文件夹名, 未列出的文件夹记录即为子文件夹名
+# ifeng 记录完整的视频页面 url, 子文件夹名为 url 的最后一段, 见 ifeng.download_ifeng_video
+PRUNE_DIR_NAMES = {
+    os.path.abspath(setting.IFENG_VIDEO_PATH): lambda key: key.split('/')[-1],
+}
+
+
+def as_iter(value) -> Iterator:
+    """
+    将命令的输入转化为迭代器, 字符串视为单个元素, None 视为空
+    """
+    if value is None:
+        return iter(())
+    if isinstance(value, str):
+        return iter([value])
+    return iter(value)
+
+
+# 视频文件夹下的记录文件, 不是下载的视频, 使用索引统计时不计入
+BOOKKEEPING_FILE_NAMES = {
+    video_index.INDEX_FILE_NAME,
+    video_index.INDEX_FILE_NAME + '-journal',
+    metastore.METADATA_FILE_NAME,
+    url.TAIL_FILE_NAME,
+    url.SNAPSHOT_FILE_NAME,
+    url.GZIP_SNAPSHOT_FILE_NAME,
+}
+
+
+def _top_level_files(dir_path: str) -> List[str]:
+    """
+    文件夹下直接存放的文件, 索引只统计子文件夹, 这些文件需要单独统计, 索引与下载记录等记录文件除外
+    """
+    with os.scandir(dir_path) as it:
+        return [entry.path for entry in it if not entry.is_dir() and entry.name not in BOOKKEEPING_FILE_NAMES]
+
 
 class Command:
     name = 'Command'
@@ -39,12 +92,18 @@ class CheckDuration(Command):
 
     help_doc = ('检查文件夹包含视频的总时长: 单位(h)\n'
                 '传入一个视频文件或文件夹地址, 程序会自动检查该文件夹下所有视频文件的总时长\n'
+                '若文件夹已建立索引, 则直接从索引中读取, 读取前不会更新索引, 需要最新结果时先执行 index\n'
                 '返回视频时间 float\n')
 
     def __call__(self, path: str, root=True, *args, **kwargs) -> float:
         video_duration = 0
 
-        if os.path.isdir(path):
+        index = VideoIndex.lookup(path) if root else None
+        if index is not None:
+            with index:
+                video_duration = index.duration() / 3600
+            video_duration += sum(self(file, root=False) for file in _top_level_files(path))
+        elif os.path.isdir(path):
             for sub_path in os.listdir(path):
                 sub_path = os.path.join(path, sub_path)
                 video_duration += self(sub_path, root=False)
@@ -62,11 +121,16 @@ class CheckDFSNumFiles(Command):
 
     cmd = 'dfs_num_files'
 
-    help_doc = '递归检查一个文件夹下的文件数量'
+    help_doc = '递归检查一个文件夹下的文件数量, 若文件夹已建立索引, 则直接从索引中读取 (不包含记录文件, 需要最新结果时先执行 index)'
 
     def __call__(self, path: str = None, root=True, *args, **kwargs) -> int:
         num_files = 0
-        if os.path.isdir(path):
+        index = VideoIndex.lookup(path) if root else None
+        if index is not None:
+            with index:
+                num_files = index.num_files()
+            num_files += len(_top_level_files(path))
+        elif os.path.isdir(path):
             for sub_path in os.listdir(path):
                 num_files += self(os.path.join(path, sub_path), root=False)
         else:
@@ -100,11 +164,19 @@ class CheckSize(Command):
 
     cmd = 'size'
 
-    help_doc = '检查文件或文件夹大小, 并计算文件数量'
+    help_doc = '检查文件或文件夹大小, 并计算文件数量, 若文件夹已建立索引, 则直接从索引中读取 (不包含记录文件, 需要最新结果时先执行 index)'
 
     def __call__(self, path: str, root=True, *args, **kwargs) -> Tuple[float, int]:
         size, cnt = 0, 0
-        if os.path.isdir(path):
+        index = VideoIndex.lookup(path) if root else None
+        if index is not None:
+            with index:
+                size, cnt = index.size()
+                size /= 1024 ** 3
+            for file in _top_level_files(path):
+                size += os.path.getsize(file) / (1024 ** 3)
+                cnt += 1
+        elif os.path.isdir(path):
             for sub_path in os.listdir(path):
                 _size, _cnt = self(os.path.join(path, sub_path), root=False)
                 size += _size
@@ -124,10 +196,12 @@ class CheckLs(Command):
 
     cmd = 'ls'
 
-    help_doc = '列出文件夹下的文件'
+    help_doc = '列出文件夹下的文件, 逐个返回'
 
-    def __call__(self, path: str, root=True, *args, **kwargs) -> List[str]:
-        return [os.path.join(path, sub_path) for sub_path in os.listdir(path)]
+    def __call__(self, path: str, root=True, *args, **kwargs) -> Iterator[str]:
+        with os.scandir(path) as it:
+            for entry in it:
+                yield entry.path
 
 
 class CheckVideoIsError(Command):
@@ -135,15 +209,25 @@ class CheckVideoIsError(Command):
 
     cmd = 'is_error'
 
-    help_doc = '检查video.mp4 是否损坏'
-
-    def __call__(self, video_paths: Union[str, List[str]], root=True, *args, **kwargs) -> List[str]:
-
-        if isinstance(video_paths, str):
-            video_paths = [video_paths]
+    help_doc = ('并发检查video.mp4 是否损坏, 逐个返回损坏的视频\n'
+                '用法: is_error [并发数] [模式], 两个参数顺序任意, 如 is_error fast, is_error 8 deep\n'
+                '模式: fast 只检查 MP4 box 结构或 TS 同步字节, probe 使用 ffmpeg.probe (默认), deep 解码整个视频流\n')
+
+    def __call__(self, video_paths: Union[str, Iterable[str]], *options, workers=None, root=True,
+                 **kwargs) -> Iterator[str]:
+        mode = 'probe'
+        for option in options:
+            if option.isdigit():
+                workers = int(option)
+            elif option in verify.MODES:
+                mode = option
+            else:
+                raise ValueError(f'未知的参数 {option}, 应为并发数或 {verify.MODES} 之一')
 
-        broken_videos = [video_path for video_path in video_paths if not m3u8.video_is_ok(video_path)]
-        return broken_videos
+        for i, (video_path, ok) in enumerate(verify.iter_check_videos(as_iter(video_paths), mode, workers)):
+            if not ok:
+                print(f'[{i + 1}] 损坏: {video_path}')
+                yield video_path
 
 
 class CheckVideo2Audio(Command):
@@ -151,15 +235,28 @@ class CheckVideo2Audio(Command):
 
     cmd = 'v2a'
 
-    help_doc = '视频格式转换 mp4 -> wav'
-
-    def __call__(self, video_path: Union[str, List[str]], root=True, *args, **kwargs):
-            if isinstance(video_path, str):
-                video_path = [video_path]
+    help_doc = ('视频格式转换 mp4 -> wav, 同时运行多个 ffmpeg 任务, 转换失败的视频所在文件夹会被删除\n'
+                '逐个返回转换成功的音频路径\n'
+                '用法: v2a [并发数] [格式], 两个参数顺序任意, 格式可选 wav (默认), m4a, aac, mp3, 编码兼容时直接复制音频流\n')
+
+    def __call__(self, video_path: Union[str, Iterable[str]], *options, workers=None, root=True,
+                 **kwargs) -> Iterator[str]:
+        audio_format = 'wav'
+        for option in options:
+            if option.isdigit():
+                workers = int(option)
+            elif option in transcode.AUDIO_FORMATS:
+                audio_format = option
+            else:
+                raise ValueError(f'未知的参数 {option}, 应为并发数或 {tuple(transcode.AUDIO_FORMATS)} 之一')
 
-            for video in video_path:
-                if os.path.exists(video) and not m3u8.video2audio(video):
-                    shutil.rmtree(os.path.dirname(video))
+        videos = (video for video in as_iter(video_path) if os.path.exists(video))
+        # batch_extract_audio 只在 ffmpeg 转换失败时返回 ok False, 缺少 ffmpeg 等环境错误会直接抛出, 不会删除视频
+        for result in transcode.batch_extract_audio(videos, audio_format, workers):
+            if result['ok']:
+                yield result['audio_path']
+            else:
+                shutil.rmtree(os.path.dirname(result['video_path']))
 
 
 class CheckDirNames(Command):
@@ -168,13 +265,10 @@ class CheckDirNames(Command):
     cmd = 'dir_names'
 
     help_doc = ('获取路径的目录名\n'
-                '传入任意数量的文件或文件夹路径, 程序会返回该路径的目录名\n')
+                '传入任意数量的文件或文件夹路径, 程序会逐个返回该路径的目录名\n')
 
-    def __call__(self, paths: Union[str, List[str]], root=True, *args, **kwargs) -> List[str]:
-        if isinstance(paths, str):
-            paths = [paths]
-
-        return [os.path.dirname(path) for path in paths if os.path.exists(path)]
+    def __call__(self, paths: Union[str, Iterable[str]], root=True, *args, **kwargs) -> Iterator[str]:
+        return (os.path.dirname(path) for path in as_iter(paths) if os.path.exists(path))
 
 
 class CheckUpdateDownloadUrls(Command):
@@ -184,17 +278,63 @@ class CheckUpdateDownloadUrls(Command):
 
     help_doc = '根据子文件夹名，更新下载链接'
 
-    def __call__(self, dir_paths: Union[str, List[str]], root=True, *args, **kwargs):
-        if isinstance(dir_paths, str):
-            dir_paths = [dir_paths]
-
-        for dir_path in dir_paths:
+    def __call__(self, dir_paths: Union[str, Iterable[str]], root=True, *args, **kwargs):
+        for dir_path in as_iter(dir_paths):
             url_set = UrlSet(dir_path)
             for sub_path in tqdm(os.listdir(dir_path)):
                 if os.path.isdir(os.path.join(dir_path, sub_path)):
                     url_set.add(sub_path)
 
 
+class CheckCompactDownloadUrls(Command):
+    name = 'check_compact_download_urls'
+
+    cmd = 'compact'
+
+    help_doc = ('将 download_urls 合并为排序去重的快照, 并清空追加日志\n'
+                '用法: compact [gz] [prune]\n'
+                'gz 使用 gzip 压缩快照, prune 删除没有对应子文件夹的记录 (包括分页等进度记录, 之后会重新请求这些列表)\n'
+                '开启归档 (STORAGE_ARCHIVE_PATH) 或自动删除 (STORAGE_EVICT) 时, 视频不在原文件夹中, 不能使用 prune\n'
+                '返回文件夹路径, 便于继续链式调用\n')
+
+    def __call__(self, dir_paths: Union[str, Iterable[str]], *options, root=True, **kwargs) -> List[str]:
+        dir_paths = list(as_iter(dir_paths))
+        if 'prune' in options and (setting.STORAGE_ARCHIVE_PATH or setting.STORAGE_EVICT):
+            print('已开启归档或自动删除, 已下载的视频不一定还在文件夹中, prune 会导致重新下载, 未执行 compact')
+            return dir_paths
+
+        for dir_path in dir_paths:
+            keep = None
+            if 'prune' in options:
+                sub_dirs = {entry.name for entry in os.scandir(dir_path) if entry.is_dir()}
+                dir_name = PRUNE_DIR_NAMES.get(os.path.abspath(dir_path), lambda key: key)
+                keep = lambda key, _sub_dirs=sub_dirs, _dir_name=dir_name: _dir_name(key) in _sub_dirs
+
+            start = time.time()
+            result = url.compact(dir_path, compress='gz' in options, keep=keep)
+            print(f'{dir_path}: {result["num_lines"]} 行 {result["old_bytes"] / 1024:.1f}KB -> '
+                  f'{result["num_urls"]} 条 {result["new_bytes"] / 1024:.1f}KB, 耗时 {time.time() - start:.2f}s')
+
+        return dir_paths
+
+
+class CheckIndex(Command):
+    name = 'check_index'
+
+    cmd = 'index'
+
+    help_doc = ('为文件夹建立或增量更新视频索引\n'
+                '索引保存在文件夹下的 video_index.db, 之后 duration, size, dfs_num_files 会直接读取索引\n'
+                '读取索引时不会自动更新, 文件夹有变化后需要重新执行 index\n'
+                '返回文件夹路径, 便于继续链式调用\n')
+
+    def __call__(self, dir_path: str, root=True, *args, **kwargs) -> str:
+        with VideoIndex(dir_path) as index:
+            index.update()
+
+        return dir_path
+
+
 class CheckCls(Command):
     name = 'check_cls'
 
@@ -211,13 +351,10 @@ class CheckOCR(Command):
 
     cmd = 'ocr'
 
-    help_doc = '调用百度ocr接口进行文字识别'
-
-    def __call__(self, dir_names: Union[str, List[str]], root=True, *args, **kwargs):
-        if isinstance(dir_names, str):
-            dir_names = [dir_names]
+    help_doc = '调用百度ocr接口进行文字识别, 逐个返回处理完成的文件夹'
 
-        for dir_name in dir_names:
+    def __call__(self, dir_names: Union[str, Iterable[str]], root=True, *args, **kwargs) -> Iterator[str]:
+        for dir_name in as_iter(dir_names):
             if not os.path.isdir(dir_name):
                 continue
 
@@ -233,6 +370,7 @@ class CheckOCR(Command):
             CheckCls()(root=False)
             m3u8.video2audio(video_path, audio_path, cover=False)
             CheckDelete()(video_path, root=False)
+            yield dir_name
 
 
 class CheckPrint(Command):
@@ -240,15 +378,27 @@ class CheckPrint(Command):
 
     cmd = 'print'
 
-    help_doc = '打印一个值'
+    help_doc = '打印一个值, 迭代器的元素会在产生时逐个打印'
 
     def __call__(self, value, root=True, *args, **kwargs):
         if isinstance(value, list):
             print('\n'.join(value) + f"\ntype = list\ntotal = {len(value)}")
+        elif isinstance(value, Iterator):
+            return self._print_iter(value)
         else:
             print(value)
         return value
 
+    @staticmethod
+    def _print_iter(values: Iterator) -> Iterator:
+        total = 0
+        for value in values:
+            print(value)
+            total += 1
+            yield value
+
+        print(f"type = iterator\ntotal = {total}")
+
 
 class CheckHelp(Command):
     name = 'check_help'
@@ -270,6 +420,28 @@ class CheckHelp(Command):
                           f'help_doc: {command.help_doc}\n')
 
 
+class CheckParallelErrors(Command):
+    name = 'check_parallel_errors'
+
+    cmd = 'errors'
+
+    help_doc = ('获取上一条链式命令中各并行阶段 (>|) 出错的元素\n'
+                '用法: errors [阶段序号], 序号从 1 开始, 默认返回所有阶段出错的元素\n')
+
+    def __call__(self, _input=None, stage=None, *args, **kwargs) -> List[str]:
+        stages = list(enumerate(PARALLEL_ERRORS, 1))
+        if stage is not None:
+            stages = [stages[int(stage) - 1]]
+
+        items = []
+        for i, (command, errors) in stages:
+            print(f'阶段 {i} {command}: {len(errors)} 项出错')
+            for item, e in errors:
+                print(f'  {item}: {e!r}')
+                items.append(item)
+        return items
+
+
 class CheckHistoryReturns(Command):
     name = 'check_history_returns'
 
@@ -282,50 +454,146 @@ class CheckHistoryReturns(Command):
 
 
 COMMANDS = {CheckDuration(), CheckDFSNumFiles(), CheckDelete(), CheckSize(), CheckLs(), CheckVideoIsError(),
-            CheckVideo2Audio(), CheckDirNames(), CheckUpdateDownloadUrls(), CheckCls(), CheckOCR(), CheckPrint(),
-            CheckHelp(), CheckHistoryReturns()}
+            CheckVideo2Audio(), CheckDirNames(), CheckUpdateDownloadUrls(),
+            CheckCompactDownloadUrls(), CheckIndex(), CheckCls(), CheckOCR(),
+            CheckPrint(), CheckHelp(), CheckParallelErrors(), CheckHistoryReturns()}
+
+# 历史命令返回值, 最多保存 HISTORY_MAX_RETURNS 条
+HISTORY_RETURNS = deque(maxlen=HISTORY_MAX_RETURNS)
+
+# 上一条链式命令中每个并行阶段的命令, 以及该阶段出错的元素与异常
+PARALLEL_ERRORS: List[Tuple[str, list]] = []
 
-# 历史命令返回值
-HISTORY_RETURNS = []
+# 链式命令的分隔符, > 顺序执行, >| 或 >|N 使用 N 个线程并行执行
+CHAIN_PATTERN = re.compile(r'>(\|\d*)?')
 
 
-def run_command(command: str, *args):
+def run_command(command: str, *args, **kwargs):
     """
     运行一个命令
 
+    命令名后可以跟空格分隔的额外参数, 如 is_error 8 fast, 额外参数会放在 args 之后传入
+
     :param command: 命令名
 
     :param args: 命令参数
 
+    :param kwargs: 命令的关键字参数, 如并行执行时传入 workers=1
+
     :return: 命令的返回值
     """
-
+    name, *extra_args = command.split() or ['']
     for cmd in COMMANDS:
-        if cmd == command:
-            return cmd(*args)
+        if cmd == name:
+            return cmd(*args, *extra_args, **kwargs)
 
     return command
 
 
+def run_parallel_command(command: str, items, workers: Optional[int] = None) -> Iterator:
+    """
+    对输入的每个元素并行运行一个命令, 按输入顺序返回结果
+
+    单个元素出错不会中断命令, 出错的元素按阶段保存在 PARALLEL_ERRORS 中, 结束时打印处理速度
+
+    每个元素只有一个输入, 命令内部不再开启线程池 (workers=1), 避免 N 个线程各自再开 cpu 核数个任务
+
+    :param command: 命令, 可带额外参数
+
+    :param items: 输入元素
+
+    :param workers: 线程数, 默认为 cpu 核数
+
+    :return: 每个元素的命令返回值, 列表或迭代器会被展开, None 会被忽略
+    """
+    # 在命令链开始执行前登记阶段, PARALLEL_ERRORS 中的阶段与命令链中的顺序一致
+    errors = []
+    PARALLEL_ERRORS.append((command, errors))
+    return _iter_parallel_command(command, items, workers, errors)
+
+
+def _iter_parallel_command(command: str, items, workers: Optional[int], errors: list) -> Iterator:
+    def run_one(item):
+        ret = run_command(command, item, workers=1)
+        return list(ret) if isinstance(ret, Iterator) else ret
+
+    start, total = time.perf_counter(), 0
+    for item, future in imap_ordered(run_one, as_iter(items), workers):
+        total += 1
+        try:
+            ret = future.result()
+        except Exception as e:
+            print(f'{command} {item} 出错: {e!r}')
+            errors.append((item, e))
+            continue
+
+        if isinstance(ret, list):
+            yield from ret
+        elif ret is not None:
+            yield ret
+
+    elapsed = time.perf_counter() - start
+    print(f'{command}: 共 {total} 项, 失败 {len(errors)} 项, 耗时 {elapsed:.2f}s, '
+          f'{total / max(elapsed, 1e-9):.2f} 项/s')
+
+
 def run_chain_commands(commands: str):
     """
     运行命令, 可以链式运行多个命令，每个命令用 > 隔开
 
-    上一个命令的输出为下一个命令的输入
+    上一个命令的输出为下一个命令的输入, 命令之间传递迭代器, 链式命令逐个元素流式执行
+
+    用 >| 或 >|N 隔开时, 下一个命令会对每个元素使用 N 个线程并行执行, 如 ls >|8 is_error
+
+    返回的迭代器需要由调用者消费, 见 collect_returns
 
     :param commands: 一行输入的命令
 
     :return: 命令的返回值
     """
-    commands = commands.split('>')
-    ret = None
-    for command in commands:
+    # 拆分结果为 [命令, 分隔符, 命令, 分隔符, ...], 顺序分隔符为 None
+    parts = CHAIN_PATTERN.split(commands)
+    # 只有包含并行阶段的命令才清空上一条命令的错误, errors 命令本身不会清空
+    if any(op is not None for op in parts[1::2]):
+        PARALLEL_ERRORS.clear()
+    ret = run_command(parts[0].strip(), None)
+    for op, command in zip(parts[1::2], parts[2::2]):
         command = command.strip()
-        ret = run_command(command, ret)
+        if op is None:
+            ret = run_command(command, ret)
+        else:
+            ret = run_parallel_command(command, ret, int(op[1:]) if op[1:] else None)
 
     return ret
 
 
+def collect_returns(ret, max_items: int = HISTORY_MAX_ITEMS):
+    """
+    消费链式命令返回的迭代器, 驱动整条命令链执行
+
+    只保存前 max_items 个元素, 避免历史返回值占用过多内存
+
+    :param ret: 命令的返回值
+
+    :param max_items: 最多保存的元素数量
+
+    :return: 非迭代器直接返回, 迭代器返回保存的元素列表
+    """
+    if not isinstance(ret, Iterator):
+        return ret
+
+    items, total = [], 0
+    for item in ret:
+        if total < max_items:
+            items.append(item)
+        total += 1
+
+    if total > max_items:
+        print(f'共返回 {total} 个元素, 历史记录只保存前 {max_items} 个')
+
+    return items
+
+
 def main():
     num_command = 0
     while True:
@@ -338,7 +606,7 @@ def main():
         elif command == '':
             pass
         else:
-            ret = run_chain_commands(command)
+            ret = collect_returns(run_chain_commands(command))
 
         HISTORY_RETURNS.append(ret)
 
@@ -0,0 +1,283 @@
+import time
+import argparse
+import threading
+import traceback
+from typing import Iterator, List, Any, Dict, Optional
+
+import priority
+
+
+class Site:
+    """
+    爬虫站点插件
+
+    discover 负责列出待下载的任务, download 负责下载单个任务, 两者在引擎中由不同的线程执行
+    """
+    # 站点名称
+    name = 'site'
+
+    # 站点的主机名, 相同主机的站点共享并发限制
+    host = ''
+
+    def discover(self) -> Iterator[Any]:
+        """
+        列出待下载的任务, 应跳过已经下载过的任务, 避免占用队列与配额
+
+        :return: 任务迭代器, 任务会原样传给 download
+        """
+        raise NotImplementedError()
+
+    def download(self, task: Any):
+        """
+        下载一个任务
+
+        :param task: discover 返回的任务
+
+        :return: 任务已经下载过而跳过时返回 False, 不计入下载速度与配额
+        """
+        raise NotImplementedError()
+
+    def task_key(self, task: Any) -> Optional[str]:
+        """
+        任务的唯一标识, 如视频 id, 引擎据此避免同一个视频同时被多个下载线程下载
+
+        :param task: discover 返回的任务
+
+        :return: 任务的唯一标识, 为 None 时不去重
+        """
+        return None
+
+    def done(self, task: Any, ok: bool):
+        """
+        任务下载结束后调用, 可以用于记录一组任务 (如一页视频) 的完成情况, 见 parallel.CompletionTracker.expect
+
+        被队列丢弃的任务不会调用
+
+        :param task: discover 返回的任务
+
+        :param ok: 是否下载成功
+        """
+
+    def task_meta(self, task: Any) -> dict:
+        """
+        从任务的列表元数据中获取调度信息, 见 priority.TaskQueue
+
+        :param task: discover 返回的任务
+
+        :return: 可以包含 duration 时长(s), size 大小(字节), category 分类, score 价值
+        """
+        return {}
+
+
+class CrawlEngine:
+    def __init__(self, sites: List[Site], max_workers: int = 16, max_host_workers: int = 4, queue_size: int = 64,
+                 mode: str = 'fifo', quotas: Optional[Dict[str, float]] = None, deadline: Optional[float] = None):
+        """
+        统一的爬虫调度器, 将任务发现与下载分离
+
+        每个站点有一个发现线程, 将任务放入该站点的有界队列, 队列满时发现线程阻塞
+
+        每个主机有 max_host_workers 个下载线程, 所有主机同时下载的任务数不超过 max_workers
+
+        队列中的任务按 mode 排序, 排序依据为 Site.task_meta 返回的元数据, 见 priority.TaskQueue
+
+        :param sites: 站点插件列表
+
+        :param max_workers: 全局最大并发下载数
+
+        :param max_host_workers: 每个主机的最大并发下载数
+
+        :param queue_size: 每个站点任务队列的长度
+
+        :param mode: 调度模式, 见 priority.MODES
+
+        :param quotas: quota 模式下每个分类最多下载的视频时长(s)
+
+        :param deadline: deadline 模式的截止时间, time.time() 的时间戳
+        """
+        self.sites = sites
+        self.max_host_workers = max_host_workers
+        self.global_limit = threading.BoundedSemaphore(max_workers)
+        self.queues: Dict[str, priority.TaskQueue] = {}
+        self.num_discovered = {site.name: 0 for site in sites}
+        self.num_done = {site.name: 0 for site in sites}
+        self.num_failed = {site.name: 0 for site in sites}
+        self.num_skipped = {site.name: 0 for site in sites}
+        # 已经放入队列或下载完成的任务 (站点名, Site.task_key), 下载失败时移除, 之后重新发现的任务可以重试
+        self.claimed = set()
+        self.lock = threading.Lock()
+
+        for site in sites:
+            self.queues.setdefault(site.host or site.name, priority.TaskQueue(mode, queue_size, quotas, deadline))
+
+    def _queue(self, site: Site) -> priority.TaskQueue:
+        return self.queues[site.host or site.name]
+
+    def _discover(self, site: Site):
+        try:
+            task_queue = self._queue(site)
+            for task in site.discover():
+                if task_queue.expired():
+                    print(f'{site.name} 已超过截止时间, 停止任务发现')
+                    break
+
+                # 同一个视频可能被多次发现 (如网易的随机频道列表), 下载完成前不能再次放入队列
+                key = site.task_key(task)
+                if key is not None:
+                    with self.lock:
+                        claimed = (site.name, key) in self.claimed
+                        self.claimed.add((site.name, key))
+                    if claimed:
+                        # 由已经放入队列的任务负责下载, 该任务视为完成
+                        site.done(task, True)
+                        continue
+
+                try:
+                    meta = site.task_meta(task)
+                except Exception as e:
+                    print(f'{site.name} 获取任务元数据失败: {e}')
+                    meta = {}
+
+                task_queue.put((site, task, meta), meta)
+                with self.lock:
+                    self.num_discovered[site.name] += 1
+        except Exception as e:
+            traceback.print_exc()
+            print(f'{site.name} 任务发现失败: {e}')
+
+    def _download(self, task_queue: priority.TaskQueue):
+        while True:
+            item = task_queue.get()
+            if item is None:
+                break
+
+            site, task, meta = item
+            ok, downloaded = False, False
+            with self.global_limit:
+                try:
+                    start = time.time()
+                    downloaded = site.download(task) is not False
+                    ok = True
+                except Exception as e:
+                    traceback.print_exc()
+                    print(f'{site.name} 下载失败: {e}')
+
+            # 只有实际下载的任务计入下载速度与配额
+            if downloaded:
+                task_queue.record(meta, time.time() - start)
+            else:
+                task_queue.cancel(meta)
+
+            try:
+                site.done(task, ok)
+            except Exception as e:
+                traceback.print_exc()
+                print(f'{site.name} 记录任务完成情况失败: {e}')
+
+            with self.lock:
+                if not ok:
+                    self.num_failed[site.name] += 1
+                    self.claimed.discard((site.name, site.task_key(task)))
+                elif downloaded:
+                    self.num_done[site.name] += 1
+                else:
+                    self.num_skipped[site.name] += 1
+
+    def status(self) -> str:
+        """
+        :return: 每个站点的发现数, 完成数, 失败数, 跳过数, 队列长度, 以及所在队列丢弃的任务数
+        """
+        with self.lock:
+            lines = [f'{site.name}: 发现 {self.num_discovered[site.name]} 完成 {self.num_done[site.name]} '
+                     f'失败 {self.num_failed[site.name]} 跳过 {self.num_skipped[site.name]} 队列 {self._queue(site).qsize()} '
+                     f'丢弃 {self._queue(site).num_dropped}' for site in self.sites]
+        return '\n'.join(lines)
+
+    def run(self):
+        """
+        运行所有站点, 直到所有任务发现并下载完成
+        """
+        discover_threads = [threading.Thread(target=self._discover, args=(site, ), name=f'discover-{site.name}')
+                            for site in self.sites]
+        download_threads = {host: [threading.Thread(target=self._download, args=(task_queue, ), name=f'download-{host}')
+                                   for _ in range(self.max_host_workers)]
+                            for host, task_queue in self.queues.items()}
+
+        for thread in discover_threads:
+            thread.start()
+        for threads in download_threads.values():
+            for thread in threads:
+                thread.start()
+
+        for thread in discover_threads:
+            thread.join()
+
+        # 发现结束后, 每个下载线程收到一个结束标记
+        for host, threads in download_threads.items():
+            for _ in threads:
+                self.queues[host].put(None)
+            for thread in threads:
+                thread.join()
+
+        print(self.status())
+
+
+def make_sites(names: List[str], acfun_uids: List[str], mode: str = 'fifo') -> List[Site]:
+    """
+    根据站点名称构造站点插件
+
+    :param names: 站点名称, 可选 wangyi, wangyi_live, brtv, acfun, ifeng
+
+    :param acfun_uids: acfun 需要下载的 up主 uid
+
+    :param mode: 调度模式, fifo 模式不需要任务的时长, acfun 发现时不再请求视频页面
+
+    :return: 站点插件列表
+    """
+    sites = []
+    for name in names:
+        if name == 'wangyi':
+            import wangyi
+            sites.append(wangyi.WangyiSite())
+        elif name == 'wangyi_live':
+            import wangyi_live
+            sites.append(wangyi_live.WangyiLiveSite())
+        elif name == 'brtv':
+            import brtv
+            sites.append(brtv.BrtvSite())
+        elif name == 'acfun':
+            import acfun
+            sites.append(acfun.AcfunSite(acfun_uids, fetch_meta=mode != 'fifo'))
+        elif name == 'ifeng':
+            import ifeng
+            sites.append(ifeng.IfengSite())
+        else:
+            raise ValueError(f'未知的站点 {name}')
+
+    return sites
+
+
+def main():
+    parser = argparse.ArgumentParser(description='同时爬取多个站点')
+    parser.add_argument('sites', nargs='+', help='站点名称: wangyi, wangyi_live, brtv, acfun, ifeng')
+    parser.add_argument('--uids', nargs='*', default=[], help='acfun up主的 uid')
+    parser.add_argument('--workers', type=int, default=16, help='全局最大并发下载数')
+    parser.add_argument('--host-workers', type=int, default=4, help='每个主机的最大并发下载数')
+    parser.add_argument('--queue-size', type=int, default=64, help='每个站点任务队列的长度')
+    parser.add_argument('--mode', choices=priority.MODES, default='fifo', help='调度模式')
+    parser.add_argument('--quota', nargs='*', default=[], help='quota 模式下分类的视频时长上限, 格式为 分类=小时')
+    parser.add_argument('--deadline', type=float, default=None, help='deadline 模式的爬取时长(分钟)')
+    args = parser.parse_args()
+
+    quotas = {}
+    for quota in args.quota:
+        category, _, hours = quota.rpartition('=')
+        quotas[category] = float(hours) * 3600
+    deadline = time.time() + args.deadline * 60 if args.deadline is not None else None
+
+    CrawlEngine(make_sites(args.sites, args.uids, args.mode), args.workers, args.host_workers, args.queue_size,
+                args.mode, quotas, deadline).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import re
+import html as _html
+import json
+from functools import lru_cache
+from typing import Any, Optional
+
+
+_DECODER = json.JSONDecoder()
+
+
+@lru_cache(maxsize=None)
+def _bracket_pattern(left: str, right: str) -> re.Pattern:
+    return re.compile(f'[{re.escape(left)}{re.escape(right)}]')
+
+
+def match_balanced(text: str, left: str, right: str, start: int = 0) -> str:
+    """
+    从 start 开始匹配第一段左右配对的字符串, 如 {...} 或 [...]
+
+    使用正则只扫描左右字符, 不逐字符遍历文本, 与 m3u8.match 的结果相同
+
+    :param text: 原始文本
+
+    :param left: 左匹配字符
+
+    :param right: 右匹配字符
+
+    :param start: 开始查找的位置
+
+    :return: 包含左右字符的匹配结果
+    """
+    cnt, first = 0, -1
+    for m in _bracket_pattern(left, right).finditer(text, start):
+        if m.group() == left:
+            if first == -1:
+                first = m.start()
+            cnt += 1
+        else:
+            cnt -= 1
+            if cnt < 0:
+                break
+            if cnt == 0:
+                return text[first: m.end()]
+
+    raise RuntimeError('无法完成完整匹配, 请检查左右匹配是否配对')
+
+
+def json_value(text: str, key: str, start: int = 0) -> Any:
+    """
+    解析文本中 key 之后的第一个 json 值, 如 "list": [...] 中的列表
+
+    使用 json 的 C 解码器直接从原文本中解码, 不需要先截取子串
+
+    :param text: 原始文本, 如 html
+
+    :param key: 值前面的键, 需包含引号, 如 '"list"'
+
+    :param start: 开始查找的位置
+
+    :return: 解析出的 json 值, ':' 之后直到文本结尾都没有值时返回 None
+    """
+    pos = text.find(key, start)
+    if pos == -1:
+        raise ValueError(f'文本中不存在 {key}')
+
+    pos = text.find(':', pos + len(key))
+    if pos == -1:
+        raise ValueError(f'{key} 之后不存在 json 值')
+
+    pos += 1
+    while pos < len(text) and text[pos].isspace():
+        pos += 1
+    if pos == len(text):
+        return None
+
+    return _DECODER.raw_decode(text, pos)[0]
+
+
+@lru_cache(maxsize=None)
+def _meta_pattern(attr: str, value: str) -> re.Pattern:
+    return re.compile(r'<meta\b(?=[^>]*\b' + attr + r'\s*=\s*["\']' + re.escape(value) + r'["\'])'
+                      r'[^>]*\bcontent\s*=\s*(["\'])(.*?)\1', re.IGNORECASE | re.DOTALL)
+
+
+def meta_content(html: str, name: str, attr: str = 'name') -> Optional[str]:
+    """
+    获取 <meta name="..." content="..."> 的 content, 不构建完整的 DOM
+
+    :param html: html 文本
+
+    :param name: meta 标签的 name
+
+    :param attr: 用于匹配的属性, 默认为 name, 也可以为 property
+
+    :return: content 的值, 不存在时返回 None
+    """
+    m = _meta_pattern(attr, name).search(html)
+    return _html.unescape(m.group(2)) if m else None
@@ -3,13 +3,14 @@ import json
 from typing import List
 from concurrent.futures import ThreadPoolExecutor as Pool
 
-import requests
 from urllib.parse import urljoin
-from bs4 import BeautifulSoup
-
 
 import m3u8
+import metrics
+import extract
 import delay
+import engine
+import priority
 import setting
 from url import UrlSet
 
@@ -17,9 +18,7 @@ CHANNEL_IDS = ['27-95119-95123-', '27-95283-', '27-95199-', '27-95288-', '27-952
                '27-95212-', '27-95022-', '27-95095-', '27-95273-95280-', '27-95171-', '27-95233-', '27-95366-',
                '27-95224-95227-', '27-95109-', '27-95022-95036-', '27-95047-', '27-95078-', ]
 
-DOWNLOAD_URL_PATH = os.path.join(setting.IFENG_VIDEO_PATH, 'download_video_url')
-
-video_urls = UrlSet(DOWNLOAD_URL_PATH, DOWNLOAD_URL_PATH)
+video_urls = UrlSet(setting.IFENG_VIDEO_PATH)
 
 
 def make_ifeng_api_url(page: int, step: int, channel_id: str) -> str:
@@ -58,25 +57,55 @@ def download_ifeng_video(data: dict, delay_min: int = 2, delay_max: int = 5):
     title = data["title"]
     if data["url"] in video_urls:
         print(f'{title} 已下载')
-        return
+        return False
 
     print(f'开始下载 {title}')
-    resp = requests.get(urljoin('https://', data["url"]), headers=setting.HEADERS, timeout=100, stream=True)
-    soup = BeautifulSoup(resp.text, 'html.parser')
+    with metrics.span('video', site='ifeng', id=data['url']):
+        with metrics.span('parse'):
+            html = m3u8.request_text(urljoin('https://', data["url"]), timeout=100)
+            video_url = extract.meta_content(html, 'og:img_video')
+
+        # 页面请求失败或没有视频地址, 不记录为已下载, 之后重新发现时再试
+        if video_url is None:
+            print(f'{title} 未找到视频地址, 跳过')
+            return False
 
-    video_url = soup.select_one('meta[name="og:img_video"]').get('content')
-    m3u8.download_video(video_url, os.path.join(setting.IFENG_VIDEO_PATH, data['url'].split('/')[-1]), data)
+        m3u8.download_video(video_url, os.path.join(setting.IFENG_VIDEO_PATH, data['url'].split('/')[-1]), data)
     video_urls.add(data["url"])
     delay.random_delay(delay_min, delay_max)
     print(f'下载 {title} 完成')
+    return True
+
+
+class IfengSite(engine.Site):
+    name = 'ifeng'
+
+    host = 'ifeng.com'
+
+    def discover(self):
+        for channel_id in CHANNEL_IDS:
+            for data in parse_ifeng_response(m3u8.request_text(make_ifeng_api_url(1, 1000, channel_id))):
+                if data["url"] not in video_urls:
+                    yield channel_id, data
+
+    def download(self, task: tuple) -> bool:
+        return download_ifeng_video(task[1], 2, 5)
+
+    def task_key(self, task: tuple) -> str:
+        return task[1]['url']
+
+    def task_meta(self, task: tuple) -> dict:
+        channel_id, data = task
+        meta = priority.find_meta(data)
+        meta['category'] = channel_id
+        return meta
 
 
 if __name__ == '__main__':
     with Pool(max_workers=10) as pool:
         for channel_id in CHANNEL_IDS:
-            resp = requests.get(make_ifeng_api_url(1, 1000, channel_id), headers=setting.HEADERS)
             # 解析 json 数据
-            datas = parse_ifeng_response(resp.text)
+            datas = parse_ifeng_response(m3u8.request_text(make_ifeng_api_url(1, 1000, channel_id)))
 
             try:
                 # 下载视频
@@ -0,0 +1,358 @@
+import os
+import re
+import time
+import heapq
+import hashlib
+import argparse
+import itertools
+import threading
+import traceback
+from typing import List, Optional
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import m3u8
+import metrics
+import setting
+import storage
+
+
+ATTRIBUTE_PATTERN = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+# 录制的分片文件名, 见 LiveRecorder._open_part
+PART_PATTERN = re.compile(r'video_(\d+)\.ts')
+
+# 播放列表连续请求失败时的最长退避时间(s)
+MAX_BACKOFF = 60
+
+
+def parse_playlist(text: str, url: str) -> dict:
+    """
+    解析 m3u8 播放列表
+
+    :param text: 播放列表文本
+
+    :param url: 播放列表 url, 用于拼接相对地址
+
+    :return: {
+        'target_duration': 分片最大时长(s), 未声明时为 None,
+        'media_sequence': 第一个分片的序号,
+        'endlist': 是否已结束,
+        'segments': [{'sequence': 序号, 'url': 分片地址, 'duration': 时长(s), 'discontinuity': 是否不连续}],
+        'variants': [(码率, 媒体播放列表地址)], 主播放列表才有
+    }
+    """
+    playlist = {'target_duration': None, 'media_sequence': 0, 'endlist': False, 'segments': [], 'variants': []}
+    duration, discontinuity, bandwidth = 0.0, False, None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+
+        if line.startswith('#EXT-X-TARGETDURATION:'):
+            playlist['target_duration'] = float(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            playlist['media_sequence'] = int(line.split(':', 1)[1])
+        elif line == '#EXT-X-ENDLIST':
+            playlist['endlist'] = True
+        elif line == '#EXT-X-DISCONTINUITY':
+            discontinuity = True
+        elif line.startswith('#EXTINF:'):
+            duration = float(line.split(':', 1)[1].split(',')[0])
+        elif line.startswith('#EXT-X-STREAM-INF:'):
+            attributes = dict(ATTRIBUTE_PATTERN.findall(line.split(':', 1)[1]))
+            bandwidth = int(attributes.get('BANDWIDTH', 0))
+        elif line.startswith('#'):
+            continue
+        elif bandwidth is not None:
+            playlist['variants'].append((bandwidth, urljoin(url, line)))
+            bandwidth = None
+        else:
+            playlist['segments'].append({'url': urljoin(url, line), 'duration': duration,
+                                         'discontinuity': discontinuity})
+            duration, discontinuity = 0.0, False
+
+    for i, segment in enumerate(playlist['segments']):
+        segment['sequence'] = playlist['media_sequence'] + i
+
+    return playlist
+
+
+class LiveRecorder:
+    def __init__(self, url: str, save_dir: str, name: Optional[str] = None, max_failures: int = 10):
+        """
+        直播录制器, 每次 poll 拉取一次媒体播放列表, 按分片序号下载新的分片并追加到输出文件
+
+        输出文件为 save_dir/video_{part:03d}.ts, 遇到 #EXT-X-DISCONTINUITY, 分片序号跳跃, 直播重启 (分片序号变小)
+        或分片下载失败时开始新的文件
+
+        :param url: 直播的 m3u8 地址, 为主播放列表时选择码率最高的媒体播放列表
+
+        :param save_dir: 保存文件夹
+
+        :param name: 频道名称, 默认为 save_dir 的文件夹名
+
+        :param max_failures: 播放列表连续请求失败的次数达到 max_failures 时停止录制
+        """
+        self.url = url
+        self.media_url = None
+        self.save_dir = save_dir
+        self.name = name or os.path.basename(save_dir)
+        self.max_failures = max_failures
+        self.target_duration = 10.0
+        self.last_sequence = None
+        self.failures = 0
+        self.finished = False
+        self.file = None
+        self.split = False
+        self.num_parts = 0
+        self.num_segments = 0
+        self.num_bytes = 0
+        self.num_gaps = 0
+
+        os.makedirs(save_dir, exist_ok=True)
+        # 不覆盖之前录制的文件, 之前的文件编号不一定连续, 从最大的编号之后开始
+        self.part = max((int(match.group(1)) for match in map(PART_PATTERN.fullmatch, os.listdir(save_dir)) if match),
+                        default=-1)
+
+    def _fetch_playlist(self) -> dict:
+        """
+        请求媒体播放列表, 第一次请求时从主播放列表中选择码率最高的媒体播放列表
+        """
+        url = self.media_url or self.url
+        text = m3u8.request_text(url, timeout=max(self.target_duration, 5))
+        if not text:
+            raise RuntimeError(f'请求播放列表 {url} 失败')
+
+        playlist = parse_playlist(text, url)
+        if playlist['variants']:
+            self.media_url = max(playlist['variants'])[1]
+            return self._fetch_playlist()
+
+        self.media_url = url
+        return playlist
+
+    def _part_path(self) -> str:
+        return os.path.join(self.save_dir, f'video_{self.part:03d}.ts')
+
+    def _open_part(self):
+        """
+        关闭当前文件, 开始新的文件
+        """
+        if self.file is not None:
+            self.file.close()
+
+        self.part += 1
+        while os.path.exists(self._part_path()):
+            self.part += 1
+        path = self._part_path()
+        self.file = open(path, 'wb')
+        self.num_parts += 1
+        self.split = False
+        print(f'{self.name} 开始写入 {path}')
+
+    def poll(self) -> Optional[float]:
+        """
+        拉取一次播放列表并下载新的分片
+
+        :return: 距下一次拉取的时间(s), 录制结束时返回 None
+        """
+        try:
+            playlist = self._fetch_playlist()
+            fetched = time.monotonic()
+        except (RuntimeError, ValueError, requests.exceptions.RequestException) as e:
+            self.failures += 1
+            metrics.inc('live_playlist_errors_total', channel=self.name)
+            print(f'{self.name} {e}, 连续失败 {self.failures} 次')
+            if self.failures >= self.max_failures:
+                self.close()
+                return None
+            return min(self.target_duration * 2 ** (self.failures - 1), MAX_BACKOFF)
+
+        self.failures = 0
+        if playlist['target_duration']:
+            self.target_duration = playlist['target_duration']
+
+        # 直播重启后分片序号从头开始, 播放列表中最新的分片序号比已下载的小, 否则之后的分片都会被当作已下载而丢弃
+        if (playlist['segments'] and self.last_sequence is not None
+                and playlist['segments'][-1]['sequence'] < self.last_sequence):
+            self.last_sequence = None
+            self.split = True
+            metrics.inc('live_restarts_total', channel=self.name)
+            print(f'{self.name} 直播重启, 分片序号从 {playlist["media_sequence"]} 重新开始')
+
+        segments = [segment for segment in playlist['segments']
+                    if self.last_sequence is None or segment['sequence'] > self.last_sequence]
+
+        # 拉取间隔过长, 部分分片已经滑出播放列表
+        if segments and self.last_sequence is not None and segments[0]['sequence'] > self.last_sequence + 1:
+            self.num_gaps += 1
+            self.split = True
+            metrics.inc('live_gaps_total', channel=self.name)
+            print(f'{self.name} 丢失分片 {self.last_sequence + 1} ~ {segments[0]["sequence"] - 1}')
+
+        for segment in segments:
+            if self.file is None or self.split or segment['discontinuity']:
+                self._open_part()
+
+            self.last_sequence = segment['sequence']
+            try:
+                content = m3u8.download_ts_segment(segment['url'])
+            except RuntimeError as e:
+                self.split = True
+                print(f'{self.name} 跳过分片 {segment["sequence"]}: {e}')
+                continue
+
+            # 分片追加到当前文件, 与其他下载一样经过 StorageGovernor 预留空间, 空间不足时等待或跳过分片
+            try:
+                with storage.get_governor().admit(self.file.name, len(content)):
+                    self.file.write(content)
+                    self.file.flush()
+            except RuntimeError as e:
+                self.split = True
+                print(f'{self.name} 跳过分片 {segment["sequence"]}: {e}')
+                continue
+
+            self.num_segments += 1
+            self.num_bytes += len(content)
+            metrics.inc('live_segments_total', channel=self.name)
+
+        if playlist['endlist']:
+            print(f'{self.name} 直播已结束')
+            self.close()
+            return None
+
+        # 播放列表没有更新时, 等待半个分片时长后再次拉取
+        # 间隔从拉取到播放列表时开始计算, 下载分片的时间不推迟下一次拉取, 否则下载较慢时分片会滑出播放列表
+        interval = self.target_duration if segments else self.target_duration / 2
+        return max(0.0, interval - (time.monotonic() - fetched))
+
+    def close(self):
+        """
+        停止录制, 关闭输出文件
+        """
+        if self.finished:
+            return
+
+        self.finished = True
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        print(f'{self.name} 录制结束, 共 {self.num_segments} 个分片 {self.num_bytes / 1024 ** 2:.1f}MB, '
+              f'{self.num_parts} 个文件, 丢失 {self.num_gaps} 次')
+
+
+class LiveScheduler:
+    def __init__(self, max_workers: int = 8):
+        """
+        在一个进程中同时录制多个直播
+
+        所有频道按下一次拉取的时间放入小根堆, 调度线程取出到期的频道交给线程池拉取, 拉取完成后按返回的间隔放回堆中
+
+        每个频道同一时间只会被一个线程拉取, 空闲的频道不占用线程
+
+        :param max_workers: 同时拉取的频道数
+        """
+        self.heap = []
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.recorders: List[LiveRecorder] = []
+        self.num_running = 0
+        self.stopped = False
+
+    def add(self, recorder: LiveRecorder, delay: float = 0):
+        """
+        添加一个频道
+
+        :param recorder: 直播录制器
+
+        :param delay: 第一次拉取前等待的时间(s)
+        """
+        with self.cond:
+            self.recorders.append(recorder)
+            heapq.heappush(self.heap, (time.monotonic() + delay, next(self.counter), recorder))
+            self.cond.notify()
+
+    def _poll(self, recorder: LiveRecorder):
+        try:
+            delay = recorder.poll()
+        except Exception:
+            traceback.print_exc()
+            delay = recorder.target_duration
+
+        with self.cond:
+            self.num_running -= 1
+            if delay is not None and not self.stopped:
+                heapq.heappush(self.heap, (time.monotonic() + delay, next(self.counter), recorder))
+            self.cond.notify()
+
+    def run(self):
+        """
+        阻塞直到所有频道录制结束或调用 stop
+        """
+        with self.cond:
+            while not self.stopped and (self.heap or self.num_running):
+                if not self.heap:
+                    self.cond.wait()
+                    continue
+
+                due, _, recorder = self.heap[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self.cond.wait(wait)
+                    continue
+
+                heapq.heappop(self.heap)
+                self.num_running += 1
+                self.pool.submit(self._poll, recorder)
+
+        self.pool.shutdown(wait=True)
+        for recorder in self.recorders:
+            recorder.close()
+
+    def stop(self):
+        """
+        停止调度, 正在进行的拉取完成后关闭所有频道
+        """
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+
+
+def parse_channel(channel: str) -> tuple:
+    """
+    解析命令行中的频道, 格式为 name=url 或 url, 未指定名称时使用 url 的 md5 前 12 位
+
+    :return: (name, url)
+    """
+    name, sep, url = channel.partition('=')
+    if not sep or '://' in name:
+        return hashlib.md5(channel.encode()).hexdigest()[:12], channel
+    return name, url
+
+
+def main():
+    parser = argparse.ArgumentParser(description='同时录制多个 HLS 直播')
+    parser.add_argument('channels', nargs='+', help='直播 m3u8 地址, 格式为 name=url 或 url')
+    parser.add_argument('--out', default=setting.LIVE_VIDEO_PATH, help='保存文件夹')
+    parser.add_argument('--workers', type=int, default=8, help='同时拉取的频道数')
+    args = parser.parse_args()
+
+    scheduler = LiveScheduler(args.workers)
+    for channel in args.channels:
+        name, url = parse_channel(channel)
+        scheduler.add(LiveRecorder(url, os.path.join(args.out, name), name))
+
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        print('停止录制')
+        scheduler.stop()
+        scheduler.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,33 @@
 import os
+import time
+import threading
 from typing import List, Optional, Iterator, Union
 
 import requests
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlsplit
 import cv2
 import ffmpeg
 
+import cache
+import metrics
 import setting
+import storage
+import metastore
+import postprocess
+import extract
+
+
+# TS 包的大小与同步字节
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+
+# 写入磁盘的块大小按该值对齐
+WRITE_ALIGN = 4096
+
+# 写入过程中的临时文件后缀, 写入完成后重命名为目标文件
+PART_SUFFIX = '.part'
+
+FSYNC_POLICIES = ('never', 'close', 'always')
 
 
 def video_duration(video_path, video_capture=None) -> float:
@@ -52,11 +73,15 @@ def request_video(url: str, headers=None, **kwargs) -> Optional[requests.Respons
     if headers is None:
         headers = setting.HEADERS
 
+    host = urlsplit(url).netloc
     response = requests.get(url, headers=headers, stream=True, **kwargs)
+    metrics.inc('http_requests_total', host=host)
+    metrics.observe('http_ttfb_seconds', response.elapsed.total_seconds(), host=host)
     try:
         response.raise_for_status()
         return response
     except requests.exceptions.HTTPError as e:
+        metrics.inc('http_errors_total', host=host)
         print(f'请求 {url} 失败')
         return None
 
@@ -86,14 +111,33 @@ def request_video_stream(url: str, headers=None, **kwargs) -> Optional[requests.
 
 
 def request_text(url: str, headers=None, **kwargs) -> str:
+    """
+    请求文本, 匹配 setting.HTTP_CACHE_RULES 的 url 会经过 http 缓存
+
+    :param url: 请求的 url
+
+    :param headers: 请求头
+
+    :param kwargs: 其他参数
+
+    :return: 响应文本, 请求失败时返回空字符串
+    """
     if headers is None:
         headers = setting.HEADERS
 
+    ttl = cache.cache_ttl(url)
+    if ttl is not None:
+        return cache.get_cache().request_text(url, headers, ttl, **kwargs)
+
+    host = urlsplit(url).netloc
     response = requests.get(url, headers=headers, **kwargs)
+    metrics.inc('http_requests_total', host=host)
+    metrics.observe('http_ttfb_seconds', response.elapsed.total_seconds(), host=host)
     try:
         response.raise_for_status()
         return response.text
     except requests.exceptions.HTTPError as e:
+        metrics.inc('http_errors_total', host=host)
         print(f'请求 {url} 失败')
         return ''
 
@@ -121,6 +165,135 @@ def parse_m3u8(url: str) -> list:
     return ts_files
 
 
+class VideoWriter:
+    def __init__(self, save_path: str, size: Optional[int] = None, buffer_size: Optional[int] = None,
+                 fsync: Optional[str] = None):
+        """
+        视频文件写入器
+
+        先写入 save_path.part, 完成后重命名为 save_path, 出现异常时删除临时文件, 不会留下写了一半的视频
+
+        已知文件大小时使用 posix_fallocate 预分配磁盘空间, 多个下载同时写入时减少文件碎片
+
+        小块写入先合并到缓冲区, 缓冲区满后按 WRITE_ALIGN 对齐写入磁盘
+
+        with VideoWriter(save_path, size) as writer:
+            writer.write(chunk)
+
+        :param save_path: 保存地址 xxx.mp4
+
+        :param size: 文件大小(字节), 如 Content-Length, 为 None 时不预分配, 提交时实际写入的字节数必须与之相同
+
+        :param buffer_size: 缓冲区大小, 默认为 setting.WRITE_BUFFER_SIZE
+
+        :param fsync: fsync 策略, 见 FSYNC_POLICIES, 默认为 setting.WRITE_FSYNC
+        """
+        self.fsync = fsync or setting.WRITE_FSYNC
+        if self.fsync not in FSYNC_POLICIES:
+            raise ValueError(f'fsync 策略应为 {FSYNC_POLICIES} 之一, 而不是 {self.fsync}')
+
+        self.save_path = save_path
+        self.part_path = save_path + PART_SUFFIX
+        self.size = size
+        self.buffer_size = max(WRITE_ALIGN, buffer_size or setting.WRITE_BUFFER_SIZE)
+        self.buffer = bytearray()
+        self.num_bytes = 0
+        self.fd = None
+
+    def open(self) -> 'VideoWriter':
+        self.fd = os.open(self.part_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        if self.size and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(self.fd, 0, self.size)
+            except OSError:
+                # 文件系统不支持预分配
+                pass
+        return self
+
+    def write(self, data: bytes) -> int:
+        """
+        写入数据, 缓冲区达到 buffer_size 时写入磁盘
+
+        :return: 写入的字节数
+        """
+        self.buffer += data
+        if len(self.buffer) >= self.buffer_size:
+            self._flush(len(self.buffer) // WRITE_ALIGN * WRITE_ALIGN)
+        return len(data)
+
+    def _flush(self, n: int):
+        """
+        将缓冲区的前 n 个字节写入磁盘
+        """
+        view = memoryview(self.buffer)
+        offset = 0
+        try:
+            while offset < n:
+                offset += os.write(self.fd, view[offset: n])
+        finally:
+            view.release()
+
+        del self.buffer[:n]
+        self.num_bytes += n
+        if self.fsync == 'always':
+            os.fsync(self.fd)
+
+    def commit(self):
+        """
+        写入剩余数据, 并重命名为目标文件
+
+        写入的字节数与 size 不一致时 (如连接提前断开) 删除临时文件并抛出 RuntimeError, 不会保存不完整的视频
+        """
+        self._flush(len(self.buffer))
+        if self.size and self.num_bytes != self.size:
+            num_bytes = self.num_bytes
+            self.abort()
+            raise RuntimeError(f'{self.save_path} 写入 {num_bytes} 字节, 与文件大小 {self.size} 不一致')
+        if self.fsync != 'never':
+            os.fsync(self.fd)
+        os.close(self.fd)
+        self.fd = None
+
+        os.replace(self.part_path, self.save_path)
+        if self.fsync != 'never':
+            _fsync_dir(os.path.dirname(os.path.abspath(self.save_path)))
+
+    def abort(self):
+        """
+        放弃写入, 删除临时文件
+        """
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
+def _fsync_dir(dir_path: str):
+    """
+    fsync 文件夹, 使重命名落盘, windows 不支持时忽略
+    """
+    try:
+        fd = os.open(dir_path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
 def _download_video(video_stream: Union[bytes, Iterator[bytes], requests.Response], save_path: str):
     """
     下载视频文件
@@ -134,18 +307,31 @@ def _download_video(video_stream: Union[bytes, Iterator[bytes], requests.Respons
     if video_stream is None:
         return
 
-    with open(save_path, 'wb') as f:
+    start, num_bytes = time.time(), 0
+    host, size = '', None
+    if isinstance(video_stream, requests.Response):
+        host = urlsplit(video_stream.url).netloc
+        if 'Content-Encoding' not in video_stream.headers and video_stream.headers.get('Content-Length'):
+            size = int(video_stream.headers['Content-Length'])
+    elif isinstance(video_stream, bytes):
+        size = len(video_stream)
+
+    with storage.get_governor().admit(save_path, size), VideoWriter(save_path, size) as f:
         if isinstance(video_stream, bytes):
-            f.write(video_stream)
+            num_bytes += f.write(video_stream)
         elif isinstance(video_stream, Iterator):
             for chunk in video_stream:
-                f.write(chunk)
+                num_bytes += f.write(chunk)
         elif isinstance(video_stream, requests.Response):
             with video_stream as r:
-                f.write(r.content)
+                for chunk in r.iter_content(WRITE_ALIGN * 256):
+                    num_bytes += f.write(chunk)
         else:
             raise TypeError('video_stream 类型错误, 应为 bytes 或 Iterator[bytes]')
 
+    metrics.inc('download_bytes_total', num_bytes, host=host)
+    metrics.inc('download_seconds_total', time.time() - start, host=host)
+
 
 def download_ts_files(ts_files: List[str], save_path: str):
     """
@@ -162,9 +348,108 @@ def download_ts_files(ts_files: List[str], save_path: str):
         print(f'Downloaded {i+1}')
 
 
+def check_ts_segment(content: bytes, content_length: Optional[int] = None) -> Optional[str]:
+    """
+    校验 ts 分片的内容
+
+    :param content: 分片内容
+
+    :param content_length: 响应头中的 Content-Length, 为 None 时不检查
+
+    :return: 校验失败的原因, 校验通过返回 None
+    """
+    if content_length is not None and len(content) != content_length:
+        return f'长度 {len(content)} 与 Content-Length {content_length} 不一致'
+
+    if not content or len(content) % TS_PACKET_SIZE != 0:
+        return f'长度 {len(content)} 不是 {TS_PACKET_SIZE} 的整数倍'
+
+    # 每 188 字节的第一个字节都应为同步字节
+    sync_bytes = content[::TS_PACKET_SIZE]
+    if sync_bytes.count(TS_SYNC_BYTE) != len(sync_bytes):
+        return '同步字节错误'
+
+    return None
+
+
+def download_ts_segment(ts_file: str, retries: Optional[int] = None, backoff: Optional[float] = None) -> bytes:
+    """
+    下载并校验一个 ts 分片, 请求失败或校验失败时按指数退避重试
+
+    :param ts_file: ts文件url
+
+    :param retries: 重试次数, 默认为 setting.SEGMENT_RETRIES
+
+    :param backoff: 退避时间(s), 默认为 setting.SEGMENT_BACKOFF
+
+    :return: 分片内容, 重试后仍失败时抛出 RuntimeError
+    """
+    if retries is None:
+        retries = setting.SEGMENT_RETRIES
+    if backoff is None:
+        backoff = setting.SEGMENT_BACKOFF
+
+    host = urlsplit(ts_file).netloc
+    error = None
+    for attempt in range(retries + 1):
+        if attempt > 0:
+            metrics.inc('segment_retries_total', host=host)
+            print(f'{ts_file} {error}, 第 {attempt} 次重试')
+            time.sleep(backoff * 2 ** (attempt - 1))
+
+        start = time.time()
+        try:
+            response = request_video(ts_file)
+            if response is None:
+                error = '请求失败'
+                continue
+
+            with response as r:
+                content = r.content
+                content_length = r.headers.get('Content-Length')
+        except requests.exceptions.RequestException as e:
+            error = f'请求出错 {e!r}'
+            continue
+
+        # 响应经过压缩时 Content-Length 为压缩后的长度
+        if content_length is not None and 'Content-Encoding' not in r.headers:
+            content_length = int(content_length)
+        else:
+            content_length = None
+
+        error = check_ts_segment(content, content_length)
+        if error is None:
+            metrics.observe('segment_seconds', time.time() - start, host=host)
+            metrics.inc('download_bytes_total', len(content), host=host)
+            metrics.inc('download_seconds_total', time.time() - start, host=host)
+            return content
+
+    metrics.inc('segment_errors_total', host=host)
+    raise RuntimeError(f'{ts_file} 下载失败: {error}')
+
+
+def iter_ts_segments(ts_files: List[str]) -> Iterator[bytes]:
+    """
+    按顺序下载并校验 ts 分片, 重复的分片 url 只下载一次
+
+    单个分片失败时只重试该分片, 已下载的分片不会重新下载
+
+    :param ts_files: ts文件列表
+
+    :return: 每个分片的内容
+    """
+    seen = set()
+    for ts_file in ts_files:
+        if ts_file in seen:
+            continue
+        seen.add(ts_file)
+
+        yield download_ts_segment(ts_file)
+
+
 def merge_download_ts_files(ts_files: list, save_path: str, cover: bool = False):
     """
-    合并下载ts文件
+    合并下载ts文件, 分片重试后仍失败时删除不完整的文件并抛出 RuntimeError
 
     :param ts_files: ts文件列表
 
@@ -176,10 +461,73 @@ def merge_download_ts_files(ts_files: list, save_path: str, cover: bool = False)
         print(save_path, '已存在')
         return
 
-    with open(save_path, 'wb') as f:
-        for ts_file in ts_files:
-            with request_video(ts_file) as r:
-                f.write(r.content)
+    with VideoWriter(save_path) as f:
+        for content in iter_ts_segments(ts_files):
+            f.write(content)
+
+
+def remux_ts_files(ts_files: List[str], save_path: str, cover: bool = False) -> bool:
+    """
+    边下载边将 ts 分片按顺序写入 ffmpeg 的标准输入, 不转码直接封装为 MP4 (-c copy -movflags +faststart)
+
+    不产生中间的 ts 文件, 生成的 MP4 带有索引且 moov 位于文件头, 读取时长与跳转不需要扫描整个文件
+
+    :param ts_files: ts文件列表
+
+    :param save_path: 保存路径 xxx.mp4
+
+    :param cover: 当文件存在时是否覆盖, 默认为 False
+
+    :return: 封装成功或文件已存在返回 True, ffmpeg 不可用或封装失败返回 False
+    """
+    if os.path.exists(save_path) and not cover:
+        print(save_path, '已存在')
+        return True
+
+    # 先写入临时文件, 封装成功后重命名
+    part_path = save_path + PART_SUFFIX
+    try:
+        process = (ffmpeg.input('pipe:0', format='mpegts')
+                   .output(part_path, c='copy', movflags='+faststart', format='mp4')
+                   .global_args('-v', 'error')
+                   .run_async(pipe_stdin=True, pipe_stderr=True, overwrite_output=True))
+    except FileNotFoundError:
+        print('未找到 ffmpeg, 无法封装 MP4')
+        return False
+
+    # ffmpeg 的错误输出在单独的线程中读取, 避免管道写满阻塞 ffmpeg
+    stderr = []
+    reader = threading.Thread(target=lambda: stderr.append(process.stderr.read()), daemon=True)
+    reader.start()
+
+    try:
+        for content in iter_ts_segments(ts_files):
+            process.stdin.write(content)
+    except BrokenPipeError:
+        # ffmpeg 提前退出, 错误信息见 stderr
+        pass
+    except BaseException:
+        process.kill()
+        process.wait()
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    finally:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+    ret = process.wait()
+    reader.join()
+    if ret != 0:
+        print(f'{save_path} 封装失败: {b"".join(stderr).decode("utf-8", errors="ignore").strip()}')
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        return False
+
+    os.replace(part_path, save_path)
+    return True
 
 
 def download_mp4_video(mp4_url: str, save_path: str, cover: bool = False):
@@ -203,15 +551,33 @@ def download_m3u8_video(m3u8_url: str, save_path: str, cover: bool = False):
     """
     下载m3u8视频文件
 
+    setting.HLS_REMUX 开启时封装为 MP4, 封装失败时回退为直接合并 ts 分片
+
     :param m3u8_url: m3u8视频文件url
 
     :param save_path: 保存路径 xxx/xxx.mp4
 
     :param cover: 当文件存在时是否覆盖, 默认为 False
     """
+    # 文件已存在时不解析 m3u8, 也不预留空间
+    if os.path.exists(save_path) and not cover:
+        print(save_path, '已存在')
+        return
 
-    ts_files = parse_m3u8(m3u8_url)
-    merge_download_ts_files(ts_files, save_path, cover=cover)
+    with metrics.span('parse_m3u8') as span:
+        ts_files = parse_m3u8(m3u8_url)
+        span.set(num_segments=len(ts_files))
+
+    # m3u8 下载前不知道总大小, 预留 setting.STORAGE_DEFAULT_RESERVE
+    with storage.get_governor().admit(save_path):
+        if setting.HLS_REMUX:
+            with metrics.span('remux'):
+                if remux_ts_files(ts_files, save_path, cover=cover):
+                    return
+            print(f'{save_path} 回退为直接合并 ts 分片')
+
+        with metrics.span('merge'):
+            merge_download_ts_files(ts_files, save_path, cover=cover)
 
 
 def auto_download_video(video_url: str, save_path: str, cover: bool = False):
@@ -290,7 +656,7 @@ def download_video(video_url, save_path, _video_info: Optional[dict] = None, cov
     """
     从给定的 url 下载视频并保存到指定路径
 
-    视频信息通过 video_info 参数传入，并保存在 video_info.txt 中
+    视频信息通过 video_info 参数传入，并保存在 video_info.txt 中, 同时追加到上级视频文件夹的 metadata.jsonl
 
     文件结构为 save_path/video.mp4 和 save_path/video_info.txt
 
@@ -307,17 +673,31 @@ def download_video(video_url, save_path, _video_info: Optional[dict] = None, cov
         os.mkdir(save_path)
 
     video_path = os.path.join(save_path, 'video.mp4')
-    auto_download_video(video_url, video_path, cover=cover)
-
-    # audio_path = os.path.join(save_path, 'audio.mp3')
-    # video2audio(video_path, audio_path, cover=cover)
-    # write_audio_info(audio_path, cover=cover)
+    with metrics.span('download', url=video_url) as span:
+        auto_download_video(video_url, video_path, cover=cover)
+        if os.path.exists(video_path):
+            span.set(bytes=os.path.getsize(video_path))
 
     if _video_info is not None:
-        with open(os.path.join(save_path, 'video_info.txt'), 'w', encoding='utf-8') as f:
+        with metrics.span('write_info'), open(os.path.join(save_path, 'video_info.txt'), 'w', encoding='utf-8') as f:
             for k, v in _video_info.items():
                 f.write(f'{k}: {v}\n')
 
+    if not os.path.exists(video_path):
+        return
+
+    with metrics.span('write_meta'):
+        metastore.record_video(save_path, video_url, _video_info, video_path)
+
+    # 归档会移动整个文件夹, 必须在写完视频信息与元数据之后
+    # 音频提取在进程共用的线程池中进行, 不阻塞下载, 提取完成后由 AudioStage 归档
+    audio_stage = postprocess.get_audio_stage()
+    if audio_stage is not None:
+        with metrics.span('enqueue_audio'):
+            audio_stage.submit(video_path)
+    else:
+        storage.get_governor().complete(save_path)
+
 
 def audio_info(audio_path) -> Optional[dict]:
     """
@@ -377,7 +757,7 @@ def write_audio_info(audio_path, _audio_info: any = None, cover: bool = False):
     return _audio_info
 
 
-def video2audio(video_path, audio_path=None, _audio_info=None, cover=False):
+def video2audio(video_path, audio_path=None, _audio_info=None, cover=False, quiet=False):
     """
     视频转音频
 
@@ -391,6 +771,8 @@ def video2audio(video_path, audio_path=None, _audio_info=None, cover=False):
 
     :param cover: 当文件存在时是否覆盖, 默认为 False
 
+    :param quiet: 是否隐藏 ffmpeg 的输出, 默认为 False
+
     :return: ffmpeg抛出异常返回 False, 否则返回 True
     """
     if not os.path.exists(video_path):
@@ -403,7 +785,7 @@ def video2audio(video_path, audio_path=None, _audio_info=None, cover=False):
     try:
         if cover or not os.path.exists(audio_path):
             print(f'Converting {video_path} to {audio_path}')
-            ffmpeg.input(video_path, y=None).output(audio_path, format="wav").run()
+            ffmpeg.input(video_path, y=None).output(audio_path, format="wav").run(quiet=quiet)
             if _audio_info is not None:
                 write_audio_info(audio_path, _audio_info, cover=cover)
 
@@ -442,19 +824,4 @@ def match(text: str, pattern_l: str, patter_r: str) -> str:
 
     :return: 匹配结果
     """
-    cnt, first = 0, -1
-    for i, c in enumerate(text):
-        if first != -1 and cnt == 0:
-            return text[first: i]
-        elif cnt < 0:
-            raise RuntimeError('无法完成完整匹配, 请检查左右匹配是否配对')
-
-        if c == pattern_l:
-            if first == -1:
-                first = i
-            cnt += 1
-
-        elif c == patter_r:
-            cnt -= 1
-
-    raise RuntimeError('无法完成完整匹配, 请检查左右匹配是否配对')
\ No newline at end of file
+    return extract.match_balanced(text, pattern_l, patter_r)
\ No newline at end of file
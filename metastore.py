@@ -0,0 +1,268 @@
+import os
+import ast
+import json
+import time
+import queue
+import atexit
+import argparse
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import setting
+from url import file_lock
+
+
+# 每个视频文件夹下的元数据文件名, 每行一个视频的 json
+METADATA_FILE_NAME = 'metadata.jsonl'
+
+
+class MetaStore:
+    def __init__(self, dir_path: str, batch_size: int = 256, flush_interval: float = 2.0):
+        """
+        一个视频文件夹的元数据存储, 所有视频的元数据追加写入 dir_path/metadata.jsonl
+
+        append 只放入队列, 由后台线程批量写入, 每批只加锁写入一次, 多个进程可以同时写入同一个文件
+
+        :param dir_path: 视频文件夹, 如 setting.WANGYI_VIDEO_PATH
+
+        :param batch_size: 每批最多写入的记录数
+
+        :param flush_interval: 队列中的记录最多等待的时间(s)
+        """
+        self.path = os.path.join(dir_path, METADATA_FILE_NAME)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.num_written = 0
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+    def append(self, record: dict):
+        """
+        追加一条元数据, 不等待写入
+
+        :param record: 元数据, 无法被 json 序列化的值保存为字符串
+        """
+        self.queue.put(record)
+
+    def _worker(self):
+        closed = False
+        while not closed:
+            record = self.queue.get()
+            if record is None:
+                break
+
+            batch = [record]
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    record = self.queue.get(timeout=max(0.0, deadline - time.time()))
+                except queue.Empty:
+                    break
+                if record is None:
+                    closed = True
+                    break
+                batch.append(record)
+
+            try:
+                self._write(batch)
+            except Exception as e:
+                print(f'{self.path} 写入 {len(batch)} 条元数据失败: {e}')
+
+    def _write(self, batch: List[dict]):
+        lines = ''.join(json.dumps(record, ensure_ascii=False, default=str) + '\n' for record in batch)
+        with file_lock(self.path) as f:
+            f.write(lines)
+        self.num_written += len(batch)
+
+    def close(self):
+        """
+        写入队列中剩余的记录后退出后台线程
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+
+_stores: Dict[str, MetaStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(dir_path: str) -> MetaStore:
+    """
+    视频文件夹对应的全局 MetaStore, 程序退出时写入剩余的记录
+    """
+    dir_path = os.path.abspath(dir_path)
+    with _stores_lock:
+        if dir_path not in _stores:
+            _stores[dir_path] = MetaStore(dir_path)
+            atexit.register(_stores[dir_path].close)
+        return _stores[dir_path]
+
+
+def record_video(save_path: str, video_url: str, _video_info: Optional[dict], video_path: Optional[str] = None):
+    """
+    记录一个下载完成的视频, setting.METASTORE_ENABLED 关闭时不记录
+
+    :param save_path: 视频所在的文件夹 xxx/{id}, 元数据写入上级的视频文件夹
+
+    :param video_url: 视频url
+
+    :param _video_info: 视频信息
+
+    :param video_path: 视频文件地址, 用于记录文件大小
+    """
+    if not setting.METASTORE_ENABLED:
+        return
+
+    save_path = os.path.abspath(save_path)
+    record = {
+        'id': os.path.basename(save_path),
+        'site': os.path.basename(os.path.dirname(save_path)),
+        'url': video_url,
+        'downloaded_at': time.time(),
+        'size': os.path.getsize(video_path) if video_path and os.path.exists(video_path) else None,
+        'info': _video_info,
+    }
+    get_store(os.path.dirname(save_path)).append(record)
+
+
+def flatten(record: dict, prefix: str = '') -> dict:
+    """
+    将嵌套的 dict 展开为以 . 连接的列名, 如 {'info': {'title': ..}} -> {'info.title': ..}
+    """
+    flat = {}
+    for key, value in record.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict) and value:
+            flat.update(flatten(value, name + '.'))
+        else:
+            flat[name] = value
+    return flat
+
+
+def iter_records(dir_path: str) -> Iterator[dict]:
+    """
+    流式读取视频文件夹的元数据, 跳过写了一半的行
+    """
+    path = os.path.join(dir_path, METADATA_FILE_NAME)
+    if not os.path.exists(path):
+        return
+
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def load_columns(dir_path: str, columns: Optional[Iterable[str]] = None, unique: bool = True) -> Dict[str, list]:
+    """
+    按列读取视频文件夹中所有视频的元数据, 不需要打开每个视频的子文件夹
+
+    columns = load_columns(setting.WANGYI_VIDEO_PATH, ['id', 'size', 'info.title'])
+
+    :param dir_path: 视频文件夹
+
+    :param columns: 需要的列名, 嵌套字段以 . 连接, 为 None 时返回所有列
+
+    :param unique: 同一个 id 有多条记录时 (如重新下载) 只保留最后一条
+
+    :return: 列名 -> 值列表, 各列长度相同, 缺失的值为 None
+    """
+    records = iter_records(dir_path)
+    if unique:
+        latest = {}
+        for record in records:
+            latest.pop(record.get('id'), None)
+            latest[record.get('id')] = record
+        records = latest.values()
+
+    columns = list(columns) if columns is not None else None
+    table: Dict[str, list] = {name: [] for name in columns} if columns is not None else {}
+    num_rows = 0
+    for record in records:
+        flat = flatten(record)
+        if columns is None:
+            for name in flat:
+                if name not in table:
+                    table[name] = [None] * num_rows
+        for name, values in table.items():
+            values.append(flat.get(name))
+        num_rows += 1
+
+    return table
+
+
+def parse_video_info(text: str) -> Any:
+    """
+    解析 video_info.txt, 兼容 download_video 写入的 k: v 格式与 write_video_info 写入的 str(dict) 格式
+    """
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        pass
+
+    info = {}
+    for line in text.splitlines():
+        key, sep, value = line.partition(': ')
+        if not sep:
+            continue
+        try:
+            info[key] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            info[key] = value
+    return info
+
+
+def backfill(dir_path: str) -> int:
+    """
+    将视频文件夹中已有的 video_info.txt 导入元数据文件, 已经记录的 id 会跳过
+
+    :return: 导入的视频数量
+    """
+    known = {record.get('id') for record in iter_records(dir_path)}
+    store = MetaStore(dir_path)
+    num_imported = 0
+    for entry in os.scandir(dir_path):
+        info_path = os.path.join(entry.path, 'video_info.txt')
+        if entry.name in known or not entry.is_dir() or not os.path.exists(info_path):
+            continue
+
+        with open(info_path, 'r', encoding='utf-8') as f:
+            info = parse_video_info(f.read())
+        video_path = os.path.join(entry.path, 'video.mp4')
+        store.append({
+            'id': entry.name,
+            'site': os.path.basename(os.path.abspath(dir_path)),
+            'url': None,
+            'downloaded_at': os.path.getmtime(info_path),
+            'size': os.path.getsize(video_path) if os.path.exists(video_path) else None,
+            'info': info,
+        })
+        num_imported += 1
+
+    store.close()
+    return num_imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description='视频元数据的导入与统计')
+    parser.add_argument('action', choices=['backfill', 'stats'], help='backfill 导入已有的 video_info.txt, stats 统计元数据')
+    parser.add_argument('dir_paths', nargs='*', default=setting.PATHS, help='视频文件夹, 默认为 setting.PATHS')
+    args = parser.parse_args()
+
+    for dir_path in args.dir_paths:
+        if args.action == 'backfill':
+            print(f'{dir_path}: 导入 {backfill(dir_path)} 个视频')
+        else:
+            start = time.time()
+            table = load_columns(dir_path, ['id', 'size'])
+            sizes = [size for size in table['size'] if size]
+            print(f'{dir_path}: {len(table["id"])} 个视频, 共 {sum(sizes) / 1024 ** 3:.2f}GB, '
+                  f'读取耗时 {time.time() - start:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+import json
+import time
+import atexit
+import bisect
+import itertools
+import threading
+from typing import Dict, Tuple, Optional
+
+import setting
+
+
+# 直方图的默认分桶, 单位(s)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, tuple], float] = {}
+_histograms: Dict[Tuple[str, tuple], list] = {}
+_span_ids = itertools.count(1)
+_local = threading.local()
+_jsonl = None
+
+
+def enabled() -> bool:
+    return setting.METRICS_ENABLED
+
+
+def _key(name: str, labels: dict) -> Tuple[str, tuple]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    """
+    计数器加 value
+
+    :param name: 指标名, 如 download_bytes_total
+
+    :param value: 增加的值
+
+    :param labels: 指标标签, 如 host='v.163.com'
+    """
+    if not setting.METRICS_ENABLED:
+        return
+
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, value: float, **labels):
+    """
+    直方图记录一个值
+
+    :param name: 指标名, 如 segment_seconds
+
+    :param value: 记录的值
+
+    :param labels: 指标标签
+    """
+    if not setting.METRICS_ENABLED:
+        return
+
+    key = _key(name, labels)
+    with _lock:
+        # [各分桶计数, 总和, 总数]
+        hist = _histograms.setdefault(key, [[0] * (len(DEFAULT_BUCKETS) + 1), 0, 0])
+        hist[0][bisect.bisect_left(DEFAULT_BUCKETS, value)] += 1
+        hist[1] += value
+        hist[2] += 1
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    def __init__(self, name: str, attrs: dict, parent: Optional['Span'] = None):
+        """
+        一段计时区间, 嵌套的 span 会记录父 span, 结束时写入 jsonl 并记录 span_seconds 直方图
+
+        :param parent: 在其他线程中开始的父 span, 如音频提取线程中的 video span, 为 None 时使用当前线程的上一层 span
+        """
+        self.name = name
+        self.attrs = attrs
+        self.span_id = next(_span_ids)
+        self.parent = parent
+        self.parent_id = None
+        self.trace_id = self.span_id
+        self.start = 0
+
+    def set(self, **attrs):
+        """
+        补充 span 的属性, 如下载的字节数
+        """
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        stack = _span_stack()
+        parent = self.parent if self.parent is not None else (stack[-1] if stack else None)
+        if parent is not None:
+            self.parent_id = parent.span_id
+            self.trace_id = parent.trace_id
+        stack.append(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        duration = time.time() - self.start
+        _span_stack().pop()
+        observe('span_seconds', duration, span=self.name)
+        _write_jsonl({'type': 'span', 'name': self.name, 'trace_id': self.trace_id, 'span_id': self.span_id,
+                      'parent_id': self.parent_id, 'start': self.start, 'duration': duration,
+                      'error': None if exc_type is None else repr(exc_val), 'attrs': self.attrs})
+        return False
+
+
+def _span_stack() -> list:
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def current_span() -> Optional[Span]:
+    """
+    当前线程最内层的 span, 用于将其他线程中的 span 挂在该 span 下, 没有时返回 None
+    """
+    stack = _span_stack()
+    return stack[-1] if stack else None
+
+
+def span(name: str, parent: Optional[Span] = None, **attrs):
+    """
+    记录一段计时区间, 关闭指标时返回不做任何事的 span
+
+    with metrics.span('video', site='wangyi', id=vid):
+        with metrics.span('download'):
+            ...
+
+    :param name: span 名称, 如 video, parse, download, merge, extract_audio
+
+    :param parent: 父 span, 见 current_span, 为 None 时使用当前线程的上一层 span
+
+    :param attrs: span 属性
+    """
+    if not setting.METRICS_ENABLED:
+        return _NOOP_SPAN
+    return Span(name, attrs, parent)
+
+
+def _write_jsonl(record: dict):
+    global _jsonl
+    if setting.METRICS_JSONL_PATH is None:
+        return
+
+    line = json.dumps(record, ensure_ascii=False, default=str) + '\n'
+    with _lock:
+        if _jsonl is None:
+            _jsonl = open(setting.METRICS_JSONL_PATH, 'a', encoding='utf-8')
+        _jsonl.write(line)
+
+
+def _format_labels(labels: tuple, extra: Optional[tuple] = None) -> str:
+    labels = labels + (extra, ) if extra else labels
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+def prometheus_text() -> str:
+    """
+    :return: Prometheus 文本格式的所有指标
+    """
+    lines = []
+    with _lock:
+        last_name = None
+        for (name, labels), value in sorted(_counters.items()):
+            if name != last_name:
+                lines.append(f'# TYPE {name} counter')
+                last_name = name
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+
+        last_name = None
+        for (name, labels), (buckets, total, count) in sorted(_histograms.items()):
+            if name != last_name:
+                lines.append(f'# TYPE {name} histogram')
+                last_name = name
+            cumulative = 0
+            for bound, bucket in zip(DEFAULT_BUCKETS + ('+Inf', ), buckets):
+                cumulative += bucket
+                lines.append(f'{name}_bucket{_format_labels(labels, ("le", bound))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {total}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def dump():
+    """
+    将指标写入 setting.METRICS_PROM_PATH, 并关闭 jsonl 文件
+    """
+    global _jsonl
+    if not setting.METRICS_ENABLED:
+        return
+
+    if setting.METRICS_PROM_PATH is not None:
+        with open(setting.METRICS_PROM_PATH, 'w', encoding='utf-8') as f:
+            f.write(prometheus_text())
+
+    with _lock:
+        if _jsonl is not None:
+            _jsonl.close()
+            _jsonl = None
+
+
+atexit.register(dump)
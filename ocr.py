@@ -7,6 +7,7 @@ import cv2
 import pysrt
 
 from delay import run_date
+from profiler import Profiler, stage
 
 # 关闭paddleocr的日志输出
 logging.disable(logging.DEBUG)
@@ -69,25 +70,37 @@ class SubTitleBox:
         return t1 <= t2
 
 
-def image_ocr(img: Union[np.ndarray, str, bytes, list]) -> Optional[List[SubTitleBox]]:
+def image_ocr(img: Union[np.ndarray, str, bytes, list], profiler: Optional[Profiler] = None) -> Optional[List[SubTitleBox]]:
     """
     识别图片中的文字
 
     :param img: 图片路径或图片数据
 
+    :param profiler: 阶段分析器, 检测与识别在 PaddleOCR 的一次调用中完成, 记录为 det_rec 阶段
+
     :return: 识别结果列表，每个元素为字典，包含文字位置信息、文字内容、置信度, 若识别失败则返回空列表
     """
     global OCR
     if OCR is None:
-        OCR = PaddleOCR(use_angle_cls=True, lang="ch")
+        with stage(profiler, 'load_model'):
+            OCR = PaddleOCR(use_angle_cls=True, lang="ch")
     try:
-        return [SubTitleBox(paddle_ocr_ret=ret) for ret in OCR.ocr(img, cls=True)[0]]
+        with stage(profiler, 'det_rec'):
+            ret = OCR.ocr(img, cls=True)[0]
+        with stage(profiler, 'boxes'):
+            return [SubTitleBox(paddle_ocr_ret=r) for r in ret]
     except Exception:
         return []
 
 
 class VideoOCR:
-    def __init__(self, video: Union[cv2.VideoCapture, str]):
+    def __init__(self, video: Union[cv2.VideoCapture, str], profiler: Optional[Profiler] = None):
+        """
+        :param video: 视频路径或cv2.VideoCapture对象
+
+        :param profiler: 阶段分析器, 为 None 时不记录
+        """
+        self.profiler = profiler
         if isinstance(video, str):
             self.video = cv2.VideoCapture(video)
         else:
@@ -121,31 +134,41 @@ class VideoOCR:
         if skip_frames is None:
             skip_frames = self.get(cv2.CAP_PROP_FPS)
 
+        profiler = self.profiler
         # 已经读取的帧数
         frame_count = 0
         subitems: List[SubTitleBox] = []
         while True:
-            ret, frame = self.video.read()
+            with stage(profiler, 'decode'):
+                ret, frame = self.video.read()
             if not ret:
                 break
 
             if frame_count % skip_frames == 0:
-                # 截取下半部分图片进行识别
-                subtitle_boxes = image_ocr(frame[2 * frame.shape[0] // 3:])
-
-                start = max(0, int((frame_count - skip_frames) * self.frame_duration))
-                end = int(frame_count * self.frame_duration)
-
-                # 从下往上放入
-                for box in subtitle_boxes[::-1]:
-                    subitems.append(SubTitleBox(l_bottom=box.l_bottom, r_bottom=box.r_bottom, l_top=box.l_top, r_top=box.r_top, text=box.text, confidence=box.confidence, start_time=start, end_time=end))
+                with stage(profiler, 'frame'):
+                    # 截取下半部分图片进行识别
+                    with stage(profiler, 'crop'):
+                        crop = frame[2 * frame.shape[0] // 3:]
+                    subtitle_boxes = image_ocr(crop, profiler)
+
+                    start = max(0, int((frame_count - skip_frames) * self.frame_duration))
+                    end = int(frame_count * self.frame_duration)
+
+                    # 从下往上放入
+                    for box in subtitle_boxes[::-1]:
+                        subitems.append(SubTitleBox(l_bottom=box.l_bottom, r_bottom=box.r_bottom, l_top=box.l_top, r_top=box.r_top, text=box.text, confidence=box.confidence, start_time=start, end_time=end))
+                if profiler is not None:
+                    profiler.count('ocr_frames')
             frame_count += 1
 
+        if profiler is not None:
+            profiler.count('decoded_frames', frame_count)
         return subitems
 
 
 @run_date
-def subtitle_ocr(video: Union[cv2.VideoCapture, str], srt_path: str, skip_frames: int = 10, eps: float = 3, max_sec: int = 5) -> int:
+def subtitle_ocr(video: Union[cv2.VideoCapture, str], srt_path: str, skip_frames: int = 10, eps: float = 3, max_sec: int = 5,
+                 profiler: Optional[Profiler] = None) -> int:
     """
     识别视频中的字幕, 智能过滤背景噪声
 
@@ -159,9 +182,11 @@ def subtitle_ocr(video: Union[cv2.VideoCapture, str], srt_path: str, skip_frames
 
     :param max_sec: 字幕出现的最大秒数，超过秒数则将该字幕加入黑名单
 
+    :param profiler: 阶段分析器, 记录解码, 裁剪, 识别, 过滤, 保存各阶段的耗时, 为 None 时不记录
+
     :return: 返回实际保存的字幕数量
     """
-    with VideoOCR(video) as video:
+    with VideoOCR(video, profiler) as video:
         # 视频x轴的中点
         half_w = video.video.get(cv2.CAP_PROP_FRAME_WIDTH) / 2
         # 字幕黑名单
@@ -187,28 +212,32 @@ def subtitle_ocr(video: Union[cv2.VideoCapture, str], srt_path: str, skip_frames
             return abs((_box.l_top[0] + _box.r_top[0]) / 2 - half_w) < eps
 
         selected_boxes = []
-        for box in video.ocr(skip_frames):
-            # 不在黑名单中, 且在识别框居中
-            if not check_black_list(box) and check_middle(box):
-                counter.setdefault(box.text, 0)
-                counter[box.text] += 1  # 字幕出现次数 + 1
-
-                if selected_boxes and selected_boxes[-1].text == box.text:
-                    # 上一个字幕框与当前字幕框相同, 更新结束时间
-                    selected_boxes[-1].end = box.end_time
-                else:
-                    # 新增字幕框
-                    selected_boxes.append(pysrt.SubRipItem(index=len(selected_boxes) + 1,
-                                                           text=box.text,
-                                                           start=box.start_time,
-                                                           end=box.end_time))
-
-        # print(black_list)
-        # print([box.text for box in selected_boxes])
-        # print(counter)
-
-        save_srt = filter(lambda _box: _box.text not in black_list, selected_boxes)
+        boxes = video.ocr(skip_frames)
+        with stage(profiler, 'filter'):
+            for box in boxes:
+                # 不在黑名单中, 且在识别框居中
+                if not check_black_list(box) and check_middle(box):
+                    counter.setdefault(box.text, 0)
+                    counter[box.text] += 1  # 字幕出现次数 + 1
+
+                    if selected_boxes and selected_boxes[-1].text == box.text:
+                        # 上一个字幕框与当前字幕框相同, 更新结束时间
+                        selected_boxes[-1].end = box.end_time
+                    else:
+                        # 新增字幕框
+                        selected_boxes.append(pysrt.SubRipItem(index=len(selected_boxes) + 1,
+                                                               text=box.text,
+                                                               start=box.start_time,
+                                                               end=box.end_time))
+
+            # print(black_list)
+            # print([box.text for box in selected_boxes])
+            # print(counter)
+
+            save_srt = filter(lambda _box: _box.text not in black_list, selected_boxes)
+
         # 保存字幕文件
-        sub_rip_file = pysrt.SubRipFile(save_srt)
-        sub_rip_file.save(srt_path, encoding='utf-8')
+        with stage(profiler, 'save'):
+            sub_rip_file = pysrt.SubRipFile(save_srt)
+            sub_rip_file.save(srt_path, encoding='utf-8')
         return len(sub_rip_file)
@@ -0,0 +1,242 @@
+import os
+import threading
+from collections import deque
+from typing import Callable, Iterable, Iterator, Optional, Tuple, Any
+from concurrent.futures import ThreadPoolExecutor as Pool, Future, wait, FIRST_COMPLETED
+
+
+def default_workers() -> int:
+    """
+    默认的并发数, 等于 cpu 核数
+    """
+    return os.cpu_count() or 1
+
+
+class BoundedPool(Pool):
+    def __init__(self, max_workers: Optional[int] = None, max_pending: Optional[int] = None):
+        """
+        提交任务数有上限的线程池, 等待执行的任务达到 max_pending 时 submit 会阻塞
+
+        用于任务发现快于下载时, 避免一次性提交所有任务
+
+        :param max_workers: 线程数, 默认为 cpu 核数
+
+        :param max_pending: 最多同时提交的任务数, 默认为 max_workers 的两倍
+        """
+        max_workers = max_workers or default_workers()
+        super().__init__(max_workers=max_workers)
+        self._slots = threading.BoundedSemaphore(max_pending or max_workers * 2)
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        self._slots.acquire()
+        try:
+            future = super().submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda _future: self._slots.release())
+        return future
+
+
+def imap_unordered(func: Callable, iterable: Iterable, workers: Optional[int] = None,
+                   max_pending: Optional[int] = None) -> Iterator[Tuple[Any, Future]]:
+    """
+    并发地对 iterable 的每个元素执行 func, 按完成顺序返回结果
+
+    输入是惰性读取的, 同一时间最多只有 max_pending 个任务在执行或等待
+
+    :param func: 对每个元素执行的函数
+
+    :param iterable: 输入元素
+
+    :param workers: 线程数, 默认为 cpu 核数
+
+    :param max_pending: 最多同时提交的任务数, 默认为 workers 的两倍
+
+    :return: (输入元素, 已完成的 Future) 的迭代器, 异常保存在 Future 中, 由调用者处理
+    """
+    workers = workers or default_workers()
+    max_pending = max_pending or workers * 2
+
+    iterator = iter(iterable)
+    with Pool(max_workers=workers) as pool:
+        pending = {}
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < max_pending:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[pool.submit(func, item)] = item
+
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future
+
+
+def imap_ordered(func: Callable, iterable: Iterable, workers: Optional[int] = None,
+                 max_pending: Optional[int] = None) -> Iterator[Tuple[Any, Future]]:
+    """
+    并发地对 iterable 的每个元素执行 func, 按输入顺序返回结果
+
+    与 imap_unordered 相同, 输入是惰性读取的, 同一时间最多只有 max_pending 个任务在执行或等待
+
+    :param func: 对每个元素执行的函数
+
+    :param iterable: 输入元素
+
+    :param workers: 线程数, 默认为 cpu 核数
+
+    :param max_pending: 最多同时提交的任务数, 默认为 workers 的两倍
+
+    :return: (输入元素, 已完成的 Future) 的迭代器, 异常保存在 Future 中, 由调用者处理
+    """
+    workers = workers or default_workers()
+    max_pending = max_pending or workers * 2
+
+    iterator = iter(iterable)
+    with Pool(max_workers=workers) as pool:
+        pending = deque()
+        for item in iterator:
+            pending.append((item, pool.submit(func, item)))
+            if len(pending) >= max_pending:
+                item, future = pending.popleft()
+                wait([future])
+                yield item, future
+
+        while pending:
+            item, future = pending.popleft()
+            wait([future])
+            yield item, future
+
+
+def prefetch(fetch: Callable, keys: Iterable, ahead: int = 2,
+             stop: Optional[Callable[[Any], bool]] = None) -> Iterator[Tuple[Any, Any]]:
+    """
+    在后台预先获取后续 ahead 个分页, 按 keys 的顺序返回
+
+    调用者处理当前页时, 后续分页已经在请求中, 列表请求不再阻塞下载
+
+    :param fetch: 获取一个分页的函数, 参数为 key
+
+    :param keys: 分页的 key, 如页码
+
+    :param ahead: 预取的分页数量
+
+    :param stop: 判断是否停止的函数, 参数为分页结果, 返回 True 时停止并取消尚未开始的预取, 如遇到空页
+
+    :return: (key, 分页结果) 的迭代器, fetch 抛出的异常会在对应分页处重新抛出
+    """
+    pool = Pool(max_workers=max(1, ahead))
+    pending = deque()
+    iterator = iter(keys)
+    try:
+        for key in iterator:
+            pending.append((key, pool.submit(fetch, key)))
+            if len(pending) > ahead:
+                break
+
+        while pending:
+            key, future = pending.popleft()
+            result = future.result()
+            yield key, result
+            if stop is not None and stop(result):
+                return
+
+            for next_key in iterator:
+                pending.append((next_key, pool.submit(fetch, next_key)))
+                break
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+class CompletionTracker:
+    def __init__(self, on_complete: Callable[[Any, bool], None]):
+        """
+        跟踪每组任务的完成情况, 一组任务全部完成后调用 on_complete
+
+        一组任务可以在发现过程中陆续加入, 调用 close 表示该组不会再有新任务
+
+        :param on_complete: 回调函数, 参数为组的 key 以及该组任务是否全部成功
+        """
+        self.on_complete = on_complete
+        self.pending = {}
+        self.failed = set()
+        self.closed = set()
+        self.lock = threading.Lock()
+
+    def add(self, key, future: Future):
+        """
+        将一个任务加入 key 组
+
+        :param key: 组的 key, 如页码
+
+        :param future: 任务的 Future
+        """
+        with self.lock:
+            self.pending[key] = self.pending.get(key, 0) + 1
+        future.add_done_callback(lambda _future: self._done(key, _future))
+
+    def expect(self, key) -> Future:
+        """
+        将一个不在线程池中执行的任务加入 key 组, 如交给 CrawlEngine 下载的任务, 任务结束时调用 finish_future
+
+        :param key: 组的 key
+
+        :return: 任务的 Future
+        """
+        future = Future()
+        self.add(key, future)
+        return future
+
+    def close(self, key, ok: bool = True):
+        """
+        表示 key 组不会再加入新任务
+
+        :param key: 组的 key
+
+        :param ok: 为 False 时表示该组的任务发现失败, 该组会被视为未全部成功
+        """
+        with self.lock:
+            self.closed.add(key)
+            if not ok:
+                self.failed.add(key)
+        self._check(key)
+
+    def _done(self, key, future: Future):
+        with self.lock:
+            self.pending[key] -= 1
+            if future.cancelled() or future.exception() is not None:
+                self.failed.add(key)
+        self._check(key)
+
+    def _check(self, key):
+        with self.lock:
+            if key not in self.closed or self.pending.get(key, 0) > 0:
+                return
+            self.closed.discard(key)
+            self.pending.pop(key, None)
+            ok = key not in self.failed
+            self.failed.discard(key)
+
+        self.on_complete(key, ok)
+
+
+def finish_future(future: Future, ok: bool):
+    """
+    结束 CompletionTracker.expect 返回的 Future
+
+    :param future: 任务的 Future
+
+    :param ok: 任务是否成功
+    """
+    if ok:
+        future.set_result(None)
+    else:
+        future.set_exception(RuntimeError('任务失败'))
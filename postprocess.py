@@ -0,0 +1,113 @@
+import os
+import atexit
+import queue
+import threading
+from typing import Optional
+
+import m3u8
+import metrics
+import setting
+import storage
+import transcode
+
+
+class AudioStage:
+    def __init__(self, workers: int = 2, audio_format: str = 'wav', cover: bool = False, max_pending: int = 0):
+        """
+        下载后的音频提取阶段
+
+        爬虫下载完成后将 video.mp4 放入队列, 由独立的线程池提取音频并写入 audio_info.txt, 下载线程不会等待转码
+
+        :param workers: 转码线程数
+
+        :param audio_format: 音频格式, 见 transcode.AUDIO_FORMATS
+
+        :param cover: 当文件存在时是否覆盖, 默认为 False
+
+        :param max_pending: 队列长度, 队列满时 submit 阻塞, 转码跟不上下载时让下载等待, 0 表示不限制
+        """
+        self.audio_format = audio_format
+        self.cover = cover
+        self.queue = queue.Queue(max_pending)
+        self.num_done = 0
+        self.num_failed = 0
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def qsize(self) -> int:
+        """
+        :return: 等待转码的视频数量
+        """
+        return self.queue.qsize()
+
+    def submit(self, video_path: str):
+        """
+        提交一个下载完成的视频
+
+        :param video_path: 视频文件地址 xxx/video.mp4
+        """
+        # 提取音频的 span 挂在提交时的 span 下, 与视频的下载记录在同一个 trace 中
+        self.queue.put((video_path, metrics.current_span()))
+        print(f'音频队列 +1 {video_path}, 当前队列长度 {self.qsize()}')
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+
+            video_path, parent = item
+            try:
+                with metrics.span('extract_audio', parent=parent, video=video_path):
+                    result = transcode.extract_audio(video_path, audio_format=self.audio_format, cover=self.cover)
+                if result['ok']:
+                    m3u8.write_audio_info(result['audio_path'], cover=self.cover)
+                else:
+                    print(f'{video_path} 提取音频失败: {result["error"]}')
+            except Exception as e:
+                result = {'ok': False}
+                print(f'{video_path} 提取音频失败: {e}')
+            finally:
+                storage.get_governor().complete(os.path.dirname(video_path))
+                self.queue.task_done()
+
+            with self.lock:
+                if result['ok']:
+                    self.num_done += 1
+                else:
+                    self.num_failed += 1
+                print(f'音频提取 完成 {self.num_done} 失败 {self.num_failed} 队列剩余 {self.qsize()}')
+
+    def close(self):
+        """
+        等待队列中的视频全部转码完成后退出线程
+        """
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+_audio_stage = None
+_audio_stage_lock = threading.Lock()
+
+
+def get_audio_stage() -> Optional[AudioStage]:
+    """
+    根据 setting 创建的全局 AudioStage, 第一次调用时创建, 同一进程中的所有站点共用, 程序退出时等待队列处理完毕
+
+    :return: AudioStage, setting.AUDIO_STAGE_WORKERS 为 0 时返回 None
+    """
+    global _audio_stage
+    if setting.AUDIO_STAGE_WORKERS <= 0:
+        return None
+
+    with _audio_stage_lock:
+        if _audio_stage is None:
+            _audio_stage = AudioStage(setting.AUDIO_STAGE_WORKERS, setting.AUDIO_STAGE_FORMAT,
+                                      max_pending=setting.AUDIO_STAGE_QUEUE_SIZE)
+            atexit.register(_audio_stage.close)
+        return _audio_stage
@@ -0,0 +1,270 @@
+import math
+import time
+import heapq
+import itertools
+import threading
+from typing import Any, Dict, Optional
+
+
+# 调度模式
+# fifo: 按发现顺序下载
+# sjf: 视频时长最短的优先下载
+# quota: 每个分类最多下载 quotas 指定的视频时长, 已下载时长最少的分类优先, 分类内 score 最高的优先
+# deadline: 在截止时间前, 按 score / 预计时长 从高到低下载, 预计无法在截止时间前完成的任务直接丢弃
+MODES = ('fifo', 'sjf', 'quota', 'deadline')
+
+# 只知道文件大小时, 按该码率(字节/s)估算视频时长, 约 2Mbps
+NOMINAL_BYTE_RATE = 256 * 1024
+
+# 下载耗时 / 视频时长 的滑动平均系数
+RATE_ALPHA = 0.2
+
+
+def parse_duration(value: Any) -> Optional[float]:
+    """
+    解析列表元数据中的时长, 支持数字, 数字字符串, 以及 mm:ss, hh:mm:ss 格式
+
+    :return: 时长(s), 无法解析时返回 None
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) if value > 0 else None
+    if not isinstance(value, str) or not value.strip():
+        return None
+
+    try:
+        seconds = 0.0
+        for part in value.strip().split(':'):
+            seconds = seconds * 60 + float(part)
+        return seconds if seconds > 0 else None
+    except ValueError:
+        return None
+
+
+def find_meta(data: dict, duration_keys=('duration', 'length', 'videoDuration'),
+              size_keys=('size', 'fileSize', 'videoSize')) -> dict:
+    """
+    在列表元数据中查找时长与大小
+
+    :param data: 列表中一个视频的元数据
+
+    :return: {'duration': 时长(s), 'size': 大小(字节)}, 只包含找到的字段
+    """
+    meta = {}
+    for key in duration_keys:
+        duration = parse_duration(data.get(key))
+        if duration is not None:
+            meta['duration'] = duration
+            break
+
+    for key in size_keys:
+        size = data.get(key)
+        if isinstance(size, (int, float)) and not isinstance(size, bool) and size > 0:
+            meta['size'] = size
+            break
+
+    return meta
+
+
+def video_seconds(meta: dict) -> float:
+    """
+    任务的视频时长, 没有时长时按大小估算, 两者都没有时返回 inf
+    """
+    if meta.get('duration'):
+        return meta['duration']
+    if meta.get('size'):
+        return meta['size'] / NOMINAL_BYTE_RATE
+    return math.inf
+
+
+def task_score(meta: dict) -> float:
+    """
+    任务的价值, 默认为视频时长, 时长未知时为 0
+    """
+    if meta.get('score') is not None:
+        return meta['score']
+    seconds = video_seconds(meta)
+    return 0 if math.isinf(seconds) else seconds
+
+
+class TaskQueue:
+    def __init__(self, mode: str = 'fifo', maxsize: int = 0, quotas: Optional[Dict[str, float]] = None,
+                 deadline: Optional[float] = None):
+        """
+        带优先级的有界任务队列, 接口与 queue.Queue 的 put / get / qsize 相同
+
+        任务的元数据 meta 可以包含 duration 时长(s), size 大小(字节), category 分类, score 价值,
+        score 默认为视频时长, 即优先下载更多的视频时长
+
+        put(None) 为结束标记, 不受 maxsize 限制, 队列中的任务全部取出后才会返回
+
+        :param mode: 调度模式, 见 MODES
+
+        :param maxsize: 队列长度, 队列满时 put 阻塞, 0 表示不限制
+
+        :param quotas: quota 模式下每个分类最多下载的视频时长(s), 未指定的分类不限制
+
+        :param deadline: deadline 模式的截止时间, time.time() 的时间戳
+        """
+        if mode not in MODES:
+            raise ValueError(f'调度模式应为 {MODES} 之一, 而不是 {mode}')
+        if mode == 'deadline' and deadline is None:
+            raise ValueError('deadline 模式需要指定截止时间')
+
+        self.mode = mode
+        self.maxsize = maxsize
+        self.quotas = quotas or {}
+        self.deadline = deadline
+        # 分类 -> [(排序 key, 序号, 任务, 元数据)]
+        self.heaps: Dict[str, list] = {}
+        # 每个分类已经取出的视频时长
+        self.served: Dict[str, float] = {}
+        self.size = 0
+        self.num_end = 0
+        self.num_dropped = 0
+        # 下载耗时 / 视频时长, 由 record 更新
+        self.rate = None
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+
+    def _key(self, meta: dict) -> float:
+        """
+        同一分类内的排序 key, 越小越先下载
+        """
+        if self.mode == 'sjf':
+            return video_seconds(meta)
+        if self.mode == 'quota':
+            return -task_score(meta)
+        if self.mode == 'deadline':
+            seconds = video_seconds(meta)
+            if math.isinf(seconds):
+                return math.inf
+            return -task_score(meta) / max(seconds, 1)
+        return 0
+
+    def _category(self, meta: dict) -> str:
+        return meta.get('category', '') if self.mode == 'quota' else ''
+
+    def _over_quota(self, category: str, meta: dict) -> bool:
+        if category not in self.quotas:
+            return False
+        seconds = video_seconds(meta)
+        return self.served.get(category, 0) + (0 if math.isinf(seconds) else seconds) > self.quotas[category]
+
+    def _too_late(self, meta: dict) -> bool:
+        """
+        deadline 模式下, 预计在截止时间后才能下载完成
+        """
+        if self.mode != 'deadline':
+            return False
+
+        remaining = self.deadline - time.time()
+        if remaining <= 0:
+            return True
+        seconds = video_seconds(meta)
+        return self.rate is not None and not math.isinf(seconds) and seconds * self.rate > remaining
+
+    def expired(self) -> bool:
+        """
+        deadline 模式下已经超过截止时间, 之后放入的任务都会被丢弃
+        """
+        return self.mode == 'deadline' and time.time() >= self.deadline
+
+    def put(self, task: Any, meta: Optional[dict] = None):
+        """
+        放入一个任务, 队列满时阻塞
+
+        :param task: 任务, None 为结束标记
+
+        :param meta: 任务的元数据
+        """
+        with self.cond:
+            if task is None:
+                self.num_end += 1
+                self.cond.notify_all()
+                return
+
+            meta = meta or {}
+            category = self._category(meta)
+            if self._over_quota(category, meta) or self.expired():
+                self.num_dropped += 1
+                return
+
+            while self.maxsize > 0 and self.size >= self.maxsize:
+                self.cond.wait()
+
+            heapq.heappush(self.heaps.setdefault(category, []), (self._key(meta), next(self.counter), task, meta))
+            self.size += 1
+            self.cond.notify_all()
+
+    def _pop(self) -> Optional[tuple]:
+        """
+        取出下一个任务, 丢弃超出配额或来不及完成的任务, 队列为空时返回 None
+        """
+        while self.size > 0:
+            categories = [category for category, heap in self.heaps.items() if heap]
+            # 已下载视频时长最少的分类优先
+            category = min(categories, key=lambda _category: self.served.get(_category, 0))
+            _, _, task, meta = heapq.heappop(self.heaps[category])
+            self.size -= 1
+            self.cond.notify_all()
+
+            if self._over_quota(category, meta) or self._too_late(meta):
+                self.num_dropped += 1
+                continue
+
+            seconds = video_seconds(meta)
+            self.served[category] = self.served.get(category, 0) + (0 if math.isinf(seconds) else seconds)
+            return task, meta
+
+        return None
+
+    def get(self) -> Any:
+        """
+        取出下一个任务, 队列为空时阻塞, 队列为空且收到结束标记时返回 None
+        """
+        with self.cond:
+            while True:
+                item = self._pop()
+                if item is not None:
+                    return item[0]
+
+                if self.num_end > 0:
+                    self.num_end -= 1
+                    return None
+                self.cond.wait()
+
+    def record(self, meta: Optional[dict], elapsed: float):
+        """
+        记录一个任务的下载耗时, 用于 deadline 模式估算下载速度, 只应记录实际下载的任务, 跳过的任务见 cancel
+
+        :param meta: 任务的元数据
+
+        :param elapsed: 下载耗时(s)
+        """
+        seconds = video_seconds(meta or {})
+        if math.isinf(seconds):
+            return
+
+        with self.cond:
+            rate = elapsed / max(seconds, 1)
+            self.rate = rate if self.rate is None else (1 - RATE_ALPHA) * self.rate + RATE_ALPHA * rate
+
+    def cancel(self, meta: Optional[dict]):
+        """
+        任务没有实际下载 (已经下载过或下载失败) 时调用, 退回 get 时计入该分类的视频时长
+
+        :param meta: 任务的元数据
+        """
+        seconds = video_seconds(meta or {})
+        if math.isinf(seconds):
+            return
+
+        with self.cond:
+            category = self._category(meta or {})
+            self.served[category] = max(0.0, self.served.get(category, 0) - seconds)
+            self.cond.notify_all()
+
+    def qsize(self) -> int:
+        return self.size
@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import threading
+from contextlib import nullcontext
+from typing import Dict, List, Optional
+
+
+_NULL_CONTEXT = nullcontext()
+
+
+class Profiler:
+    def __init__(self, trace: bool = False):
+        """
+        按阶段记录耗时的分析器
+
+        每个阶段记录墙钟时间与 CPU 时间, 可以输出汇总表以及 Chrome trace (chrome://tracing, perfetto) 格式的 json
+
+        :param trace: 是否记录每一次阶段调用, 用于输出 Chrome trace
+        """
+        self.trace = trace
+        self.wall: Dict[str, List[float]] = {}
+        self.cpu: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.events = []
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def stage(self, name: str) -> '_Stage':
+        """
+        记录一个阶段
+
+        with profiler.stage('decode'):
+            ...
+
+        :param name: 阶段名称
+        """
+        return _Stage(self, name)
+
+    def count(self, name: str, value: int = 1):
+        """
+        记录计数, 如解码帧数, 识别帧数
+        """
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def _record(self, name: str, start: float, wall: float, cpu: float):
+        with self.lock:
+            self.wall.setdefault(name, []).append(wall)
+            self.cpu[name] = self.cpu.get(name, 0) + cpu
+            if self.trace:
+                self.events.append({'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                                    'ts': (start - self.origin) * 1e6, 'dur': wall * 1e6})
+
+    def summary(self) -> str:
+        """
+        :return: 每个阶段的调用次数, 墙钟时间, CPU 时间, 以及单次耗时的 p50 / p90 / p99
+        """
+        lines = [f'{"阶段":<14}{"次数":>8}{"墙钟(s)":>10}{"CPU(s)":>10}{"均值(ms)":>10}'
+                 f'{"p50(ms)":>10}{"p90(ms)":>10}{"p99(ms)":>10}']
+        with self.lock:
+            for name, walls in self.wall.items():
+                walls = sorted(walls)
+                total = sum(walls)
+                lines.append(f'{name:<16}{len(walls):>8}{total:>10.3f}{self.cpu[name]:>10.3f}'
+                             f'{total / len(walls) * 1000:>10.2f}{_percentile(walls, 50) * 1000:>10.2f}'
+                             f'{_percentile(walls, 90) * 1000:>10.2f}{_percentile(walls, 99) * 1000:>10.2f}')
+            for name, value in self.counts.items():
+                lines.append(f'{name:<16}{value:>8}')
+
+        return '\n'.join(lines)
+
+    def write_chrome_trace(self, path: str):
+        """
+        保存 Chrome trace json, 需要 trace=True
+
+        :param path: 保存地址 xxx.json
+        """
+        with self.lock, open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+
+class _Stage:
+    __slots__ = ('profiler', 'name', 'start', 'cpu_start')
+
+    def __init__(self, profiler: Profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.cpu_start = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profiler._record(self.name, self.start, time.perf_counter() - self.start,
+                              time.thread_time() - self.cpu_start)
+        return False
+
+
+def stage(profiler: Optional[Profiler], name: str):
+    """
+    profiler 为 None 时返回空的上下文管理器, 不记录任何数据
+    """
+    if profiler is None:
+        return _NULL_CONTEXT
+    return profiler.stage(name)
+
+
+def _percentile(values: List[float], p: float) -> float:
+    """
+    已排序列表的百分位数
+    """
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
@@ -14,6 +14,14 @@ PATHS.append(WANGYI_LIVE_VIDEO_PATH)
 BRTV_VIDEO_PATH = os.path.join(os.path.dirname(__file__), 'brtv')
 PATHS.append(BRTV_VIDEO_PATH)
 
+# 凤凰网视频文件夹地址
+IFENG_VIDEO_PATH = os.path.join(os.path.dirname(__file__), 'ifeng')
+PATHS.append(IFENG_VIDEO_PATH)
+
+# 直播录制文件夹地址
+LIVE_VIDEO_PATH = os.path.join(os.path.dirname(__file__), 'live')
+PATHS.append(LIVE_VIDEO_PATH)
+
 # acfun视频文件夹地址
 ACFUN_VIDEO_PATH = os.path.join(os.path.dirname(__file__), 'acfun')
 PATHS.append(ACFUN_VIDEO_PATH)
@@ -29,4 +37,78 @@ HEADERS = {
 PROXY = {
     'http': '',
     'https': ''
-}
\ No newline at end of file
+}
+
+# 是否启用 http 响应缓存, 只缓存 HTTP_CACHE_RULES 中匹配的 url
+HTTP_CACHE_ENABLED = True
+
+# http 响应缓存地址
+HTTP_CACHE_PATH = os.path.join(os.path.dirname(__file__), 'http_cache.db')
+
+# (url 正则, 缓存有效期(s)), 按顺序匹配第一个, 有效期内直接使用缓存, 过期后发送条件请求, 有效期为 0 表示不缓存
+HTTP_CACHE_RULES = [
+    (r'https://www\.brtn\.cn/btvprogram', 24 * 3600),           # 北京卫视 栏目列表
+    (r'https://www\.btime\.com/btv/', 24 * 3600),               # 北京卫视 栏目年份列表
+    (r'https://pc\.api\.btime\.com/btimeweb/infoFlow', 6 * 3600),  # 北京卫视 节目列表
+    (r'https://shankapi\.ifeng\.com/api/getVideoStream/', 3600),  # 凤凰网 频道视频列表
+]
+
+# 生成缓存 key 时忽略的 url 参数
+HTTP_CACHE_IGNORE_PARAMS = ('_', 't', 'callback')
+
+# 是否记录下载指标与 span, 关闭时指标函数直接返回
+METRICS_ENABLED = False
+
+# span 记录的 jsonl 文件地址, 为 None 时不记录
+METRICS_JSONL_PATH = os.path.join(os.path.dirname(__file__), 'metrics.jsonl')
+
+# 程序退出时写入的 Prometheus 文本格式指标文件地址, 为 None 时不写入
+METRICS_PROM_PATH = os.path.join(os.path.dirname(__file__), 'metrics.prom')
+
+# 分页列表预取的页数, 下载当前页视频时在后台请求后续的分页
+PREFETCH_PAGES = 3
+
+# 是否将 m3u8 的 ts 分片边下载边通过 ffmpeg 封装为带索引的 MP4, 关闭或 ffmpeg 不可用时直接合并 ts 分片
+HLS_REMUX = True
+
+# ts 分片下载或校验失败时的重试次数, 只重试失败的分片
+SEGMENT_RETRIES = 3
+
+# ts 分片重试的退避时间(s), 第 n 次重试等待 SEGMENT_BACKOFF * 2 ** (n - 1)
+SEGMENT_BACKOFF = 1.0
+
+# 视频文件写入缓冲区大小(字节), 小块写入合并为按 4KB 对齐的大块后再写入磁盘
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+
+# 视频文件的 fsync 策略
+# never: 不调用 fsync, 由操作系统决定何时落盘
+# close: 重命名前 fsync 文件与所在文件夹, 断电后不会留下不完整的视频
+# always: 每次写入磁盘后都 fsync, 吞吐最低
+WRITE_FSYNC = 'never'
+
+# 磁盘最少保留的剩余空间(字节), 低于该值时暂停新的下载, 见 storage.StorageGovernor
+STORAGE_MIN_FREE_BYTES = 2 * 1024 ** 3
+
+# 视频文件夹 -> 最多占用的字节数, 如 {WANGYI_VIDEO_PATH: 500 * 1024 ** 3}, 未指定的文件夹不限制
+STORAGE_QUOTAS = {}
+
+# 下载前不知道文件大小时 (如 m3u8) 预留的空间(字节)
+STORAGE_DEFAULT_RESERVE = 512 * 1024 ** 2
+
+# 下载完成的视频文件夹移动到的归档地址, 为 None 时不归档
+STORAGE_ARCHIVE_PATH = None
+
+# 空间不足时是否删除最早下载的视频文件夹, 会永久删除视频
+STORAGE_EVICT = False
+
+# 是否将下载完成的视频元数据批量追加到视频文件夹下的 metadata.jsonl, 见 metastore.py
+METASTORE_ENABLED = True
+
+# 下载后提取音频的线程数, 0 表示不提取
+AUDIO_STAGE_WORKERS = 0
+
+# 下载后提取的音频格式, 见 transcode.AUDIO_FORMATS
+AUDIO_STAGE_FORMAT = 'wav'
+
+# 等待提取音频的视频数量上限, 超出时下载线程等待, 0 表示不限制
+AUDIO_STAGE_QUEUE_SIZE = 64
@@ -0,0 +1,306 @@
+import os
+import time
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+import metrics
+import setting
+
+
+class Reservation:
+    __slots__ = ('folder', 'path', 'size', 'existing')
+
+    def __init__(self, folder: str, path: str, size: int, existing: int = 0):
+        """
+        一次下载预留的磁盘空间
+
+        :param folder: 所属的视频文件夹
+
+        :param path: 下载的文件地址
+
+        :param size: 预留的字节数
+
+        :param existing: 预留时文件已有的字节数, 覆盖或追加写入时只计入文件大小的变化
+        """
+        self.folder = folder
+        self.path = path
+        self.size = size
+        self.existing = existing
+
+
+class StorageGovernor:
+    def __init__(self, folders: List[str], min_free_bytes: int = 0, quotas: Optional[Dict[str, int]] = None,
+                 default_reserve: int = 512 * 1024 ** 2, poll_interval: float = 30,
+                 archive_hook: Optional[Callable[[str], None]] = None,
+                 evict_hook: Optional[Callable[[str, int], int]] = None):
+        """
+        视频文件夹的磁盘空间控制
+
+        记录每个视频文件夹已占用的字节数与正在下载的字节数, 下载前按 Content-Length 预留空间,
+        磁盘剩余空间 (减去所有正在下载的预留空间) 低于 min_free_bytes, 或文件夹超出配额时, 新的下载阻塞等待,
+        没有正在下载的任务可以释放空间, 或者文件本身超出配额 / 磁盘容量时直接抛出 RuntimeError
+
+        :param folders: 视频文件夹, 如 setting.PATHS, 下载地址按所在的视频文件夹统计
+
+        :param min_free_bytes: 磁盘最少保留的剩余空间(字节)
+
+        :param quotas: 视频文件夹 -> 最多占用的字节数, 未指定的文件夹不限制
+
+        :param default_reserve: 不知道文件大小时预留的字节数
+
+        :param poll_interval: 等待空间时重新检查磁盘剩余空间的间隔(s), 其他进程也可能释放空间
+
+        :param archive_hook: 视频下载完成后调用, 参数为视频所在的文件夹, 可以将视频归档到其他磁盘
+
+        :param evict_hook: 空间不足时调用, 参数为视频文件夹与需要释放的字节数, 返回实际释放的字节数
+        """
+        self.folders = [os.path.abspath(folder) for folder in folders]
+        self.min_free_bytes = min_free_bytes
+        self.quotas = {os.path.abspath(folder): quota for folder, quota in (quotas or {}).items()}
+        self.default_reserve = default_reserve
+        self.poll_interval = poll_interval
+        self.archive_hook = archive_hook
+        self.evict_hook = evict_hook
+        # 视频文件夹 -> 已占用的字节数, 第一次使用时在 cond 之外统计, 见 _measure
+        self.on_disk: Dict[str, int] = {}
+        # 视频文件夹 -> 正在下载的预留字节数
+        self.in_flight: Dict[str, int] = {}
+        self.cond = threading.Condition()
+        # evict_hook 会删除文件, 在 cond 之外执行, 同一时间只有一个线程释放空间
+        self.evict_lock = threading.Lock()
+
+    def folder_of(self, path: str) -> str:
+        """
+        path 所在的视频文件夹, 不在任何视频文件夹中时为 path 的上级文件夹
+        """
+        path = os.path.abspath(path)
+        for folder in self.folders:
+            if path == folder or path.startswith(folder + os.sep):
+                return folder
+        return os.path.dirname(path)
+
+    def _measure(self, folder: str):
+        """
+        第一次使用 folder 时统计已占用的字节数, 遍历文件夹较慢, 不持有 cond, 避免阻塞其他下载线程
+        """
+        with self.cond:
+            if folder in self.on_disk:
+                return
+
+        size = dir_size(folder)
+        with self.cond:
+            self.on_disk.setdefault(folder, size)
+
+    def _on_disk(self, folder: str) -> int:
+        return self.on_disk.get(folder, 0)
+
+    def _blocked(self, folder: str, size: int) -> Optional[int]:
+        """
+        :return: 还需要释放的字节数, 可以下载时返回 None
+        """
+        free = shutil.disk_usage(folder).free if os.path.exists(folder) else 0
+        need = self.min_free_bytes + sum(self.in_flight.values()) + size - free
+        if folder in self.quotas:
+            need = max(need, self._on_disk(folder) + self.in_flight.get(folder, 0) + size - self.quotas[folder])
+        return need if need > 0 else None
+
+    def _check_fits(self, folder: str, path: str, size: int):
+        """
+        文件本身超出配额或磁盘容量时, 等待其他下载释放空间也无法下载, 直接抛出 RuntimeError
+        """
+        if folder in self.quotas and size > self.quotas[folder]:
+            raise RuntimeError(f'{path} 大小 {size / 1024 ** 2:.0f}MB 超出 {folder} 的配额 '
+                               f'{self.quotas[folder] / 1024 ** 2:.0f}MB')
+
+        if os.path.exists(folder) and size + self.min_free_bytes > shutil.disk_usage(folder).total:
+            raise RuntimeError(f'{path} 大小 {size / 1024 ** 2:.0f}MB 加上最少保留空间超出磁盘容量')
+
+    def acquire(self, path: str, size: Optional[int] = None) -> Reservation:
+        """
+        为一次下载预留空间, 空间不足时先调用 evict_hook, 仍然不足时等待其他下载结束
+
+        没有其他正在下载的任务时, 等待不会释放空间, 抛出 RuntimeError
+
+        :param path: 下载的文件地址
+
+        :param size: 文件大小(字节), 如 Content-Length, 为 None 时预留 default_reserve
+        """
+        folder = self.folder_of(path)
+        size = size if size is not None and size >= 0 else self.default_reserve
+        self._check_fits(folder, path, size)
+        self._measure(folder)
+        existing = os.path.getsize(path) if os.path.isfile(path) else 0
+
+        paused = False
+        while True:
+            with self.cond:
+                need = self._blocked(folder, size)
+                if need is None:
+                    self.in_flight[folder] = self.in_flight.get(folder, 0) + size
+                    break
+
+            if self.evict_hook is not None:
+                with self.evict_lock:
+                    freed = self.evict_hook(folder, need)
+                if freed:
+                    with self.cond:
+                        self.on_disk[folder] = max(0, self._on_disk(folder) - freed)
+                    continue
+
+            with self.cond:
+                need = self._blocked(folder, size)
+                if need is None:
+                    continue
+                if not any(self.in_flight.values()):
+                    metrics.inc('storage_rejected_total', folder=os.path.basename(folder))
+                    raise RuntimeError(f'{folder} 空间不足, 还需要 {need / 1024 ** 2:.0f}MB, '
+                                       f'且没有正在下载的任务可以释放空间, 放弃下载 {path}')
+
+                if not paused:
+                    paused = True
+                    metrics.inc('storage_paused_total', folder=os.path.basename(folder))
+                    print(f'{folder} 空间不足, 还需要 {need / 1024 ** 2:.0f}MB, 暂停下载 {path}')
+                self.cond.wait(self.poll_interval)
+
+        if paused:
+            print(f'{folder} 空间已恢复, 继续下载 {path}')
+        return Reservation(folder, path, size, existing)
+
+    def release(self, reservation: Reservation):
+        """
+        下载结束后释放预留空间, 并按实际的文件大小计入已占用的字节数
+        """
+        actual = os.path.getsize(reservation.path) if os.path.isfile(reservation.path) else 0
+        with self.cond:
+            self.in_flight[reservation.folder] -= reservation.size
+            self.on_disk[reservation.folder] = max(0, self._on_disk(reservation.folder) + actual - reservation.existing)
+            self.cond.notify_all()
+
+    @contextmanager
+    def admit(self, path: str, size: Optional[int] = None) -> Iterator[Reservation]:
+        """
+        with governor.admit(save_path, content_length):
+            ...
+        """
+        reservation = self.acquire(path, size)
+        try:
+            yield reservation
+        finally:
+            self.release(reservation)
+
+    def complete(self, video_dir: str):
+        """
+        视频下载 (及后处理) 完成后调用 archive_hook
+        """
+        if self.archive_hook is None or not os.path.isdir(video_dir):
+            return
+
+        folder = self.folder_of(video_dir)
+        self._measure(folder)
+        size = dir_size(video_dir)
+        try:
+            self.archive_hook(video_dir)
+        except Exception as e:
+            print(f'{video_dir} 归档失败: {e}')
+            return
+
+        if not os.path.exists(video_dir):
+            with self.cond:
+                self.on_disk[folder] = max(0, self._on_disk(folder) - size)
+                self.cond.notify_all()
+
+    def status(self) -> str:
+        """
+        :return: 每个视频文件夹已占用与正在下载的字节数
+        """
+        for folder in self.folders:
+            self._measure(folder)
+        with self.cond:
+            return '\n'.join(f'{folder}: 占用 {self._on_disk(folder) / 1024 ** 3:.2f}GB '
+                             f'下载中 {self.in_flight.get(folder, 0) / 1024 ** 2:.0f}MB' for folder in self.folders)
+
+
+def dir_size(dir_path: str) -> int:
+    """
+    文件夹下所有文件的大小之和
+    """
+    total = 0
+    stack = [dir_path]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        total += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue
+    return total
+
+
+def make_archive_hook(archive_path: str) -> Callable[[str], None]:
+    """
+    将下载完成的视频文件夹移动到 archive_path 下对应的视频文件夹
+
+    :param archive_path: 归档地址, 通常在另一块磁盘上
+    """
+    def archive(video_dir: str):
+        dest = os.path.join(archive_path, os.path.basename(os.path.dirname(video_dir)), os.path.basename(video_dir))
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        if os.path.exists(dest):
+            shutil.rmtree(dest)
+        shutil.move(video_dir, dest)
+
+    return archive
+
+
+def evict_oldest(folder: str, need: int) -> int:
+    """
+    删除 folder 下最早修改的视频子文件夹, 直到释放 need 字节, 会永久删除视频
+
+    :return: 实际释放的字节数
+    """
+    try:
+        entries = [entry for entry in os.scandir(folder) if entry.is_dir(follow_symlinks=False)]
+    except OSError:
+        return 0
+
+    freed = 0
+    for entry in sorted(entries, key=lambda _entry: _entry.stat().st_mtime):
+        if freed >= need:
+            break
+        size = dir_size(entry.path)
+        shutil.rmtree(entry.path, ignore_errors=True)
+        freed += size
+        print(f'空间不足, 删除 {entry.path} 释放 {size / 1024 ** 2:.0f}MB')
+
+    return freed
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def get_governor() -> StorageGovernor:
+    """
+    根据 setting 创建的全局 StorageGovernor
+    """
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = StorageGovernor(
+                setting.PATHS,
+                min_free_bytes=setting.STORAGE_MIN_FREE_BYTES,
+                quotas=setting.STORAGE_QUOTAS,
+                default_reserve=setting.STORAGE_DEFAULT_RESERVE,
+                archive_hook=make_archive_hook(setting.STORAGE_ARCHIVE_PATH) if setting.STORAGE_ARCHIVE_PATH else None,
+                evict_hook=evict_oldest if setting.STORAGE_EVICT else None,
+            )
+        return _governor
@@ -0,0 +1,146 @@
+import os
+import time
+import shutil
+from typing import Iterable, Iterator, Optional
+
+import ffmpeg
+
+import m3u8
+from parallel import imap_unordered
+
+
+# 目标格式 -> (ffmpeg format, 可以直接复制的源音频编码, 需要转码时使用的编码)
+AUDIO_FORMATS = {
+    'wav': ('wav', {'pcm_s16le'}, 'pcm_s16le'),
+    'm4a': ('ipod', {'aac'}, 'aac'),
+    'aac': ('adts', {'aac'}, 'aac'),
+    'mp3': ('mp3', {'mp3'}, 'libmp3lame'),
+}
+
+
+def probe_audio(video_path: str) -> Optional[dict]:
+    """
+    获取视频中第一个音频流的编码与时长
+
+    :param video_path: 视频文件地址
+
+    :return: {'codec': 音频编码, 'duration': 时长(s)}, 无音频流或 ffprobe 无法读取视频时返回 None,
+             未安装 ffprobe 时抛出 FileNotFoundError
+    """
+    try:
+        probe = ffmpeg.probe(video_path)
+    except ffmpeg.Error:
+        return None
+
+    for stream in probe['streams']:
+        if stream.get('codec_type') == 'audio':
+            return {
+                'codec': stream.get('codec_name'),
+                'duration': float(stream.get('duration') or probe['format'].get('duration') or 0)
+            }
+
+    return None
+
+
+def extract_audio(video_path: str, audio_path: Optional[str] = None, audio_format: str = 'wav',
+                  cover: bool = False) -> dict:
+    """
+    从视频中提取音频, 不输出 ffmpeg 日志
+
+    源音频编码与目标格式兼容时直接复制音频流 (-c:a copy), 否则转码
+
+    :param video_path: 视频文件地址 xxx/video.mp4
+
+    :param audio_path: 音频文件地址, 默认为 video_path 所在目录的 audio.{audio_format}
+
+    :param audio_format: 目标格式, 见 AUDIO_FORMATS
+
+    :param cover: 当文件存在时是否覆盖, 默认为 False
+
+    :return: 任务结果, 包含 video_path, audio_path, ok, copy, duration, wall_time, rtf, error
+    """
+    fmt, copy_codecs, codec = AUDIO_FORMATS[audio_format]
+    if audio_path is None:
+        audio_path = os.path.join(os.path.dirname(video_path), f'audio.{audio_format}')
+
+    result = {'video_path': video_path, 'audio_path': audio_path, 'ok': False, 'copy': False,
+              'duration': 0, 'wall_time': 0, 'rtf': 0, 'error': None}
+
+    if os.path.exists(audio_path) and not cover:
+        result['ok'] = True
+        return result
+
+    start = time.perf_counter()
+    info = probe_audio(video_path)
+    if info is None:
+        result['error'] = '无法读取音频流'
+        return result
+
+    result['duration'] = info['duration']
+    result['copy'] = info['codec'] in copy_codecs
+    # 先写入临时文件, 转换成功后重命名, 转换失败不会留下不完整的音频, 下次不会被当作已完成而跳过
+    part_path = audio_path + m3u8.PART_SUFFIX
+    try:
+        (ffmpeg.input(video_path)
+               .output(part_path, format=fmt, vn=None, acodec='copy' if result['copy'] else codec)
+               .run(quiet=True, overwrite_output=True))
+        os.replace(part_path, audio_path)
+        result['ok'] = True
+    except ffmpeg.Error as e:
+        result['error'] = e.stderr.decode('utf-8', errors='ignore') if e.stderr else str(e)
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+    result['wall_time'] = time.perf_counter() - start
+    if result['wall_time'] > 0:
+        result['rtf'] = result['duration'] / result['wall_time']
+
+    return result
+
+
+def batch_extract_audio(video_paths: Iterable[str], audio_format: str = 'wav', workers: Optional[int] = None,
+                        cover: bool = False, verbose: bool = True) -> Iterator[dict]:
+    """
+    并发提取音频, 同时运行 workers 个 ffmpeg 任务, 按完成顺序返回结果
+
+    实时率 rtf = 音频时长 / 耗时, 结束时打印总体实时率
+
+    :param video_paths: 视频文件地址
+
+    :param audio_format: 目标格式, 见 AUDIO_FORMATS
+
+    :param workers: 并发的 ffmpeg 任务数, 默认为 cpu 核数
+
+    :param cover: 当文件存在时是否覆盖, 默认为 False
+
+    :param verbose: 是否打印每个任务与总体的实时率
+
+    :return: extract_audio 的结果迭代器, 只有 ffmpeg 转换失败时 ok 为 False, 其他错误 (如未安装 ffmpeg) 直接抛出
+    """
+    if audio_format not in AUDIO_FORMATS:
+        raise ValueError(f'不支持的音频格式 {audio_format}, 应为 {tuple(AUDIO_FORMATS)} 之一')
+    for program in ('ffmpeg', 'ffprobe'):
+        if shutil.which(program) is None:
+            raise RuntimeError(f'提取音频需要 {program}, 请先安装 ffmpeg')
+
+    start = time.perf_counter()
+    total_duration, num_jobs = 0, 0
+    jobs = imap_unordered(lambda path: extract_audio(path, None, audio_format, cover), video_paths, workers)
+    for video_path, future in jobs:
+        # extract_audio 已经处理 ffmpeg 转换失败, 其他异常 (如未安装 ffmpeg) 直接抛出
+        result = future.result()
+        num_jobs += 1
+        total_duration += result['duration']
+        if verbose:
+            if result['ok']:
+                print(f'[{num_jobs}] {video_path} {"复制" if result["copy"] else "转码"} '
+                      f'{result["duration"]:.1f}s 耗时 {result["wall_time"]:.2f}s rtf {result["rtf"]:.1f}x')
+            else:
+                print(f'[{num_jobs}] {video_path} 转换失败: {result["error"]}')
+
+        yield result
+
+    elapsed = time.perf_counter() - start
+    if verbose and num_jobs:
+        print(f'共 {num_jobs} 个任务, 音频总时长 {total_duration:.1f}s, 耗时 {elapsed:.2f}s, '
+              f'总体 rtf {total_duration / max(elapsed, 1e-9):.1f}x')
@@ -1,26 +1,88 @@
 import os
-from typing import Union
+import gzip
+from typing import Callable, Iterator, Optional, Union
+from contextlib import contextmanager
 from multiprocessing import Lock as ProcessLock
 from threading import Lock as ThreadLock
 
+try:
+    import fcntl
+except ImportError:
+    # windows 下没有 fcntl, 不加文件锁
+    fcntl = None
+
+
+# 追加写入的日志文件名
+TAIL_FILE_NAME = 'download_urls'
+
+# 压缩后的快照文件名, 按行排序去重, 可以是 gzip 压缩的
+SNAPSHOT_FILE_NAME = 'download_urls.snapshot'
+GZIP_SNAPSHOT_FILE_NAME = SNAPSHOT_FILE_NAME + '.gz'
+
+
+@contextmanager
+def file_lock(path: str):
+    """
+    对日志文件加排他锁, 多个进程追加写入与压缩时互斥
+    """
+    with open(path, 'a', encoding='utf-8') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield f
+        finally:
+            # 解锁前写入缓冲区, 否则其他进程拿到锁后读不到刚写入的内容
+            f.flush()
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def snapshot_paths(dir_path: str) -> list:
+    """
+    文件夹下存在的快照文件
+    """
+    paths = [os.path.join(dir_path, name) for name in (SNAPSHOT_FILE_NAME, GZIP_SNAPSHOT_FILE_NAME)]
+    return [path for path in paths if os.path.exists(path)]
+
+
+def iter_urls(dir_path: str) -> Iterator[str]:
+    """
+    依次流式读取快照与追加日志中的 url, 可能包含重复
+
+    :param dir_path: 文件夹路径
+    """
+    for path in snapshot_paths(dir_path) + [os.path.join(dir_path, TAIL_FILE_NAME)]:
+        if not os.path.exists(path):
+            continue
+
+        opener = gzip.open if path.endswith('.gz') else open
+        try:
+            f = opener(path, 'rt', encoding='utf-8')
+        except FileNotFoundError:
+            # 其他进程正在压缩, 旧格式的快照已被删除
+            continue
+
+        with f:
+            for line in f:
+                url = line.strip()
+                if url:
+                    yield url
+
 
 class UrlSet:
     def __init__(self, dir_path: str):
         """
         以一个文件夹的所有子文件夹名作为 url 集合
 
+        url 保存在快照 download_urls.snapshot(.gz) 与追加日志 download_urls 中, 使用 compact 合并
+
         :param dir_path: 文件夹路径
         """
-        self.save_path = os.path.join(dir_path, 'download_urls')
-        self.urls = set()
-
-        if not os.path.exists(self.save_path):
-            with open(self.save_path, 'w', encoding='utf-8'):
-                pass
-        else:
-            with open(self.save_path, 'r', encoding='utf-8') as f:
-                for sub_dir in f.readlines():
-                    self.urls.add(sub_dir.strip())
+        self.dir_path = dir_path
+        self.save_path = os.path.join(dir_path, TAIL_FILE_NAME)
+        # 读取时持有文件锁, 避免读到其他进程 compact 到一半的快照与日志, 追加日志不存在时会被创建
+        with file_lock(self.save_path):
+            self.urls = set(iter_urls(dir_path))
 
         self.process_lock = ProcessLock()
         self.thread_lock = ThreadLock()
@@ -30,7 +92,7 @@ class UrlSet:
             url = str(url).strip()
             if url not in self.urls:
                 self.urls.add(url)
-                with open(self.save_path, 'a', encoding='utf-8') as f:
+                with file_lock(self.save_path) as f:
                     f.write(url + '\n')
 
     def __contains__(self, url: str):
@@ -44,4 +106,54 @@ class UrlSet:
         return iter(self.urls)
 
     def __str__(self):
-        return str(self.urls)
\ No newline at end of file
+        return str(self.urls)
+
+
+def compact(dir_path: str, compress: bool = False, keep: Optional[Callable[[str], bool]] = None) -> dict:
+    """
+    将快照与追加日志合并为排序去重的新快照, 并清空追加日志
+
+    压缩期间持有追加日志的文件锁, 其他进程的 UrlSet.add 会等待压缩完成, 不会丢失记录
+
+    :param dir_path: 文件夹路径
+
+    :param compress: 是否使用 gzip 压缩快照
+
+    :param keep: 过滤函数, 返回 False 的 url 会被删除, 为 None 时保留所有 url
+
+    :return: 压缩前的行数与字节数, 压缩后的 url 数与字节数
+    """
+    tail_path = os.path.join(dir_path, TAIL_FILE_NAME)
+    snapshot_path = os.path.join(dir_path, GZIP_SNAPSHOT_FILE_NAME if compress else SNAPSHOT_FILE_NAME)
+    part_path = snapshot_path + '.part'
+
+    with file_lock(tail_path) as tail:
+        old_paths = snapshot_paths(dir_path) + [tail_path]
+        old_bytes = sum(os.path.getsize(path) for path in old_paths)
+        num_lines, urls = 0, set()
+        for url in iter_urls(dir_path):
+            num_lines += 1
+            urls.add(url)
+        if keep is not None:
+            urls = {url for url in urls if keep(url)}
+
+        opener = gzip.open if compress else open
+        with opener(part_path, 'wt', encoding='utf-8') as f:
+            for url in sorted(urls):
+                f.write(url + '\n')
+        with open(part_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(part_path, snapshot_path)
+
+        # 删除另一种格式的旧快照, 再清空追加日志
+        for path in snapshot_paths(dir_path):
+            if path != snapshot_path:
+                os.remove(path)
+        tail.truncate(0)
+
+    return {
+        'num_lines': num_lines,
+        'old_bytes': old_bytes,
+        'num_urls': len(urls),
+        'new_bytes': os.path.getsize(snapshot_path),
+    }
@@ -0,0 +1,180 @@
+import os
+import shutil
+import struct
+from typing import Iterable, Iterator, Optional, Tuple
+
+import ffmpeg
+
+import m3u8
+from m3u8 import TS_PACKET_SIZE, TS_SYNC_BYTE
+from parallel import imap_unordered
+
+
+# 检查 TS 同步字节时, 在文件头, 中间, 尾部各读取的包数量
+TS_SAMPLE_PACKETS = 64
+
+# 校验模式
+# fast: 只检查 MP4 box 结构或 TS 同步字节, 不启动 ffmpeg
+# probe: 使用 ffmpeg.probe 检查, 与 m3u8.video_is_ok 相同
+# deep: 使用 ffmpeg 解码整个视频流
+MODES = ('fast', 'probe', 'deep')
+
+# 各校验模式依赖的程序
+REQUIRED_PROGRAMS = {'probe': 'ffprobe', 'deep': 'ffmpeg'}
+
+
+def is_ts_file(video_path: str) -> bool:
+    """
+    根据前两个包的同步字节判断文件是否为 TS 流
+
+    m3u8 下载的视频虽然保存为 video.mp4, 实际为拼接的 TS 流
+    """
+    with open(video_path, 'rb') as f:
+        head = f.read(TS_PACKET_SIZE + 1)
+
+    return len(head) > TS_PACKET_SIZE and head[0] == TS_SYNC_BYTE and head[TS_PACKET_SIZE] == TS_SYNC_BYTE
+
+
+def check_ts_sync(video_path: str) -> bool:
+    """
+    检查 TS 文件的同步字节
+
+    文件大小应为 188 的整数倍, 且在文件头, 中间, 尾部采样的包都以 0x47 开头
+    """
+    size = os.path.getsize(video_path)
+    if size == 0 or size % TS_PACKET_SIZE != 0:
+        return False
+
+    num_packets = size // TS_PACKET_SIZE
+    starts = {0, max(0, num_packets // 2 - TS_SAMPLE_PACKETS // 2), max(0, num_packets - TS_SAMPLE_PACKETS)}
+    with open(video_path, 'rb') as f:
+        for start in starts:
+            f.seek(start * TS_PACKET_SIZE)
+            data = f.read(TS_SAMPLE_PACKETS * TS_PACKET_SIZE)
+            if any(data[i] != TS_SYNC_BYTE for i in range(0, len(data), TS_PACKET_SIZE)):
+                return False
+
+    return True
+
+
+def check_mp4_boxes(video_path: str) -> bool:
+    """
+    检查 MP4 文件顶层 box 的结构
+
+    所有顶层 box 的大小之和应恰好等于文件大小, 且包含 ftyp, moov, mdat
+    """
+    size = os.path.getsize(video_path)
+    box_types = set()
+    offset = 0
+    with open(video_path, 'rb') as f:
+        while offset < size:
+            f.seek(offset)
+            header = f.read(8)
+            if len(header) < 8:
+                return False
+
+            box_size, box_type = struct.unpack('>I4s', header)
+            if box_size == 1:
+                large = f.read(8)
+                if len(large) < 8:
+                    return False
+                box_size = struct.unpack('>Q', large)[0]
+            elif box_size == 0:
+                box_size = size - offset
+
+            if box_size < 8:
+                return False
+
+            box_types.add(box_type)
+            offset += box_size
+
+    return offset == size and {b'ftyp', b'moov', b'mdat'} <= box_types
+
+
+def structural_check(video_path: str) -> bool:
+    """
+    快速结构检查, 不解码视频
+
+    :param video_path: 视频文件地址
+
+    :return: True or False
+    """
+    if not os.path.isfile(video_path):
+        return False
+
+    try:
+        if is_ts_file(video_path):
+            return check_ts_sync(video_path)
+        return check_mp4_boxes(video_path)
+    except OSError:
+        return False
+
+
+def deep_check(video_path: str) -> bool:
+    """
+    使用 ffmpeg 解码整个视频流, 出现任何解码错误都视为损坏
+
+    :param video_path: 视频文件地址
+
+    :return: True or False
+    """
+    if not os.path.isfile(video_path):
+        return False
+
+    try:
+        _, stderr = (ffmpeg.input(video_path)['v:0']
+                     .output('-', format='null')
+                     .global_args('-v', 'error')
+                     .run(capture_stdout=True, capture_stderr=True))
+    except ffmpeg.Error:
+        return False
+
+    return not stderr.strip()
+
+
+def check_video(video_path: str, mode: str = 'probe') -> bool:
+    """
+    按给定模式检查视频是否正常
+
+    :param video_path: 视频文件地址
+
+    :param mode: 校验模式, fast / probe / deep
+
+    :return: True or False
+    """
+    if mode == 'fast':
+        return structural_check(video_path)
+    elif mode == 'probe':
+        return m3u8.video_is_ok(video_path)
+    elif mode == 'deep':
+        return deep_check(video_path)
+
+    raise ValueError(f'未知的校验模式 {mode}, 应为 {MODES} 之一')
+
+
+def iter_check_videos(video_paths: Iterable[str], mode: str = 'probe',
+                      workers: Optional[int] = None) -> Iterator[Tuple[str, bool]]:
+    """
+    并发检查视频, 按完成顺序返回结果
+
+    :param video_paths: 视频文件地址
+
+    :param mode: 校验模式, fast / probe / deep
+
+    :param workers: 并发数, 默认为 cpu 核数
+
+    :return: (视频地址, 是否正常) 的迭代器
+    """
+    if mode not in MODES:
+        raise ValueError(f'未知的校验模式 {mode}, 应为 {MODES} 之一')
+    # 缺少 ffprobe / ffmpeg 时每个视频都会检查失败, 不能当作视频损坏
+    program = REQUIRED_PROGRAMS.get(mode)
+    if program is not None and shutil.which(program) is None:
+        raise RuntimeError(f'{mode} 模式需要 {program}, 请先安装 ffmpeg 或使用 fast 模式')
+
+    for video_path, future in imap_unordered(lambda path: check_video(path, mode), video_paths, workers):
+        try:
+            yield video_path, future.result()
+        except Exception as e:
+            print(f'检查 {video_path} 出错: {e}')
+            yield video_path, False
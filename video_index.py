@@ -0,0 +1,166 @@
+import os
+import sqlite3
+from typing import Optional, Tuple
+
+import ffmpeg
+
+
+# 索引文件名, 保存在被索引的文件夹下
+INDEX_FILE_NAME = 'video_index.db'
+
+
+class VideoIndex:
+    def __init__(self, dir_path: str):
+        """
+        以 sqlite 保存一个文件夹下所有视频子文件夹的信息
+
+        每个子文件夹对应一行, 记录大小, 文件数量, 时长, 编码, 是否损坏, 是否已 OCR / 转音频, 以及修改时间
+
+        :param dir_path: 文件夹路径, 如 setting.WANGYI_VIDEO_PATH
+        """
+        self.dir_path = os.path.abspath(dir_path)
+        self.db_path = os.path.join(self.dir_path, INDEX_FILE_NAME)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS videos ('
+                          'name TEXT PRIMARY KEY, '
+                          'mtime REAL, '
+                          'size INTEGER, '
+                          'num_files INTEGER, '
+                          'duration REAL, '
+                          'codec TEXT, '
+                          'is_ok INTEGER, '
+                          'has_ocr INTEGER, '
+                          'has_audio INTEGER)')
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    @staticmethod
+    def lookup(path: str) -> Optional['VideoIndex']:
+        """
+        查找 path 的索引, 只有 path 为建立了索引的文件夹本身时才使用索引
+
+        不会更新索引, 读取的结果为上一次 update 时的统计, 需要最新结果时先调用 update (check.py 的 index 命令)
+
+        :param path: 文件夹路径
+
+        :return: 索引对象, 不存在时返回 None
+        """
+        if not os.path.isdir(path) or not os.path.exists(os.path.join(path, INDEX_FILE_NAME)):
+            return None
+
+        return VideoIndex(path)
+
+    def update(self, verbose: bool = True) -> int:
+        """
+        增量更新索引
+
+        只有修改时间发生变化的子文件夹才会重新统计, 已删除的子文件夹会从索引中移除
+
+        :param verbose: 是否打印更新进度
+
+        :return: 重新统计的子文件夹数量
+        """
+        indexed = dict(self.conn.execute('SELECT name, mtime FROM videos'))
+        seen, updated, unchecked = set(), 0, 0
+
+        with os.scandir(self.dir_path) as it:
+            for entry in it:
+                if not entry.is_dir():
+                    continue
+
+                seen.add(entry.name)
+                mtime = _dir_mtime(entry.path)
+                if indexed.get(entry.name) == mtime:
+                    continue
+
+                row = _scan_video_dir(entry.path)
+                # 无法检查视频时 (如未安装 ffprobe) 不记录修改时间, 下次更新时重新统计
+                if row[4] is None:
+                    mtime = None
+                    unchecked += 1
+                self.conn.execute('INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                  (entry.name, mtime, *row))
+                updated += 1
+                if verbose and updated % 100 == 0:
+                    print(f'已更新 {updated} 个视频文件夹')
+                    self.conn.commit()
+
+        removed = [(name, ) for name in indexed if name not in seen]
+        self.conn.executemany('DELETE FROM videos WHERE name = ?', removed)
+        self.conn.commit()
+
+        if verbose:
+            print(f'索引 {self.db_path} 更新 {updated} 个, 删除 {len(removed)} 个')
+        if verbose and unchecked:
+            print(f'{unchecked} 个视频无法检查 (ffprobe 是否已安装), 时长与是否损坏未记录, 下次更新时重新检查')
+
+        return updated
+
+    def duration(self) -> float:
+        """
+        :return: 所有子文件夹中视频的总时长, 单位(s), 不包含文件夹下直接存放的文件
+        """
+        return self.conn.execute('SELECT COALESCE(SUM(duration), 0) FROM videos').fetchone()[0]
+
+    def size(self) -> Tuple[int, int]:
+        """
+        :return: 所有子文件夹的总大小(字节) 与 文件数量, 不包含文件夹下直接存放的文件
+        """
+        return self.conn.execute('SELECT COALESCE(SUM(size), 0), COALESCE(SUM(num_files), 0) FROM videos').fetchone()
+
+    def num_files(self) -> int:
+        return self.size()[1]
+
+
+def _dir_mtime(dir_path: str) -> float:
+    """
+    子文件夹的修改时间, 取文件夹本身与 video.mp4 修改时间的最大值
+
+    文件夹的 mtime 只在增删文件时变化, 因此需要额外检查 video.mp4
+    """
+    mtime = os.stat(dir_path).st_mtime
+    video_path = os.path.join(dir_path, 'video.mp4')
+    if os.path.exists(video_path):
+        mtime = max(mtime, os.stat(video_path).st_mtime)
+
+    return mtime
+
+
+def _scan_video_dir(dir_path: str) -> tuple:
+    """
+    统计一个视频子文件夹
+
+    :return: 大小, 文件数量, 时长, 编码, 是否正常, 是否有字幕, 是否有音频, 无法检查视频时是否正常为 None
+    """
+    size, num_files = 0, 0
+    for root, _, files in os.walk(dir_path):
+        for file in files:
+            size += os.path.getsize(os.path.join(root, file))
+            num_files += 1
+
+    duration, codec, is_ok = 0, None, 0
+    video_path = os.path.join(dir_path, 'video.mp4')
+    if os.path.exists(video_path):
+        try:
+            probe = ffmpeg.probe(video_path)
+            stream = probe['streams'][0]
+            duration = float(probe['format'].get('duration', 0))
+            codec = stream.get('codec_name', None)
+            is_ok = int(stream['codec_type'] == 'video')
+        except (ffmpeg.Error, KeyError, IndexError, ValueError):
+            pass
+        except OSError:
+            is_ok = None
+
+    has_ocr = int(os.path.exists(os.path.join(dir_path, 'subtitle.srt')))
+    has_audio = int(os.path.exists(os.path.join(dir_path, 'audio.wav')))
+
+    return size, num_files, duration, codec, is_ok, has_ocr, has_audio
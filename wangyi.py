@@ -7,9 +7,13 @@ from concurrent.futures import ThreadPoolExecutor as Pool
 import traceback
 
 import m3u8
+import metrics
 import delay
+import engine
+import priority
 import setting
 from url import UrlSet
+from parallel import prefetch
 
 
 TAB_TYPES = ['vlog', 'game', 'funny', 'music', 'redian', 'foodie', 'travel', 'movies', 'sports',
@@ -42,6 +46,18 @@ def parse_wy_api_response(data: str) -> List[dict]:
     return json.loads(data)['data']['item']
 
 
+def get_tab_videos(tab_type: str, size: int = 20) -> List[dict]:
+    """
+    请求一个频道的视频列表
+
+    :param tab_type: 频道类型
+
+    :param size: 返回数据量大小
+    """
+    url = make_wy_api_url(tab_type, USER_IDS, size=size)
+    return parse_wy_api_response(m3u8.request_text(url, timeout=50, stream=True))
+
+
 def download_wangyi_video(data: dict, delay_min: int = 2, delay_max: int = 5):
     """
     下载网易视频
@@ -52,13 +68,47 @@ def download_wangyi_video(data: dict, delay_min: int = 2, delay_max: int = 5):
 
     if vid in video_urls:
         print(f'{title} 视频已下载')
-        return
+        return False
 
     print(f'开始下载 {title} {vid}')
-    m3u8.download_video(video_url, os.path.join(setting.WANGYI_VIDEO_PATH, vid), _video_info=data, cover=True)
+    with metrics.span('video', site='wangyi', id=vid):
+        m3u8.download_video(video_url, os.path.join(setting.WANGYI_VIDEO_PATH, vid), _video_info=data, cover=True)
     video_urls.add(vid)
     delay.random_delay(delay_min, delay_max)
     print(f'{title} 视频下载完成')
+    return True
+
+
+class WangyiSite(engine.Site):
+    name = 'wangyi'
+
+    host = 'v.163.com'
+
+    def __init__(self, num_page: int = 30, size: int = 30):
+        self.num_page = num_page
+        self.size = size
+
+    def discover(self):
+        for i in range(self.num_page):
+            random.shuffle(TAB_TYPES)
+            for tab_type, datas in prefetch(lambda _tab_type: get_tab_videos(_tab_type, self.size), list(TAB_TYPES),
+                                            setting.PREFETCH_PAGES):
+                for data in datas:
+                    if data['vid'] not in video_urls:
+                        yield tab_type, data
+
+    def download(self, task: tuple) -> bool:
+        return download_wangyi_video(task[1], 1, 2)
+
+    def task_key(self, task: tuple) -> str:
+        return task[1]['vid']
+
+    def task_meta(self, task: tuple) -> dict:
+        tab_type, data = task
+        meta = priority.find_meta(data)
+        meta.update(priority.find_meta(data.get('video_data') or {}))
+        meta['category'] = tab_type
+        return meta
 
 
 def main():
@@ -67,11 +117,10 @@ def main():
 
         for i in range(num_page):
             random.shuffle(TAB_TYPES)  # 随机打乱TAB_TYPES列表
-            for tab_type in TAB_TYPES:
-                url = make_wy_api_url(tab_type, USER_IDS, size=size)
-                text = m3u8.request_text(url, timeout=50, stream=True)
-                datas = parse_wy_api_response(text)
-
+            # 下载当前频道时, 在后台请求后续频道的列表
+            pages = prefetch(lambda _tab_type: get_tab_videos(_tab_type, size), list(TAB_TYPES),
+                             setting.PREFETCH_PAGES)
+            for tab_type, datas in pages:
                 try:
                     for data in datas:
                         download_wangyi_video(data, 1, 2)
@@ -5,12 +5,15 @@ import atexit
 import time
 from typing import List
 import traceback
-import requests
 
 import m3u8
+import metrics
 import delay
+import engine
+import priority
 import setting
 from url import UrlSet
+from parallel import prefetch, CompletionTracker, finish_future
 
 
 video_urls = UrlSet(setting.WANGYI_LIVE_VIDEO_PATH)
@@ -32,49 +35,120 @@ def parse_wy_live_api_response(data: str) -> List[dict]:
     return json.loads(data)["live_review"]
 
 
+def get_live_page(index: int) -> List[dict]:
+    """
+    请求一页直播列表
+
+    :param index: 直播列表索引
+    """
+    return parse_wy_live_api_response(m3u8.request_text(make_wy_live_api_url(index), timeout=50))
+
+
 def download_wangyi_live(data: dict, delay_min: int = 0, delay_max: int = 1):
     """
-    下载网易直播
+    下载网易直播, 下载失败 (如分片重试后仍失败的 RuntimeError) 时抛出异常, 由调用者决定是否继续
     """
     room_name = data['roomName']
     room_id = str(data['roomId'])
     if 'videos' not in data:
-        return
+        return False
 
     video_url = data['videos'][0]["videoUrl"]
 
     if room_id in video_urls:
         print(f'{room_name} 直播已下载')
-        return
+        return False
 
     print(f'开始下载 {room_name} {room_id}')
 
-    try:
-        start = time.time()
-        m3u8.download_video(video_url, os.path.join(setting.WANGYI_LIVE_VIDEO_PATH, room_id), _video_info=data, cover=True)
-        video_urls.add(room_id)
-        delay.random_delay(delay_min, delay_max)
-        print(f'{room_name} 直播下载完成 耗时 {time.time() - start:.2f} 秒')
-    except requests.exceptions.ConnectionError as e:
-        print(f'{room_name} 直播下载失败 {e}')
-        traceback.print_exc()
+    start = time.time()
+    with metrics.span('video', site='wangyi_live', id=room_id):
+        m3u8.download_video(video_url, os.path.join(setting.WANGYI_LIVE_VIDEO_PATH, room_id), _video_info=data,
+                            cover=True)
+    video_urls.add(room_id)
+    delay.random_delay(delay_min, delay_max)
+    print(f'{room_name} 直播下载完成 耗时 {time.time() - start:.2f} 秒')
+    return True
 
 
-def main():
+class WangyiLiveSite(engine.Site):
+    name = 'wangyi_live'
+
+    host = 'v.163.com'
+
+    def discover(self):
+        """
+        与 main 相同, 一页直播间全部下载完成后记录该页
+        """
+        tracker = CompletionTracker(on_page_complete)
+        for i, datas in prefetch(get_live_page, undownloaded_pages(), setting.PREFETCH_PAGES,
+                                 stop=lambda _datas: not _datas):
+            if not datas:
+                break
+
+            for data in datas:
+                if 'videos' in data and str(data['roomId']) not in video_urls:
+                    yield data, tracker.expect(i)
+            tracker.close(i)
+
+    def download(self, task: tuple) -> bool:
+        return download_wangyi_live(task[0], 0, 0)
+
+    def task_key(self, task: tuple) -> str:
+        return str(task[0]['roomId'])
+
+    def done(self, task: tuple, ok: bool):
+        finish_future(task[1], ok)
+
+    def task_meta(self, task: tuple) -> dict:
+        data = task[0]
+        meta = priority.find_meta(data)
+        if data.get('videos'):
+            meta.update(priority.find_meta(data['videos'][0]))
+        return meta
+
+
+def undownloaded_pages():
+    """
+    跳过已经下载完成的直播列表页
+    """
     for i in range(1, 240):
         if str(i) in video_urls:
             print(f'第 {i} 页直播间已下载')
             continue
+        yield i
 
-        print(f'开始下载第 {i} 页直播间')
-        url = make_wy_live_api_url(i)
-        text = m3u8.request_text(url, timeout=50)
-        datas = parse_wy_live_api_response(text)
-        for data in datas:
-            download_wangyi_live(data, 0, 0)
 
-        print(f'第 {i} 页直播间下载完成')
+def on_page_complete(i: int, ok: bool):
+    """
+    一页直播间全部下载完成后记录该页
+    """
+    if ok:
         video_urls.add(str(i))
+        print(f'第 {i} 页直播间下载完成')
+    else:
+        print(f'第 {i} 页有直播下载失败')
+
+
+def main():
+    # 下载当前页时, 在后台请求后续的分页, 遇到空页时停止
+    for i, datas in prefetch(get_live_page, undownloaded_pages(), setting.PREFETCH_PAGES, stop=lambda _datas: not _datas):
+        print(f'开始下载第 {i} 页直播间')
+        if not datas:
+            print(f'第 {i} 页直播间为空, 停止下载')
+            break
+
+        # 单个直播下载失败时继续下载其余直播, 该页不记录为已完成, 下次重新检查
+        ok = True
+        for data in datas:
+            try:
+                download_wangyi_live(data, 0, 0)
+            except Exception as e:
+                print(f'{data.get("roomName")} 直播下载失败 {e}')
+                traceback.print_exc()
+                ok = False
+
+        on_page_complete(i, ok)
 
 
 if __name__ == '__main__':